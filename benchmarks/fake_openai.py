@@ -0,0 +1,107 @@
+"""Local fake of the OpenAI completion endpoints.
+
+Answers /v1/chat/completions and /v1/completions with a fixed text, word by
+word when the request asks for stream=True. Like the OpenAI API, streamed chat
+completions start with a role chunk whose content is null and end with an
+empty delta. Point the api_base field of the
+gpt or chatgpt bots to it to exercise streaming without an API key:
+
+    python benchmarks/fake_openai.py --port 8765 --delay 0.05
+    # api_base: http://127.0.0.1:8765/v1
+
+tests/test_streaming.py runs both bots against it with python -m pytest.
+"""
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TEXT = (
+    "Streaming works. This reply arrives one word at a time, so the chat shows "
+    "partial text while the completion is still being generated."
+)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Handles completion requests"""
+
+    delay = 0.05
+    words = TEXT.split(" ")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Replies completion or streamed completion"""
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        chat = self.path.endswith("/chat/completions")
+        choices = int(request.get("n", 1))
+        if request.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            kind = "chat.completion.chunk" if chat else "text_completion"
+            if chat:
+                self.send_event({"object": kind, "choices": [
+                    {"index": index, "delta": {"role": "assistant", "content": None},
+                     "finish_reason": None}
+                    for index in range(choices)
+                ]})
+            for position, word in enumerate(self.words):
+                chunk = word if position == 0 else " " + word
+                self.send_event({
+                    "object": kind,
+                    "choices": [
+                        self.choice(index, chunk, chat, stream=True) for index in range(choices)
+                    ],
+                })
+                time.sleep(self.delay)
+            self.send_event({"object": kind, "choices": [
+                {"index": index, "delta": {}, "finish_reason": "stop"} if chat
+                else {"index": index, "text": "", "finish_reason": "stop"}
+                for index in range(choices)
+            ]})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            return
+        body = json.dumps({
+            "object": "chat.completion" if chat else "text_completion",
+            "choices": [self.choice(index, TEXT, chat) for index in range(choices)],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0,
+                      "total_tokens": len(self.words)},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def choice(index, text, chat, stream=False):
+        """Builds a choice in the format of the endpoint"""
+        if not chat:
+            return {"index": index, "text": text, "finish_reason": None}
+        if stream:
+            return {"index": index, "delta": {"content": text}, "finish_reason": None}
+        return {"index": index, "message": {"role": "assistant", "content": text},
+                "finish_reason": None}
+
+    def send_event(self, data):
+        """Writes server-sent event"""
+        self.wfile.write(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+
+def main():
+    """Starts fake server"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.05,
+                        help="seconds between streamed words")
+    args = parser.parse_args()
+    FakeOpenAIHandler.delay = args.delay
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), FakeOpenAIHandler)
+    print(f"Fake OpenAI endpoint on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
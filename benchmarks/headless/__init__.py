@@ -0,0 +1 @@
+"""Headless benchmarks of the kernel side of the chat"""
@@ -0,0 +1,45 @@
+"""Replays chat workloads through KernelComm without a kernel or browser.
+
+Reports throughput, p50/p95/p99 latency and outbound bytes of each scenario.
+Results are written as json and can be compared with a previous run.
+
+Usage: python -m benchmarks.headless [-s SCENARIO ...] [-n REQUESTS]
+                                     [-o results.json] [-c baseline.json]
+"""
+import argparse
+import json
+
+from .runner import compare, format_result, run_scenario
+from .scenarios import SCENARIOS
+
+
+def main():
+    """Runs scenarios and writes results"""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.headless")
+    parser.add_argument("-s", "--scenario", action="append", choices=list(SCENARIOS),
+                        help="scenario to run (default: all)")
+    parser.add_argument("-n", "--requests", type=int, default=200,
+                        help="timed requests per scenario")
+    parser.add_argument("-w", "--warmup", type=int, default=10,
+                        help="untimed requests per scenario")
+    parser.add_argument("-o", "--output", help="json file for results")
+    parser.add_argument("-c", "--compare", help="json file of a previous run")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.scenario or SCENARIOS:
+        results[name] = run_scenario(name, args.requests, args.warmup)
+        print(format_result(name, results[name]))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fil:
+            json.dump(results, fil, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as fil:
+            baseline = json.load(fil)
+        print(f"Compared to {args.compare}:")
+        print("\n".join(compare(results, baseline)))
+
+
+if __name__ == "__main__":
+    main()
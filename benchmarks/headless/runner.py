@@ -0,0 +1,77 @@
+"""Times scenarios and compares results"""
+import contextlib
+import io
+import math
+import time
+
+from .scenarios import SCENARIOS
+from .stubs import create_comm
+
+METRICS = ("throughput", "p50", "p95", "p99", "bytes_per_request")
+
+
+def percentile(values, percent):
+    """Returns nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    return values[max(math.ceil(len(values) * percent / 100) - 1, 0)]
+
+
+def run_scenario(name, count=200, warmup=10):
+    """Replays scenario and returns its throughput, latency (ms) and outbound traffic"""
+    scenario = SCENARIOS[name]()
+    # Newton prints build messages of subject handlers
+    with contextlib.redirect_stdout(io.StringIO()):
+        comm = create_comm()
+        scenario.setup(comm)
+        for data, buffers in scenario.requests(comm, warmup):
+            comm.receive({"content": {"data": data}, "buffers": buffers})
+
+        stub = comm.comm
+        frames, sent = stub.frames, stub.bytes
+        latencies = []
+        start = time.perf_counter()
+        for data, buffers in scenario.requests(comm, count):
+            request_start = time.perf_counter()
+            comm.receive({"content": {"data": data}, "buffers": buffers})
+            latencies.append((time.perf_counter() - request_start) * 1000)
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    requests = len(latencies)
+    return {
+        "requests": requests,
+        "seconds": elapsed,
+        "throughput": requests / elapsed if elapsed else 0.0,
+        "mean": sum(latencies) / requests if requests else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "frames": stub.frames - frames,
+        "bytes": stub.bytes - sent,
+        "bytes_per_request": (stub.bytes - sent) / requests if requests else 0.0,
+    }
+
+
+def compare(results, baseline):
+    """Returns lines with the relative change of each metric against baseline"""
+    lines = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        changes = []
+        for metric in METRICS:
+            before = baseline[name].get(metric)
+            if not before:
+                continue
+            changes.append(f"{metric} {(result[metric] - before) / before:+.1%}")
+        lines.append(f"{name:>12}: " + ", ".join(changes))
+    return lines
+
+
+def format_result(name, result):
+    """Returns summary line of scenario result"""
+    return (f"{name:>12}: {result['throughput']:8.1f} req/s, "
+            f"p50 {result['p50']:7.2f}ms, p95 {result['p95']:7.2f}ms, "
+            f"p99 {result['p99']:7.2f}ms, {result['bytes_per_request']:9.0f} B/req "
+            f"({result['frames']} frames)")
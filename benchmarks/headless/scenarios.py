@@ -0,0 +1,152 @@
+"""Workloads replayed through KernelComm.receive.
+
+Each scenario prepares the comm in setup and yields (data, buffers) requests,
+as the frontend would send them. Requests are generated lazily, so they can
+depend on the replies to the previous requests (e.g., load the last save)"""
+import uuid
+
+from .stubs import receive
+
+MESSAGES = [
+    "hello",
+    "help",
+    "what can you do?",
+    "thanks",
+]
+
+COMMANDS = [
+    "tokenize text from df",
+    "transform case to lower case of text from df",
+    "transform cases to upper case of column title from df",
+    "filter tokens with more than 3 characters text from df",
+    "filter tokens between 2 and 8 characters text from df",
+    "select dataframe df",
+]
+
+SEARCHES = [
+    "random forest",
+    "logistic regression",
+    "decision tree classifier",
+    "cross validation",
+    "linear regression",
+    "support vector machine",
+]
+
+COMPLETIONS = ["random forest", "classification", "tokenize"]
+
+
+def message(text, instance="base"):
+    """Returns message operation with user message"""
+    return {
+        "operation": "message",
+        "instance": instance,
+        "message": {
+            "id": str(uuid.uuid4()),
+            "text": text,
+            "type": "user",
+            "timestamp": 0,
+            "reply": None,
+            "display": 0,
+            "kernelProcess": 1,
+            "kernelDisplay": 0,
+            "feedback": {"rate": 0, "reason": "", "otherreason": ""},
+            "loading": False,
+            "alternatives": [],
+            "selectedAlt": -1,
+            "inConversationContext": False,
+        }
+    }
+
+
+class Scenario:
+    """Replays requests from texts in a loop"""
+    texts = MESSAGES
+
+    def setup(self, comm):
+        """Prepares comm before timing"""
+
+    def requests(self, comm, count):
+        """Yields count (data, buffers) requests"""
+        # pylint: disable=unused-argument
+        for index in range(count):
+            yield message(self.texts[index % len(self.texts)]), None
+
+
+class PlainScenario(Scenario):
+    """Plain Newton messages that fall through every solver"""
+    texts = MESSAGES
+
+
+class CommandScenario(Scenario):
+    """Preprocessing commands routed by RegexHandler"""
+    texts = COMMANDS
+
+
+class SearchScenario(Scenario):
+    """Subject searches answered by SubjectHandler"""
+    texts = SEARCHES
+
+
+class AutocompleteScenario(Scenario):
+    """Autocomplete bursts, one query per typed character"""
+
+    def requests(self, comm, count):
+        index = 0
+        while index < count:
+            text = COMPLETIONS[index % len(COMPLETIONS)]
+            for size in range(1, len(text) + 1):
+                if index >= count:
+                    break
+                yield {
+                    "operation": "autocomplete-query",
+                    "instance": "base",
+                    "requestId": index,
+                    "query": text[:size],
+                }, None
+                index += 1
+
+
+class ReplicationScenario(Scenario):
+    """Base messages replicated to other Newton and dummy instances"""
+    texts = MESSAGES + COMMANDS
+    instances = {"newton1": "newton", "newton2": "newton", "dummy1": "dummy", "dummy2": "dummy"}
+
+    def setup(self, comm):
+        for name, mode in self.instances.items():
+            receive(comm, {
+                "operation": "new-instance",
+                "instance": "<meta>",
+                "name": name,
+                "mode": mode,
+            })
+
+
+class SaveLoadScenario(Scenario):
+    """Full saves followed by loads of the saved snapshot"""
+    history = 200
+
+    def setup(self, comm):
+        for index in range(self.history):
+            receive(comm, message(MESSAGES[index % len(MESSAGES)]))
+
+    def requests(self, comm, count):
+        for index in range(count):
+            if index % 2 == 0:
+                yield {"operation": "save-instances", "instance": "<meta>", "full": True}, None
+                continue
+            data, buffers = comm.comm.last
+            yield {
+                "operation": "load-instances",
+                "instance": "<meta>",
+                "data": data.get("data"),
+            }, buffers
+
+
+SCENARIOS = {
+    "plain": PlainScenario,
+    "commands": CommandScenario,
+    "search": SearchScenario,
+    "autocomplete": AutocompleteScenario,
+    "replication": ReplicationScenario,
+    "save-load": SaveLoadScenario,
+}
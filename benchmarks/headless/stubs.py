@@ -0,0 +1,76 @@
+"""Stub Comm and IPython shell for driving KernelComm without a kernel"""
+import json
+
+from newtonchat.comm.kernelcomm import KernelComm
+
+
+class StubComm:
+    """Records frames sent by KernelComm instead of sending them to a client"""
+
+    def __init__(self, target_name=None, **kwargs):
+        # pylint: disable=unused-argument
+        self.target_name = target_name
+        self.callback = None
+        self.frames = 0
+        self.bytes = 0
+        self.last = None
+
+    def on_msg(self, callback):
+        """Stores receive callback"""
+        self.callback = callback
+
+    def send(self, data=None, buffers=None):
+        """Counts outbound frame and its json size"""
+        self.frames += 1
+        self.bytes += len(json.dumps(data, separators=(',', ':'), default=str))
+        for buffer in buffers or ():
+            self.bytes += memoryview(buffer).nbytes
+        self.last = (data, buffers)
+
+
+class StubHistoryManager:
+    """Serves executed inputs like IPython HistoryManager.get_range"""
+
+    def __init__(self):
+        self.inputs = []
+
+    def get_range(self, session=0, start=1, stop=None, raw=True, output=False):
+        """Returns (session, line, input) for inputs in [start, stop)"""
+        # pylint: disable=unused-argument, too-many-arguments
+        stop = stop or len(self.inputs) + 1
+        for lineno in range(max(start, 1), min(stop, len(self.inputs) + 1)):
+            yield (session, lineno, self.inputs[lineno - 1])
+
+
+class StubShell:
+    """Minimal IPython shell used by KernelComm and Newton states"""
+
+    def __init__(self, user_ns=None):
+        self.user_ns = user_ns or {}
+        self.history_manager = StubHistoryManager()
+
+    def run_line_magic(self, magic_name, line):
+        """Ignores magics"""
+        # pylint: disable=unused-argument, no-self-use
+        return None
+
+    def run_cell(self, source):
+        """Records source as an executed input"""
+        self.history_manager.inputs.append(source)
+
+
+class HeadlessKernelComm(KernelComm):
+    """KernelComm that sends frames to a StubComm"""
+    comm_class = StubComm
+
+
+def create_comm(mode="newton", user_ns=None):
+    """Creates and registers KernelComm with stub comm and shell"""
+    comm = HeadlessKernelComm(StubShell(user_ns), mode)
+    comm.register()
+    return comm
+
+
+def receive(comm, data):
+    """Sends request data to KernelComm as the frontend would"""
+    comm.receive({"content": {"data": data}})
@@ -0,0 +1,66 @@
+"""Measures the memory used by chat messages.
+
+Compares the ChatMessage objects created by MessageContext.create_message
+with the IChatMessage dicts it used to create.
+
+Usage: python benchmarks/message_memory.py [count]
+"""
+import sys
+import tracemalloc
+import uuid
+from datetime import datetime
+
+from newtonchat.comm.message import KernelProcess, MessageContext, MessageDisplay
+
+
+def create_dict_message(text, type_, reply=None):
+    """Creates a message with the previous dict layout"""
+    return {
+        "id": str(uuid.uuid4()),
+        "text": text,
+        "type": type_,
+        "timestamp": int(datetime.timestamp(datetime.now())*1000),
+        "reply": reply,
+        "display": MessageDisplay.DEFAULT,
+        "kernelProcess": KernelProcess.PREVENT,
+        "kernelDisplay": MessageDisplay.DEFAULT,
+        "feedback": {
+            "rate": 0,
+            "reason": "",
+            "otherreason": "",
+        },
+        "loading": False,
+        "alternatives": [],
+        "selectedAlt": -1,
+        "inConversationContext": False,
+    }
+
+
+def measure(factory, count):
+    """Returns the number of bytes allocated by count messages"""
+    texts = [f"message {index}" for index in range(count)]
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    history = [factory(text, "bot") for text in texts]
+    end = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del history
+    return end - start
+
+
+def main():
+    """Prints memory per message and total memory for each representation"""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    results = {
+        "dict": measure(create_dict_message, count),
+        "ChatMessage": measure(MessageContext.create_message, count),
+    }
+    for name, total in results.items():
+        print(f"{name:>12}: {total / count:8.1f} B/message, {total / 2**20:8.2f} MiB total")
+    saved = results["dict"] - results["ChatMessage"]
+    print(f"{'saved':>12}: {saved / count:8.1f} B/message, {saved / 2**20:8.2f} MiB total "
+          f"({saved / results['dict']:.0%}) for {count} messages")
+
+
+if __name__ == "__main__":
+    main()
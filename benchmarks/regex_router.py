@@ -0,0 +1,123 @@
+"""Measures RegexRouter against a linear re.search scan.
+
+Builds the rules of regexes.json followed by synthetic command rules and
+routes matching and non-matching texts with both strategies. Checks that
+both select the same rule and extract the same params.
+
+Usage: python benchmarks/regex_router.py [rules] [texts]
+"""
+import json
+import random
+import re
+import sys
+import time
+
+from newtonchat.bots.newton.handlers.router import RegexRouter
+from newtonchat.bots.newton.resources import data
+
+VERBS = "filter transform select plot train evaluate split encode scale drop".split()
+NOUNS = "tokens case column rows model metric chart feature target outlier".split()
+
+
+def create_rules(count, seed=0):
+    """Returns rules of regexes.json followed by synthetic rules"""
+    rng = random.Random(seed)
+    with open(data() / "regexes.json", "r", encoding="utf-8") as fil:
+        rules = [rule for rule in json.load(fil) if "regex" in rule]
+    while len(rules) < count:
+        index = len(rules)
+        verb, noun = rng.choice(VERBS), rng.choice(NOUNS)
+        kind = index % 10
+        if index % 50 == 0:
+            regex = rf"(?i)(\w+) {noun}{index}$"
+        elif kind == 0:
+            regex = rf"(\w+) {noun}{index}$"
+        elif kind < 5:
+            regex = rf"{verb} {noun} {index} ?(.*)"
+        else:
+            regex = rf"{verb} (\d+) {noun}s? (?:of|from) set{index} ?(.+)?"
+        rules.append({"regex": regex, "params": [1], "state": f"synthetic?state{index}"})
+    return rules
+
+
+def create_texts(rules, count, seed=1):
+    """Returns texts that match random rules and texts that match none"""
+    rng = random.Random(seed)
+    texts = []
+    for index in range(count):
+        if index % 4 == 0:
+            texts.append(f"what does {rng.choice(NOUNS)} mean in {rng.choice(VERBS)}?")
+            continue
+        position = rng.randrange(len(rules))
+        verb, noun = rng.choice(VERBS), rng.choice(NOUNS)
+        texts.append(rng.choice([
+            f"{verb} {noun} {position} from df",
+            f"{verb} 5 {noun}s of set{position} df",
+            f"go {noun}{position}",
+            "filter tokens with more than 3 characters text from df",
+            "tokenize text from df",
+        ]))
+    return texts
+
+
+def linear(rules, text):
+    """Returns first matching rule and params with the previous linear scan"""
+    for rule in rules:
+        matches = re.search(rule["regex"], text)
+        if matches:
+            return rule["state"], [matches.group(param) for param in rule["params"]]
+    return None
+
+
+def compiled(patterns, rules, text):
+    """Returns first matching rule and params scanning precompiled patterns"""
+    for pattern, rule in zip(patterns, rules):
+        matches = pattern.search(text)
+        if matches:
+            return rule["state"], [matches.group(param) for param in rule["params"]]
+    return None
+
+
+def routed(router, text):
+    """Returns first matching rule and params with RegexRouter"""
+    result = router.match(text)
+    if result is None:
+        return None
+    rule, matches = result
+    return rule["state"], [matches.group(param) for param in rule["params"]]
+
+
+def timed(function, *args):
+    """Returns the result of function and the elapsed seconds"""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    """Prints routing time of each strategy"""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    text_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    rules = create_rules(count)
+    texts = create_texts(rules, text_count)
+    router, build_time = timed(RegexRouter, rules)
+    print(f"{len(rules)} rules ({len(router.always)} without literal), "
+          f"{len(texts)} texts, router built in {build_time * 1000:.1f}ms")
+
+    expected, linear_time = timed(lambda: [linear(rules, text) for text in texts])
+    patterns = [re.compile(rule["regex"]) for rule in rules]
+    result, compiled_time = timed(lambda: [compiled(patterns, rules, text) for text in texts])
+    assert result == expected, "compiled scan does not preserve first-match semantics"
+    result, routed_time = timed(lambda: [routed(router, text) for text in texts])
+    assert result == expected, "router does not preserve first-match semantics"
+    candidates = sum(len(router.candidates(text)) for text in texts) / len(texts)
+    matched = sum(1 for item in expected if item is not None)
+    print(f"{matched} texts matched a rule, {candidates:.1f} candidate rules per text")
+    print(f"  linear: {linear_time / len(texts) * 1e6:8.1f}us per text")
+    print(f"compiled: {compiled_time / len(texts) * 1e6:8.1f}us per text")
+    print(f"  router: {routed_time / len(texts) * 1e6:8.1f}us per text "
+          f"({linear_time / routed_time:.0f}x linear, {compiled_time / routed_time:.1f}x compiled)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Measures snapshot codecs on a synthetic save_instances snapshot.
+
+Builds a snapshot with a base instance and ChatGPT instances that receive
+every base message, with alternatives and ####metadata#: blobs. Reports the
+encoded size, encode and decode times, and the time to open the snapshot
+without decoding instances. Checks that every codec round-trips the data.
+
+Usage: python benchmarks/snapshot_codec.py [messages]
+"""
+import json
+import random
+import sys
+import time
+import uuid
+
+from newtonchat.comm.message import MessageContext
+from newtonchat.comm.snapshot import SNAPSHOT_CODECS, Snapshot
+
+WORDS = (
+    "data frame column model fit predict tokenize filter transform case train "
+    "test split accuracy random forest classifier regression plot histogram"
+).split()
+
+
+def sentence(rng, size):
+    """Returns random sentence"""
+    return " ".join(rng.choice(WORDS) for _ in range(size))
+
+
+def create_snapshot(count, instances=4, seed=0):
+    """Returns snapshot data with count messages in total"""
+    rng = random.Random(seed)
+    per_instance = count // instances
+    base = []
+    for _ in range(per_instance):
+        message = MessageContext.create_message(sentence(rng, 12), "user").to_dict()
+        message["kernelProcess"] = 1
+        base.append(message)
+    data = {
+        "instances": {
+            "base": {"name": "base", "mode": "newton", "bot": {}, "config": {}, "history": base},
+        },
+        "!!dead_instances": [],
+        "!!sessions_history": ["   1: import pandas as pd\n"],
+    }
+    for index in range(1, instances):
+        history = []
+        for message in base[:per_instance // 2]:
+            user = {**message, "id": str(uuid.uuid4()), "inConversationContext": True}
+            meta = json.dumps({"tokens": rng.randint(100, 3000), "context": ["0", "1|0"],
+                               "context_window": 0})
+            alternatives = [
+                f"####markdown#:\n{sentence(rng, 60)}\n####metadata#:{meta}" for _ in range(2)
+            ]
+            reply = MessageContext.create_message(alternatives, "bot", user["id"]).to_dict()
+            history.extend([user, reply])
+        data["instances"][f"gpt{index}"] = {
+            "name": f"gpt{index}",
+            "mode": "chatgpt",
+            "bot": {"config": {"model": "gpt-3.5-turbo"}, "prompt": sentence(rng, 30)},
+            "config": {"process_base_chat_message": True},
+            "history": history,
+        }
+    return data
+
+
+def timed(function, *args):
+    """Returns the result of function and the elapsed seconds"""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    """Prints size and times of each codec"""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    data = create_snapshot(count)
+    total = sum(len(instance["history"]) for instance in data["instances"].values())
+    print(f"{total} messages in {len(data['instances'])} instances")
+    reference = None
+    for name, codec_class in SNAPSHOT_CODECS.items():
+        codec = codec_class()
+        raw, encode_time = timed(codec.encode, data)
+        snapshot, open_time = timed(Snapshot.from_bytes, raw)
+        decoded, decode_time = timed(snapshot.to_data)
+        assert decoded == data, f"{name} does not round-trip"
+        reference = reference or len(raw)
+        print(f"{name:>8}: {len(raw) / 2**20:7.2f} MiB ({len(raw) / reference:6.1%}), "
+              f"encode {encode_time:6.3f}s, open {open_time:6.3f}s, "
+              f"decode {open_time + decode_time:6.3f}s")
+
+
+if __name__ == "__main__":
+    main()
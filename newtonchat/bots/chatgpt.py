@@ -9,6 +9,7 @@ from typing import TYPE_CHECKING
 import openai
 
 from ..comm.message import MessageContext
+from .streaming import StreamingReply, estimate_tokens
 
 if TYPE_CHECKING:
     from ..comm.chat_instance import ChatInstance
@@ -23,6 +24,9 @@ class ChatGPTBot:
         self.model_config = {}
         self.rules_to_be_followed = ""
         self.context_window = 0
+        self.stream = True
+        self.stream_interval = 0.25
+        self.api_base = ""
 
     @classmethod
     def config(cls):
@@ -41,6 +45,9 @@ class ChatGPTBot:
             "frequency_penalty": ('range', {"value": 0, "min": 0, "max": 2, "step": 0.01}),
             "presence_penalty": ('range', {"value": 0, "min": 0, "max": 2, "step": 0.01}),
             "n": ('range', {"value": 1, "min": 1, "max": 20, "step": 1}),
+            "stream": ('checkbox', {"value": True}),
+            "stream_interval": ('range', {"value": 0.25, "min": 0, "max": 2, "step": 0.05}),
+            "api_base": ('text', {"value": ""}),
             "api_key": ("file", {"value": ""}),
         }
 
@@ -56,6 +63,9 @@ class ChatGPTBot:
             "frequency_penalty": self.model_config['frequency_penalty'],
             "presence_penalty": self.model_config['presence_penalty'],
             "n": self.model_config['n'],
+            "stream": self.stream,
+            "stream_interval": self.stream_interval,
+            "api_base": self.api_base,
             "api_key": self.api_key,
         }
 
@@ -77,21 +87,18 @@ class ChatGPTBot:
             self._set_config(original, data, 'frequency_penalty', float)
             self._set_config(original, data, 'presence_penalty', float)
             self._set_config(original, data, 'n', int)
+            self.stream = bool(data.get("stream", self.stream))
+            self.stream_interval = float(data.get("stream_interval", self.stream_interval))
+            self.api_base = (data.get("api_base", self.api_base) or "").strip()
 
             instance.config["enable_autocomplete"] = False
 
             if start:
-                instance.history.append(MessageContext.create_message(
+                prompt = instance.append_history(MessageContext.create_message(
                     self.prompt, "system", in_conversation_context=True
                 ))
-
-                response_messages = self.get_response_messages(instance)
-
-                instance.history.append(MessageContext.create_message(
-                    response_messages,
-                    "bot",
-                    in_conversation_context=True
-                ))
+                # The bot worker answers the prompt without blocking the kernel
+                instance.schedule_message(MessageContext(instance.comm_ref(), instance, prompt))
 
         except Exception:  # pylint: disable=broad-exception-caught
             instance.reply_message(MessageContext.create_message(traceback.format_exc(), "error"))
@@ -99,13 +106,15 @@ class ChatGPTBot:
     def refresh(self, instance: ChatInstance):
         """Refresh chatbot"""
         # pylint: disable=no-self-use
-        instance.sync_chat("refresh")
 
-    def process_message(self, context: MessageContext) -> None:
-        """Processes user messages"""
+    async def process_message(self, context: MessageContext) -> None:
+        """Processes user messages without blocking the kernel"""
         # pylint: disable=unused-argument
         try:
-            response_messages = self.get_response_messages(context.instance)
+            if self.stream:
+                response_messages = await self.astream_response_messages(context)
+            else:
+                response_messages = await self.aget_response_messages(context.instance)
             context.reply(
                 response_messages,
                 in_conversation_context=True
@@ -130,6 +139,9 @@ class ChatGPTBot:
             "prompt": self.prompt,
             "rules_to_be_followed": self.rules_to_be_followed,
             "context_window": self.context_window,
+            "stream": self.stream,
+            "stream_interval": self.stream_interval,
+            "api_base": self.api_base,
             "!form": {
                 "api_key": ("file", {"value": ""})
             }
@@ -142,6 +154,9 @@ class ChatGPTBot:
         self.prompt = data.get("prompt", self.prompt)
         self.rules_to_be_followed = data.get("rules_to_be_followed", self.rules_to_be_followed)
         self.context_window = data.get("context_window", self.context_window)
+        self.stream = data.get("stream", self.stream)
+        self.stream_interval = data.get("stream_interval", self.stream_interval)
+        self.api_base = data.get("api_base", self.api_base)
         if form := data.get("!form", None):
             self.api_key = form.get("api_key", "").strip()
 
@@ -151,11 +166,8 @@ class ChatGPTBot:
         # pylint: disable=no-self-use
         return message.split('####metadata#:')[0].replace('####markdown#:\n', '')
 
-    def get_response_messages(self, instance):
-        """Send conversation context to ChatGPT and returns response messages"""
-        # pylint: disable=broad-exception-raised
-        openai.api_key = self.api_key
-
+    def get_conversation_context(self, instance):
+        """Returns conversation context and the history positions it uses"""
         conversation_context = []
         conversation_context_ids = []
         for pos, message in enumerate(instance.history):
@@ -185,17 +197,68 @@ class ChatGPTBot:
                         "content": content
                     }
                 )
-        response = openai.ChatCompletion.create(
+        return conversation_context, conversation_context_ids
+
+    async def aget_response_messages(self, instance):
+        """Send conversation context to ChatGPT asynchronously and returns response messages"""
+        conversation_context, conversation_context_ids = self.get_conversation_context(instance)
+        response = await openai.ChatCompletion.acreate(
             messages=conversation_context[self.context_window:],
+            api_key=self.api_key,
+            api_base=self.api_base or None,
+            **self.model_config
+        )
+        return self.parse_response(response, conversation_context_ids)
+
+    async def astream_response_messages(self, context: MessageContext):
+        """Streams ChatGPT response into the reply placeholder and returns response messages"""
+        # pylint: disable=broad-exception-raised
+        conversation_context, conversation_context_ids = self.get_conversation_context(
+            context.instance
+        )
+        messages = conversation_context[self.context_window:]
+        streaming = StreamingReply(context, self.stream_interval, "####markdown#:\n{}")
+        response = await openai.ChatCompletion.acreate(
+            messages=messages,
+            stream=True,
+            api_key=self.api_key,
+            api_base=self.api_base or None,
             **self.model_config
         )
+        usage = None
+        async for chunk in response:
+            for choice in chunk["choices"]:
+                streaming.push(choice["delta"].get("content") or "", choice.get("index", 0))
+            usage = chunk.get("usage") or usage
+        if not streaming.texts:
+            raise Exception("GPT API returned no choices")
+        if usage:
+            total_tokens_used = usage["total_tokens"]
+        else:
+            total_tokens_used = estimate_tokens(
+                *(message["content"] for message in messages), *streaming.texts
+            )
+        return self.build_response_messages(
+            streaming.texts, total_tokens_used, conversation_context_ids
+        )
 
+    def parse_response(self, response, conversation_context_ids):
+        """Extracts response messages from ChatGPT response"""
+        # pylint: disable=broad-exception-raised
         if response.get("choices") is None or len(response["choices"]) == 0:
             raise Exception("GPT API returned no choices")
 
-        response_messages = []
+        contents = [
+            getattr(getattr(response_choice, "message"), "content")
+            for response_choice in response["choices"]
+        ]
+        return self.build_response_messages(
+            contents, response["usage"]["total_tokens"], conversation_context_ids
+        )
 
-        total_tokens_used = response["usage"]["total_tokens"]
+    def build_response_messages(self, contents, total_tokens_used, conversation_context_ids):
+        """Formats response contents with metadata and updates the context window"""
+        response_messages = []
 
         if total_tokens_used > 3000:
             self.context_window += 1
@@ -206,9 +269,8 @@ class ChatGPTBot:
             "context_window": self.context_window 
         })
 
-        for response_choice in response["choices"]:
-            message = getattr(response_choice, "message")
-            content = getattr(message, "content").strip()
+        for content in contents:
+            content = content.strip()
 
             response_messages.append(
                 f"####markdown#:\n{content}\n####metadata#:{meta_json}")
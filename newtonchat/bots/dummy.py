@@ -30,7 +30,7 @@ class DummyBot:
         self.format_str = data.get("format_str", self.format_str)
         if not start:
             return
-        instance.history.append(MessageContext.create_message(
+        instance.append_history(MessageContext.create_message(
             f"Hello, I am a dummy bot that repeats messages using the template {self.format_str}",
             "bot"
         ))
@@ -39,7 +39,6 @@ class DummyBot:
     def refresh(self, instance: ChatInstance):
         """Refresh chatbot"""
         # pylint: disable=no-self-use
-        instance.sync_chat("refresh")
 
     def process_message(self, context: MessageContext) -> None:
         """Processes user messages"""
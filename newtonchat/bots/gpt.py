@@ -7,6 +7,7 @@ from typing import TYPE_CHECKING
 import openai
 
 from ..comm.message import MessageContext
+from .streaming import StreamingReply
 
 if TYPE_CHECKING:
     from ..comm.chat_instance import ChatInstance
@@ -19,6 +20,9 @@ class GPTBot:
         self.prompt = "You are a chatbot that can help programming.\n\nQ: {}\nA:"
         self.api_key = ""
         self.model_config = {}
+        self.stream = True
+        self.stream_interval = 0.25
+        self.api_base = ""
 
     @classmethod
     def config(cls):
@@ -104,6 +108,9 @@ class GPTBot:
             "frequency_penalty": ('range', {"value": 0, "min": 0, "max": 2, "step": 0.01}), 
             "presence_penalty": ('range', {"value": 0, "min": 0, "max": 2, "step": 0.01}),
             "best_of": ('range', {"value": 1, "min": 1, "max": 20, "step": 1}),
+            "stream": ('checkbox', {"value": True}),
+            "stream_interval": ('range', {"value": 0.25, "min": 0, "max": 2, "step": 0.05}),
+            "api_base": ('text', {"value": ""}),
             "api_key": ("file", {"value": ""}),
         }
     
@@ -118,6 +125,9 @@ class GPTBot:
             "frequency_penalty": self.model_config['frequency_penalty'],
             "presence_penalty": self.model_config['presence_penalty'],
             "best_of": self.model_config['best_of'],
+            "stream": self.stream,
+            "stream_interval": self.stream_interval,
+            "api_base": self.api_base,
             "api_key": self.api_key,
         }
 
@@ -137,9 +147,12 @@ class GPTBot:
         self._set_config(original, data, 'frequency_penalty', float)
         self._set_config(original, data, 'presence_penalty', float)
         self._set_config(original, data, 'best_of', int)
+        self.stream = bool(data.get("stream", self.stream))
+        self.stream_interval = float(data.get("stream_interval", self.stream_interval))
+        self.api_base = (data.get("api_base", self.api_base) or "").strip()
 
         if start:
-            instance.history.append(MessageContext.create_message(
+            instance.append_history(MessageContext.create_message(
                 "I am a GPT bot",
                 "bot"
             ))
@@ -148,16 +161,19 @@ class GPTBot:
     def refresh(self, instance: ChatInstance):
         """Refresh chatbot"""
         # pylint: disable=no-self-use
-        instance.sync_chat("refresh")
 
-    def process_message(self, context: MessageContext) -> None:
-        """Processes user messages"""
+    async def process_message(self, context: MessageContext) -> None:
+        """Processes user messages without blocking the kernel"""
         # pylint: disable=unused-argument
         # pylint: disable=broad-exception-raised
         # pylint: disable=broad-exception-caught
-        openai.api_key = self.api_key
-        response = openai.Completion.create(
+        if self.stream and self.model_config['best_of'] == 1:
+            await self.stream_message(context)
+            return
+        response = await openai.Completion.acreate(
           prompt=self.prompt.format(context.text),
+          api_key=self.api_key,
+          api_base=self.api_base or None,
           **self.model_config
         )
         try:
@@ -170,6 +186,28 @@ class GPTBot:
         except Exception:
             context.reply(traceback.format_exc(), "error")
 
+    async def stream_message(self, context: MessageContext) -> None:
+        """Streams completion into the reply placeholder"""
+        # pylint: disable=broad-exception-raised
+        # pylint: disable=broad-exception-caught
+        streaming = StreamingReply(context, self.stream_interval)
+        response = await openai.Completion.acreate(
+          prompt=self.prompt.format(context.text),
+          stream=True,
+          api_key=self.api_key,
+          api_base=self.api_base or None,
+          **self.model_config
+        )
+        try:
+            async for chunk in response:
+                for choice in chunk["choices"]:
+                    streaming.push(choice.get("text") or "", choice.get("index", 0))
+            if not streaming.texts:
+                raise Exception("GPT API returned no choices")
+            context.reply(streaming.texts[0].strip())
+        except Exception:
+            context.reply(traceback.format_exc(), "error")
+
     def process_autocomplete(self, instance: ChatInstance, request_id: int, query: str):
         """Processes user autocomplete query"""
         # pylint: disable=unused-argument
@@ -185,6 +223,9 @@ class GPTBot:
         return {
             "config": self.model_config,
             "prompt": self.prompt,
+            "stream": self.stream,
+            "stream_interval": self.stream_interval,
+            "api_base": self.api_base,
             "!form": {
                 "api_key": ("file", {"value": ""})
             }
@@ -195,5 +236,8 @@ class GPTBot:
         if "config" in data:
             self.model_config = {**self.model_config, **data["config"]}
         self.prompt = data.get("prompt", self.prompt)
+        self.stream = data.get("stream", self.stream)
+        self.stream_interval = data.get("stream_interval", self.stream_interval)
+        self.api_base = data.get("api_base", self.api_base)
         if form := data.get("!form", None):
             self.api_key = form.get("api_key", "").strip()
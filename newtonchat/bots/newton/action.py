@@ -2,19 +2,83 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 
-from .states.utils import statemanager
+import json
+
+from ...comm.checkpoints import checkpoint_string
 
 
 if TYPE_CHECKING:
     from typing import List, Optional
     from ...comm.message import MessageContext, IOptionItem
-    from .states.state import StateCallable
+    from .states.state import StateCallable, StateDefinition
 
     class StatefulOption(IOptionItem, total=False):
         """Defines an Option for a list of options"""
         state: Optional[StateCallable]
 
 
+class OptionSelector:
+    """State for option selection.
+    The first option whose position, key or label matches the reply is selected.
+    Option states can be state strings"""
+    __slots__ = ('options', 'keys', 'labels')
+
+    def __init__(self, options: List[StatefulOption]):
+        self.options = options
+        self.keys: dict[str, int] = {}
+        self.labels: dict[str, int] = {}
+        for pos, option in enumerate(options):
+            self.keys.setdefault(option['key'], pos)
+            self.labels.setdefault(option['label'].lower(), pos)
+
+    def __repr__(self) -> str:
+        return f"OptionSelector({len(self.options)} options)"
+
+    @property
+    def checkpoint_state(self) -> str:
+        """Returns state string that can be stored instead of the checkpoint.
+        Option states that cannot be stored as state strings are stored as !forgotten"""
+        return "!options " + json.dumps([
+            [
+                option['key'],
+                option['label'],
+                None if (state := option.get('state')) is None
+                else checkpoint_string(state) or "!forgotten",
+            ]
+            for option in self.options
+        ])
+
+    @classmethod
+    def from_checkpoint_state(cls, data: str) -> OptionSelector:
+        """Creates selector from the json list of a !options state string"""
+        return cls([
+            {'key': key, 'label': label, 'state': state}
+            for key, label, state in json.loads(data)
+        ])
+
+    def select(self, text: str) -> int | None:
+        """Returns the position of the selected option"""
+        if text and text[0].isdigit() and ('.' in text or text.isdigit()):
+            pos = int(text.split('.')[0])
+            if pos <= len(self.options):
+                return pos - 1
+        matches = [
+            pos for pos in (self.keys.get(text), self.labels.get(text.lower()))
+            if pos is not None
+        ]
+        return min(matches) if matches else None
+
+    def __call__(self, context: MessageContext) -> StateDefinition:
+        pos = self.select(context.text)
+        if pos is None:
+            return False
+        state = self.options[pos].get('state', None)
+        if isinstance(state, str):
+            return state
+        result = state(context) if state else None
+        return False if result is None else result
+
+
 def show_options(
     context: MessageContext,
     options: List[StatefulOption],
@@ -22,20 +86,4 @@ def show_options(
     text: str | None = None
 ) -> None:
     """Shows options that redirect to states"""
-    @statemanager(False)
-    def select_option(context: MessageContext):
-        """State for option selection"""
-        no_state = lambda _: None
-
-        text = context.text
-        if text and text[0].isdigit() and ('.' in text or text.isdigit()):
-            pos = int(text.split('.')[0])
-            if pos <= len(options):
-                state = options[pos - 1].get('state', None) or no_state
-                return state(context)
-
-        for option in options:
-            if option['key'] == text or option['label'].lower() == text.lower():
-                state = option.get('state', None) or no_state
-                return state(context)
-    context.reply_options(options, ordered=ordered, checkpoint=select_option, text=text)
+    context.reply_options(options, ordered=ordered, checkpoint=OptionSelector(options), text=text)
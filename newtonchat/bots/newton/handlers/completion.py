@@ -0,0 +1,117 @@
+"""Provides a prefix index for subject autocomplete"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import re
+
+
+if TYPE_CHECKING:
+    from typing import Any, Iterable, List
+    from .graph import SubjectGraph
+
+
+WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """Returns lowercase text with collapsed whitespace"""
+    return " ".join(text.lower().split())
+
+
+def truncate(text: str, size: int) -> str:
+    """Truncates text to size characters"""
+    if len(text) <= size:
+        return text
+    return text[:size - 1].rstrip() + "…"
+
+
+class CompletionIndex:
+    """Trie of subject names, key segments, keywords and their words.
+    Each node stores the best limit documents for its prefix, so lookups
+    walk the query once and return a precomputed list"""
+
+    name_weight = 10
+    keyword_weight = 7
+    key_weight = 5
+    word_factor = 0.5
+
+    def __init__(self, graph: SubjectGraph, limit: int = 20, description_size: int = 120):
+        self.limit = limit
+        self.items: List[dict[str, Any]] = []
+        self.words: List[frozenset[str]] = []
+        self.root: list[Any] = [{}, {}]
+        for key, node in graph.keys.items():
+            position = len(self.items)
+            self.items.append({
+                'type': 'subject',
+                'key': key,
+                'value': truncate(graph.descriptions[node] or '', description_size),
+                'url': graph.urls[node] or '',
+            })
+            keywords = graph.keywords[node] or ''
+            if isinstance(keywords, str):
+                keywords = [keywords]
+            phrases = [
+                (key.rsplit(" > ", 1)[-1], self.name_weight),
+                *((keyword, self.keyword_weight) for keyword in keywords if keyword),
+                *((segment, self.key_weight) for segment in key.split(" > ")),
+            ]
+            words = set()
+            for phrase, weight in phrases:
+                phrase = normalize(phrase)
+                self.insert(phrase, position, weight + 1 / (1 + len(key)))
+                for word in WORD.findall(phrase):
+                    words.add(word)
+                    self.insert(word, position, weight * self.word_factor)
+            self.words.append(frozenset(words))
+        self.finalize(self.root)
+
+    def insert(self, term: str, position: int, weight: float):
+        """Adds document position with weight to every prefix of term"""
+        node = self.root
+        for char in term:
+            node = node[0].setdefault(char, [{}, {}])
+            scores = node[1]
+            if scores.get(position, -1) < weight:
+                scores[position] = weight
+
+    def finalize(self, root: list[Any]):
+        """Replaces score maps with the best positions of each prefix"""
+        pending = [root]
+        while pending:
+            node = pending.pop()
+            scores = node[1]
+            node[1] = sorted(scores, key=lambda position: (-scores[position], position))[:self.limit]
+            pending.extend(node[0].values())
+
+    def lookup(self, prefix: str) -> list[int]:
+        """Returns the best positions for prefix"""
+        node = self.root
+        for char in prefix:
+            node = node[0].get(char)
+            if node is None:
+                return []
+        return node[1]
+
+    def complete(self, query: str, count: int = 5) -> Iterable[dict[str, Any]]:
+        """Yields up to count items for query.
+        Matches the whole query as a prefix of a phrase. Otherwise, matches the last
+        word as a prefix and requires the previous words in the same subject"""
+        query = normalize(query)
+        if not query:
+            return
+        positions = self.lookup(query)
+        required: list[str] = []
+        if not positions:
+            words = WORD.findall(query)
+            if not words:
+                return
+            positions = self.lookup(words[-1])
+            required = words[:-1]
+        for position in positions:
+            if count <= 0:
+                return
+            words = self.words[position]
+            if all(any(word.startswith(part) for word in words) for part in required):
+                count -= 1
+                yield self.items[position]
@@ -0,0 +1,69 @@
+"""Provides the compiled subject knowledge base"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+from array import array
+
+from ..states.utils import create_state_loader
+
+
+if TYPE_CHECKING:
+    from typing import Any, Dict, List, Optional, Tuple
+    from ..action import StatefulOption
+
+
+class SubjectGraph:
+    """Array-backed subject tree, immutable after freeze.
+    Subjects are identified by integer ids. Each id has a parent id (-1 for roots),
+    a tuple of child ids and the aliases of the subject. The keys table maps every
+    alias path (e.g., "Classifier > Preprocessing") to its subject id"""
+
+    def __init__(self):
+        self.aliases: List[Tuple[str, ...]] = []
+        self.descriptions: List[Optional[str]] = []
+        self.urls: List[Optional[str]] = []
+        self.keywords: List[Any] = []
+        self.actions: List[Tuple[Tuple[str, str], ...]] = []
+        self.parents = array('i')
+        self.children: List[Any] = []
+        self.keys: Dict[str, int] = {}
+        self._action_options: Dict[int, Tuple[StatefulOption, ...]] = {}
+
+    def add(self, subject: dict[str, Any], parent: int) -> int:
+        """Adds subject definition and returns its id"""
+        names = subject['name']
+        node = len(self.aliases)
+        self.aliases.append(tuple([names] if isinstance(names, str) else names))
+        self.descriptions.append(subject.get('description'))
+        self.urls.append(subject.get('url'))
+        self.keywords.append(subject.get('keywords', ''))
+        self.actions.append(tuple(
+            (action['name'], action['state']) for action in subject.get('actions', [])
+        ))
+        self.parents.append(parent)
+        self.children.append([])
+        if parent >= 0:
+            self.children[parent].append(node)
+        return node
+
+    def freeze(self) -> SubjectGraph:
+        """Converts child lists to tuples"""
+        self.children = [tuple(children) for children in self.children]
+        return self
+
+    def __len__(self) -> int:
+        return len(self.aliases)
+
+    def name(self, node: int) -> str:
+        """Returns the primary name of the subject"""
+        return self.aliases[node][0]
+
+    def action_options(self, node: int) -> Tuple[StatefulOption, ...]:
+        """Returns options for the actions of the subject, shared by all visits"""
+        if node not in self._action_options:
+            self._action_options[node] = tuple({
+                'key': state,
+                'label': name,
+                'state': create_state_loader(state)
+            } for name, state in self.actions[node])
+        return self._action_options[node]
@@ -4,9 +4,9 @@ from typing import TYPE_CHECKING
 
 
 import json
-import re
-from ..resources import data
+from ..resources import STATE_TABLE, data
 from ..states.utils import GoToState
+from .router import RegexRouter
 from .utils import HandlerWithPaths
 
 
@@ -21,6 +21,7 @@ class RegexHandler(HandlerWithPaths):
 
     def __init__(self):
         self.regexes = []
+        self.router = RegexRouter([])
         super().__init__()
 
     def load_file(self, filepath: Path) -> None:
@@ -39,19 +40,19 @@ class RegexHandler(HandlerWithPaths):
         self.regexes = []
         self.paths = {}
         self.load_file(data() / 'regexes.json')
+        self.router = RegexRouter(self.regexes)
+        STATE_TABLE.compile('regexes', (regex.get('state') for regex in self.regexes))
 
     def inner_process_message(self, context: MessageContext) -> StateDefinition:
         """Processes user message"""
-        text = context.text
-        for regex in self.regexes:
-            matches = re.search(regex['regex'], text)
-            if matches:
-                param_defs = regex.get('params', [])
-                params = []
-                for param in param_defs:
-                    try:
-                        params.append(matches.group(param))
-                    except IndexError:
-                        params.append(None)
-                raise GoToState(regex['state'], params)
-        return None
+        result = self.router.match(context.text)
+        if result is None:
+            return None
+        regex, matches = result
+        params = []
+        for param in regex.get('params', []):
+            try:
+                params.append(matches.group(param))
+            except IndexError:
+                params.append(None)
+        raise GoToState(regex['state'], params)
@@ -0,0 +1,99 @@
+"""Provides a prefiltered router for regex rules"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import re
+
+# The regex parser is private and may change between Python versions.
+# Patterns that it cannot parse are evaluated for every text
+try:
+    from re import _parser as sre_parse  # type: ignore
+except ImportError:
+    try:
+        import sre_parse  # type: ignore # pylint: disable=deprecated-module
+    except ImportError:
+        sre_parse = None
+
+
+if TYPE_CHECKING:
+    from typing import Any, Match, Pattern
+
+
+def required_literal(pattern: Pattern[str]) -> str:
+    """Returns the longest literal that every match of pattern contains.
+    Only literals at the top level of the pattern are considered.
+    Returns an empty literal if the pattern cannot be parsed"""
+    if pattern.flags & re.IGNORECASE or sre_parse is None:
+        return ""
+    best, current = "", []
+    try:
+        for opcode, value in sre_parse.parse(pattern.pattern, pattern.flags):
+            if opcode == sre_parse.LITERAL:
+                current.append(chr(value))
+                continue
+            if len(current) > len(best):
+                best = "".join(current)
+            current = []
+    except Exception:  # pylint: disable=broad-except
+        return ""
+    if len(current) > len(best):
+        best = "".join(current)
+    return best
+
+
+class RegexRouter:
+    """Routes texts to the first matching rule.
+    Rules are compiled once and indexed by an n-gram of their required literal.
+    Only rules whose n-gram occurs in the text are evaluated, in rule order"""
+
+    size = 3
+
+    def __init__(self, rules: list[dict[str, Any]]):
+        self.rules = rules
+        self.patterns: list[Pattern[str]] = []
+        self.literals: list[str] = []
+        self.index: dict[str, list[int]] = {}
+        self.always: list[int] = []
+        grams_by_rule = []
+        counts: dict[str, int] = {}
+        for position, rule in enumerate(rules):
+            pattern = re.compile(rule['regex'])
+            literal = required_literal(pattern)
+            grams = {
+                literal[start:start + self.size]
+                for start in range(len(literal) - self.size + 1)
+            }
+            for gram in grams:
+                counts[gram] = counts.get(gram, 0) + 1
+            if not grams:
+                self.always.append(position)
+            self.patterns.append(pattern)
+            self.literals.append(literal)
+            grams_by_rule.append(grams)
+
+        # Index each rule by its least shared n-gram
+        for position, grams in enumerate(grams_by_rule):
+            if grams:
+                gram = min(grams, key=lambda gram: (counts[gram], gram))
+                self.index.setdefault(gram, []).append(position)
+
+    def candidates(self, text: str) -> list[int]:
+        """Returns positions of rules that may match text"""
+        positions = list(self.always)
+        index = self.index
+        for gram in {text[start:start + self.size] for start in range(len(text) - self.size + 1)}:
+            if gram in index:
+                positions.extend(index[gram])
+        positions.sort()
+        return positions
+
+    def match(self, text: str) -> tuple[dict[str, Any], Match[str]] | None:
+        """Returns the first rule that matches text and its match"""
+        for position in self.candidates(text):
+            literal = self.literals[position]
+            if literal and literal not in text:
+                continue
+            matches = self.patterns[position].search(text)
+            if matches:
+                return self.rules[position], matches
+        return None
@@ -1,223 +1,435 @@
 """This module defines the subject state and the subject handler"""
 from __future__ import annotations
 from typing import TYPE_CHECKING
+import hashlib
 import json
-import uuid
+import os
+import threading
+import time
+import traceback
 
-from lunr import lunr  # type: ignore
+from lunr import lunr, __VERSION__ as lunr_version  # type: ignore
 from lunr.exceptions import QueryParseError  # type: ignore
+from lunr.index import Index  # type: ignore
 
 from ..pagination import pagination
-from ..resources import data
-from ..states.utils import create_panel_state, create_reply_state, create_state_loader
-from ..states.utils import statemanager
+from ..resources import STATE_TABLE, cache, data
+from ..states.utils import create_panel_state, create_reply_state
 from ..action import show_options
-from .utils import HandlerWithPaths
+from .completion import CompletionIndex
+from .graph import SubjectGraph
+from .utils import HandlerWithPaths, LRUCache
+from .watcher import get_watcher
 
 
 if TYPE_CHECKING:
-    from typing import List, Optional, TypedDict
+    from typing import Any, List
     from ....comm.message import MessageContext
-    from ..states.state import StateCallable, StateDefinition
+    from ..states.state import StateDefinition
     from ..action import StatefulOption
 
 
-    class Action(TypedDict, total=False):
-        """Defines an Action"""
-        name: str
-        state: str
-
-
-    class Subject(TypedDict, total=False):
-        """Defines a Subject"""
-        name: str | List[str]
-        description: Optional[str]
-        url: Optional[str]
-        parent: Optional[Subject]
-        actions: Optional[List[Action]]
-        children: Optional[List[Subject]]
-
-
-def subject_name(subject: Subject, key: str | None=None) -> str:
-    """Return subject name"""
-    if key:
-        return key.rsplit(" > ", 1)[-1]
-    name = subject['name']
-    if isinstance(name, list):
-        return name[0]
-    return name
-
-
-def create_subject_state(subject: Subject, key: str | None=None) -> StateCallable:
-    """Creates state for subject"""
-    name = subject_name(subject, key)
-    if not key:
-        key = str(uuid.uuid4())
-        parent_key = str(uuid.uuid4())
-    else:
-        parent_key = key.rsplit(" > ", 1)[0]
-    @statemanager()
-    def subject_state(context: MessageContext):
+def subject_name(key: str) -> str:
+    """Return subject name of alias path"""
+    return key.rsplit(" > ", 1)[-1]
+
+
+class SubjectState:
+    """State that shows the options of a subject.
+    Refers to the subject by id and alias path. Options are resolved when enacted"""
+    __slots__ = ('graph', 'node', 'key')
+
+    def __init__(self, graph: SubjectGraph, node: int, key: str):
+        self.graph = graph
+        self.node = node
+        self.key = key
+
+    def __repr__(self) -> str:
+        return f"SubjectState({self.key!r})"
+
+    @property
+    def checkpoint_state(self) -> str:
+        """Returns state string that can be stored instead of the checkpoint"""
+        return f"!subject {self.key}"
+
+    def __call__(self, context: MessageContext) -> StateDefinition:
+        graph, node, key = self.graph, self.node, self.key
+        name = subject_name(key)
         options: List[StatefulOption] = []
-        if 'description' in subject:
+        if graph.descriptions[node] is not None:
             options.append({
                 'key': f"{key}::description",
                 'label': 'Description',
-                'state': create_reply_state(subject['description']),
+                'state': SubjectInfoState(graph, node, key, "description"),
             })
-        if 'url' in subject:
+        if graph.urls[node] is not None:
             options.append({
                 'key': f"{key}::url",
                 'label': 'Documentation',
-                'state': create_panel_state(subject['url'], name),
+                'state': SubjectInfoState(graph, node, key, "url"),
             })
-        if subject_parent := subject.get('parent', None):
-            parent_name = subject_name(subject_parent)
+        if (parent := graph.parents[node]) >= 0:
+            parent_key = key.rsplit(" > ", 1)[0]
             options.append({
                 'key': parent_key,
-                'label': f'⬆️ {parent_name}',
-                'state': create_subject_state(subject_parent, parent_key)
+                'label': f'⬆️ {graph.name(parent)}',
+                'state': SubjectState(graph, parent, parent_key)
             })
-        if subject_actions := subject.get('actions', []):
-            actions: List[StatefulOption] = [{
-                'key': action['state'],
-                'label': action['name'],
-                'state': create_state_loader(action['state'])
-            } for action in subject_actions]
+        if graph.actions[node]:
             options.append({
                 'key': f"{key}::actions",
                 'label': 'Actions',
-                'state': create_state_list(name, actions, "action(s)")
+                'state': SubjectListState(graph, node, key, "actions")
             })
-        if subject_children := subject.get('children', []):
-            children: List[StatefulOption] = []
-            children_names = []
-            for child in subject_children:
-                child_name = subject_name(child)
-                children_names.append(child_name)
-                child_key = f"{key} > {child_name}"
-                children.append({
-                    'key': child_key,
-                    'label': child_name,
-                    'state': create_subject_state(child, child_key)
-                })
+        if children := graph.children[node]:
             options.append({
                 'key': f"{key}::children",
-                'label': f'⬇️ {", ".join(children_names)}',
-                'state': create_state_list(name, children, "child subject(s)")
+                'label': f'⬇️ {", ".join(graph.name(child) for child in children)}',
+                'state': SubjectListState(graph, node, key, "children")
             })
 
         if not options:
             context.reply(
                 f"Unfortunately, there is nothing in my knowlegde base about {name}.",
-                checkpoint=subject_state
+                checkpoint=self
             )
         else:
             show_options(context, options, text=f"What do you want to know about {name}?")
-    return subject_state
+        return True
 
 
-def create_state_list(name: str, children: List[StatefulOption], theme: str) -> StateCallable:
-    """Creates state for list of children of subject"""
-    @statemanager()
-    def children_state(context: MessageContext) -> StateDefinition:
-        text = f"{name} has {len(children)} {theme}. Please select one:"
-        pagination(context, children, text=text)
-        return None
-    return children_state
+class SubjectInfoState:
+    """State that replies the description or opens the documentation of a subject"""
+    __slots__ = ('graph', 'node', 'key', 'kind')
+
+    def __init__(self, graph: SubjectGraph, node: int, key: str, kind: str):
+        self.graph = graph
+        self.node = node
+        self.key = key
+        self.kind = kind
+
+    def __repr__(self) -> str:
+        return f"SubjectInfoState({self.key!r}, {self.kind!r})"
+
+    @property
+    def checkpoint_state(self) -> str:
+        """Returns state string that can be stored instead of the checkpoint"""
+        return f"!subject {self.key}::{self.kind}"
+
+    def __call__(self, context: MessageContext) -> StateDefinition:
+        graph, node = self.graph, self.node
+        if self.kind == "description":
+            return create_reply_state(graph.descriptions[node])(context)
+        return create_panel_state(graph.urls[node], subject_name(self.key))(context)
+
+
+class SubjectListState:
+    """State that paginates the actions or the children of a subject"""
+    __slots__ = ('graph', 'node', 'key', 'kind')
+
+    def __init__(self, graph: SubjectGraph, node: int, key: str, kind: str):
+        self.graph = graph
+        self.node = node
+        self.key = key
+        self.kind = kind
+
+    def __repr__(self) -> str:
+        return f"SubjectListState({self.key!r}, {self.kind!r})"
+
+    @property
+    def checkpoint_state(self) -> str:
+        """Returns state string that can be stored instead of the checkpoint"""
+        return f"!subject {self.key}::{self.kind}"
+
+    def __call__(self, context: MessageContext) -> StateDefinition:
+        graph, node, key = self.graph, self.node, self.key
+        if self.kind == "actions":
+            items = graph.action_options(node)
+            text = f"{subject_name(key)} has {len(items)} action(s). Please select one:"
+            pagination(context, items, text=text)
+            return True
+
+        def child_option(child: int) -> StatefulOption:
+            child_key = f"{key} > {graph.name(child)}"
+            return {
+                'key': child_key,
+                'label': graph.name(child),
+                'state': SubjectState(graph, child, child_key)
+            }
+        children = graph.children[node]
+        text = f"{subject_name(key)} has {len(children)} child subject(s). Please select one:"
+        pagination(context, children, text=text, option=child_option)
+        return True
+
+
+SUBJECT_OPTION_STATES = {
+    "description": SubjectInfoState,
+    "url": SubjectInfoState,
+    "actions": SubjectListState,
+    "children": SubjectListState,
+}
+
+INDEX_FIELDS = (
+    {'field_name': 'key', 'boost': 5},
+    {'field_name': 'name', 'boost': 10},
+    {'field_name': 'description', 'boost': 1},
+    {'field_name': 'keywords', 'boost': 7}
+)
+
+INDEX_CACHE_VERSION = 1
+
+# Cached indexes that were not used for this many seconds are removed
+INDEX_CACHE_AGE = 30 * 24 * 60 * 60
 
 
 class SubjectHandler(HandlerWithPaths):
-    """Provides functions for searching a subject"""
+    """Provides functions for searching a subject.
+    After the first load, the index is rebuilt in a background thread
+    while the previous one keeps serving queries"""
 
     def __init__(self):
-        self.docmap = {}
-        self.idx = None
+        self.index: tuple[SubjectGraph, Any, CompletionIndex] = (
+            SubjectGraph(), None, CompletionIndex(SubjectGraph())
+        )
+        self.rebuilding: threading.Thread | None = None
+        self.rebuild_error: str | None = None
+        self.search_cache = LRUCache(256)
+        self.cached_key: str | None = None
         super().__init__()
 
-    def build_document_list(self, forest):
-        """Builds document list to use lurn for searching"""
-        docmap = {}
+    @property
+    def graph(self) -> SubjectGraph:
+        """Returns subject graph of the current index"""
+        return self.index[0]
+
+    @property
+    def idx(self) -> Any:
+        """Returns lunr index of the current index"""
+        return self.index[1]
+
+    @property
+    def completion(self) -> CompletionIndex:
+        """Returns autocomplete index of the current index"""
+        return self.index[2]
+
+    def build_document_list(self, forest, paths=None):
+        """Builds subject graph and document list to use lurn for searching.
+        Each alias path of a subject becomes a document"""
+        paths = self.paths if paths is None else paths
+        graph = SubjectGraph()
         documents = []
+        # Maps id(subject) to (subject, id). Keeping the subject alive prevents
+        # merged redirect dicts from being freed and their ids reused
+        node_ids: dict[int, tuple[dict, int]] = {}
 
-        visit = [('', tree) for tree in forest]
+        visit = [('', tree, -1) for tree in reversed(forest)]
         while visit:
-            current = visit.pop()
-            if 'redirect' in current[1]:
-                filepath = data() / current[1]['redirect']
-                del current[1]['redirect']
+            prefix, subject, parent = visit.pop()
+            if 'redirect' in subject:
+                filepath = data() / subject['redirect']
+                del subject['redirect']
                 with open(filepath, 'r', encoding='utf-8') as subfile:
-                    subvisit = [(current[0], {**tree, **current[1]}) for tree in json.load(subfile)]
-                    visit = visit + subvisit
+                    subvisit = [(prefix, {**tree, **subject}, parent) for tree in json.load(subfile)]
+                    visit.extend(reversed(subvisit))
                     print(subvisit)
-                self.paths[filepath] = self.getmtime(filepath)
+                paths[filepath] = self.getmtime(filepath)
                 continue
-            names = current[1]['name']
-            if isinstance(names, str):
-                names = [names]
-            for name in names:
+            # Children of aliases are visited once per alias path
+            if (entry := node_ids.get(id(subject))) is None:
+                entry = node_ids[id(subject)] = (subject, graph.add(subject, parent))
+            node = entry[1]
+            for name in graph.aliases[node]:
                 key = name
-                if current[0]:
-                    key = current[0] + ' > ' + key
-                document = {
+                if prefix:
+                    key = prefix + ' > ' + key
+                documents.append({
                     'key': key,
                     'name': name,
-                    'description': current[1].get('description', ''),
-                    'keywords': current[1].get('keywords', ''),
-                    'node': current[1],
-                }
-                documents.append(document)
-                docmap[key] = document
-                for child in current[1].get('children', []):
-                    child['parent'] = current[1]
-                    visit.append((key, child))
-        return docmap, documents
+                    'description': graph.descriptions[node] or '',
+                    'keywords': graph.keywords[node],
+                })
+                graph.keys[key] = node
+                for child in reversed(subject.get('children', [])):
+                    visit.append((key, child, node))
+        return graph.freeze(), documents
 
-    def inner_reload(self) -> None:
-        """Reloads lunr indexes based on subjects file"""
+    def build_index(self, paths: dict) -> tuple[SubjectGraph, Any, CompletionIndex]:
+        """Builds subject graph, lunr index and autocomplete index based on subjects file.
+        Adds loaded files to paths.
+        Loads the lunr index from the user cache if the subject files did not change"""
         filepath = data() / 'subjects.json'
         with open(filepath, 'r', encoding='utf-8') as subjects:
             forest = json.load(subjects)
-        self.docmap, documents = self.build_document_list(forest)
-        self.idx = lunr(ref='key', fields=(
-            {'field_name': 'key', 'boost': 5},
-            {'field_name': 'name', 'boost': 10},
-            {'field_name': 'description', 'boost': 1},
-            {'field_name': 'keywords', 'boost': 7}
-        ), documents=documents)
-        self.paths[filepath] = self.getmtime(filepath)
+        graph, documents = self.build_document_list(forest, paths)
+        paths[filepath] = self.getmtime(filepath)
+        key = self.index_key(paths)
+        idx = self.load_cached_index(key)
+        if idx is None:
+            idx = lunr(ref='key', fields=INDEX_FIELDS, documents=documents)
+            self.store_cached_index(key, idx)
+        return graph, idx, CompletionIndex(graph)
+
+    def index_key(self, paths: dict) -> str:
+        """Returns hash of the subject files and index settings"""
+        # pylint: disable=no-self-use
+        digest = hashlib.sha256(
+            json.dumps([INDEX_CACHE_VERSION, lunr_version, INDEX_FIELDS]).encode('utf-8')
+        )
+        for filepath in sorted(paths, key=str):
+            digest.update(os.path.basename(filepath).encode('utf-8') + b'\0')
+            with open(filepath, 'rb') as fil:
+                digest.update(fil.read())
+        return digest.hexdigest()
+
+    def load_cached_index(self, key: str) -> Any:
+        """Returns cached lunr index or None.
+        Marks the cached index as recently used"""
+        directory = cache()
+        if directory is None:
+            return None
+        filepath = directory / f'subjects-{key}.json'
+        try:
+            with open(filepath, 'r', encoding='utf-8') as fil:
+                idx = Index.load(json.load(fil))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        try:
+            os.utime(filepath)
+        except OSError:
+            pass
+        self.cached_key = key
+        return idx
+
+    def store_cached_index(self, key: str, idx: Any) -> None:
+        """Writes lunr index to the user cache.
+        Removes the index previously used by this handler and the indexes that
+        were not used for INDEX_CACHE_AGE seconds. Other kernels may share the
+        cache directory with different subject files"""
+        directory = cache()
+        if directory is None:
+            return
+        filepath = directory / f'subjects-{key}.json'
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            temp = filepath.with_suffix(f'.{os.getpid()}.tmp')
+            with open(temp, 'w', encoding='utf-8') as fil:
+                json.dump(idx.serialize(), fil)
+            os.replace(temp, filepath)
+        except OSError:
+            return
+        previous, self.cached_key = self.cached_key, key
+        if previous is not None and previous != key:
+            try:
+                (directory / f'subjects-{previous}.json').unlink()
+            except OSError:
+                pass
+        limit = time.time() - INDEX_CACHE_AGE
+        for old in directory.glob('subjects-*.json'):
+            try:
+                if old != filepath and old.stat().st_mtime < limit:
+                    old.unlink()
+            except OSError:
+                pass
+
+    def inner_reload(self) -> None:
+        """Reloads lunr indexes based on subjects file"""
+        self.index = self.build_index(self.paths)
+        self.search_cache.clear()
+        self.compile_states()
+
+    def check_updates(self) -> None:
+        """Starts background rebuild if any of the monitored files has changed"""
+        if self.dirty and self.rebuilding is None:
+            self.dirty = False
+            self.rebuilding = threading.Thread(
+                target=self.rebuild, name="newton-subject-index", daemon=True
+            )
+            self.rebuilding.start()
+
+    def rebuild(self) -> None:
+        """Builds new index and swaps it with the current one.
+        Keeps the current index if the build fails"""
+        paths: dict = {}
+        try:
+            index = self.build_index(paths)
+        except Exception:  # pylint: disable=broad-except
+            self.rebuild_error = traceback.format_exc()
+            paths = {filepath: self.getmtime(filepath) for filepath in {**self.paths, **paths}}
+        else:
+            self.index = index
+            self.search_cache.clear()
+            self.compile_states()
+            self.rebuild_error = None
+        self.paths = paths
+        get_watcher().watch(self, paths)
+        self.rebuilding = None
+
+    def compile_states(self) -> None:
+        """Resolves the action states of the current subject graph"""
+        STATE_TABLE.compile('subjects', (
+            state for actions in self.graph.actions for _, state in actions
+        ))
 
     def inner_process_message(self, context: MessageContext) -> StateDefinition:
         """Processes users message"""
-        matches = list(self.search(context.text))
-        if matches:
-            text = (f"I found {len(matches)} subjects. "
-                    f"Which one of these best describe your query?")
-            pagination(context, [{
-                'key': match['ref'],
-                'label': subject_name(node['name'], match['ref']),
-                'state': create_subject_state(node, key=match['ref'])
-            } for match, node in matches], text=text)
+        graph, results = self.search_results(context.text)
+        if results:
+            text = "I found these subjects. Which one of these best describe your query?"
+            if self.rebuilding is not None:
+                text += " (The subject index is being rebuilt. Results may be outdated)"
+            # Pages slice the cached results. Options are created when their page is shown
+            pagination(context, results, text=text, option=lambda match: {
+                'key': match[0],
+                'label': subject_name(match[0]),
+                'state': SubjectState(graph, graph.keys[match[0]], match[0])
+            })
             return True
         return None
 
     def search(self, text):
-        """Searches subject based on input text"""
-        try:
-            matches = self.idx.search(text)
-        except QueryParseError:
-            matches = []
-        node_ids = set()
-        for match in matches:
-            node = self.docmap[match['ref']]['node']
-            node_id = id(node)
-            if node_id not in node_ids:
-                node_ids.add(node_id)
-                yield (match, node)
+        """Searches subject based on input text.
+        Yields ({'ref', 'score'}, subject id) pairs"""
+        graph, results = self.search_results(text)
+        for ref, score in results:
+            yield ({'ref': ref, 'score': score}, graph.keys[ref])
+
+    def search_results(self, text):
+        """Returns subject graph and (ref, score) pairs of the search.
+        Results are cached by normalized text"""
+        graph, idx, _ = self.index
+        query = " ".join(text.lower().split())
+        cached = self.search_cache.get(query)
+        # Entries of a replaced index may be added during a background swap
+        if cached is not None and cached[0] is idx:
+            results = cached[1]
+        else:
+            try:
+                matches = idx.search(query)
+            except QueryParseError:
+                matches = []
+            results = []
+            node_ids = set()
+            for match in matches:
+                node = graph.keys[match['ref']]
+                if node not in node_ids:
+                    node_ids.add(node)
+                    results.append((match['ref'], match['score']))
+            self.search_cache.put(query, (idx, results))
+        return graph, results
 
     def state_by_key(self, key) -> StateDefinition:
-        """Return subject state by key, if it exists"""
-        if key in self.docmap:
-            node = self.docmap[key]['node']
-            return create_subject_state(node, key=key)
-        return None
+        """Return subject state by key, if it exists.
+        Keys of subject options (e.g., "<key>::description") return the option state"""
+        graph = self.graph
+        subject, separator, kind = key.rpartition("::")
+        if not separator or kind not in SUBJECT_OPTION_STATES:
+            subject, kind = key, ""
+        if subject not in graph.keys:
+            return None
+        node = graph.keys[subject]
+        if not kind:
+            return SubjectState(graph, node, subject)
+        if (kind == "description" and graph.descriptions[node] is None
+                or kind == "url" and graph.urls[node] is None):
+            return None
+        return SUBJECT_OPTION_STATES[kind](graph, node, subject, kind)
@@ -3,32 +3,42 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 from abc import abstractmethod
+from collections import OrderedDict
 import os
 
+from .watcher import get_watcher
+
 
 if TYPE_CHECKING:
+    from typing import Any
     from ....comm.message import MessageContext
     from ..states.state import StateDefinition
 
 
 class HandlerWithPaths:
-    """Handle changes on loaded data files"""
+    """Handle changes on loaded data files.
+    A shared file watcher marks the handler as dirty when a loaded file changes"""
 
     def __init__(self):
         self.paths = {}
+        self.dirty = False
         self.reload()
 
     def reload(self) -> None:
         """Reloads paths"""
+        self.dirty = False
         self.paths = {}
         self.inner_reload()
+        get_watcher().watch(self, self.paths)
+
+    def mark_dirty(self) -> None:
+        """Marks handler for reloading on the next message"""
+        self.dirty = True
 
     def check_updates(self) -> None:
-        """Checks if any of the monitored files has changed"""
-        for filepath, oldtime in self.paths.items():
-            if oldtime != self.getmtime(filepath):
-                self.reload()
-                break
+        """Reloads if any of the monitored files has changed"""
+        if self.dirty:
+            self.reload()
 
     def process_message(self, context: MessageContext) -> StateDefinition:
         """Processes users message"""
@@ -50,3 +60,38 @@ class HandlerWithPaths:
     @abstractmethod
     def inner_process_message(self, context: MessageContext) -> StateDefinition:
         """Defines how to process messages for subclasses"""
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entry.
+    Counts hits and misses to help sizing it"""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.entries: OrderedDict[Any, Any] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """Returns cached value and marks it as recently used"""
+        try:
+            self.entries.move_to_end(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return self.entries[key]
+
+    def put(self, key: Any, value: Any) -> None:
+        """Stores value and evicts the oldest entries above maxsize"""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Removes all entries. Keeps counters"""
+        self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,148 @@
+"""Watches data files and notifies handlers when they change"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import json
+import os
+import threading
+import time
+import weakref
+
+try:
+    import pyinotify  # type: ignore
+except ImportError:
+    pyinotify = None
+
+
+if TYPE_CHECKING:
+    from typing import Any
+
+
+def getmtime(path: str) -> float | None:
+    """Returns the modification time of a file"""
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+class PollWatcher:
+    """Stats watched files every interval seconds in a daemon thread.
+    Each watch calls owner.mark_dirty once. Owners watch again after reloading"""
+
+    def __init__(self, interval: float = 2.0):
+        self.interval = interval
+        self.watches: weakref.WeakKeyDictionary[Any, dict[str, float | None]] = (
+            weakref.WeakKeyDictionary()
+        )
+        self.lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+
+    def watch(self, owner: Any, paths: dict[Any, float | None]) -> dict[str, float | None]:
+        """Marks owner as dirty when any of the paths differs from its recorded mtime.
+        Returns the watched absolute paths"""
+        paths = {os.path.abspath(os.fspath(path)): mtime for path, mtime in paths.items()}
+        with self.lock:
+            self.watches[owner] = paths
+        self.start()
+        return paths
+
+    def start(self):
+        """Starts polling thread"""
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.run, name="newton-file-watcher", daemon=True
+            )
+            self.thread.start()
+
+    def run(self):
+        """Polls watched files"""
+        while True:
+            time.sleep(self.interval)
+            self.poll()
+
+    def poll(self):
+        """Fires the watches whose files changed"""
+        with self.lock:
+            watches = list(self.watches.items())
+        for owner, paths in watches:
+            if any(getmtime(path) != mtime for path, mtime in paths.items()):
+                self.fire(owner)
+
+    def fire(self, owner: Any):
+        """Removes watch of owner and marks it as dirty"""
+        with self.lock:
+            if self.watches.pop(owner, None) is None:
+                return
+        owner.mark_dirty()
+
+
+class InotifyWatcher(PollWatcher):
+    """Receives file events from inotify instead of polling.
+    Watches the directories of the files, since editors often replace files on save"""
+
+    mask = (
+        0 if pyinotify is None else
+        pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM
+        | pyinotify.IN_CREATE | pyinotify.IN_DELETE | pyinotify.IN_ATTRIB
+    )
+
+    def __init__(self):
+        if pyinotify is None:
+            raise ImportError("pyinotify is not installed")
+        super().__init__()
+        self.manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.ThreadedNotifier(
+            self.manager, default_proc_fun=self.process_event
+        )
+        self.notifier.daemon = True
+        self.directories: set[str] = set()
+
+    def watch(self, owner: Any, paths: dict[Any, float | None]) -> dict[str, float | None]:
+        """Marks owner as dirty on events of the paths.
+        Also fires if a file changed before its directory was watched"""
+        paths = super().watch(owner, paths)
+        for directory in {os.path.dirname(path) for path in paths}:
+            if directory not in self.directories:
+                self.manager.add_watch(directory, self.mask)
+                self.directories.add(directory)
+        self.poll()
+        return paths
+
+    def start(self):
+        """Starts notifier thread"""
+        if self.thread is None:
+            self.thread = self.notifier
+            self.notifier.start()
+
+    def process_event(self, event):
+        """Fires the watches that contain the event path"""
+        path = os.path.abspath(event.pathname)
+        with self.lock:
+            watches = list(self.watches.items())
+        for owner, paths in watches:
+            if path in paths:
+                self.fire(owner)
+
+
+FILE_WATCHERS = {
+    "inotify": InotifyWatcher,
+    "poll": PollWatcher,
+}
+
+WATCHER: PollWatcher | None = None
+
+
+def get_watcher() -> PollWatcher:
+    """Returns the file watcher defined by the NewtonFileWatcher environment variable.
+    The variable has the format <watcher>?<json args>. E.g.: poll?{"interval": 5}.
+    Uses inotify by default and falls back to polling if pyinotify is not available"""
+    global WATCHER  # pylint: disable=global-statement
+    if WATCHER is None:
+        definition = os.environ.get("NewtonFileWatcher", "inotify").split('?', 1)
+        args = json.loads(definition[1]) if len(definition) > 1 else {}
+        try:
+            WATCHER = FILE_WATCHERS[definition[0]](**args)
+        except (ImportError, OSError):
+            WATCHER = PollWatcher()
+    return WATCHER
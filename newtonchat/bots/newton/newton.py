@@ -2,13 +2,16 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 
+import time
 import traceback
 
 from ...comm.message import MessageContext
+from .action import OptionSelector
 from .handlers.regex import RegexHandler
 from .handlers.subject import SubjectHandler
 from .handlers.url import URLHandler
-from .resources import import_state_module
+from .resources import STATE_TABLE
+from .stats import SolverStats, format_stats, profile_call
 from .states.utils import GoToState, state_checkpoint
 
 
@@ -20,6 +23,8 @@ if TYPE_CHECKING:
 
 class DefaultState:
     """Default Newton state"""
+    # State string that loads the default state
+    checkpoint_state = "!subject"
 
     def __init__(self):
         self.subject_handler = SubjectHandler()
@@ -29,11 +34,24 @@ class DefaultState:
             URLHandler(),
             self.subject_handler,
         ]
+        self.solver_stats = {
+            type(solver).__name__: SolverStats() for solver in self.solvers
+        }
 
     def process_message(self, context: MessageContext) -> StateDefinition:
         """Processes user message"""
         for solver in self.solvers:
-            result = solver.process_message(context)
+            start = time.perf_counter()
+            result = None
+            try:
+                result = solver.process_message(context)
+            except GoToState:
+                result = True
+                raise
+            finally:
+                self.solver_stats[type(solver).__name__].record(
+                    bool(result), (time.perf_counter() - start) * 1000
+                )
             if result:
                 return result
         context.reply("I could not process this query. Please, try a different query",
@@ -42,15 +60,7 @@ class DefaultState:
 
     def process_autocomplete(self, instance: ChatInstance, request_id: int, query: str):
         """Processes subject queries"""
-        result = []
-        for match, node in self.subject_handler.search(query):
-            result.append({
-                'type': 'subject',
-                'key': match['ref'],
-                'value': node.get('description', ''),
-                'url': node.get('url', ''),
-            })
-        result = result[:5]
+        result = list(self.subject_handler.completion.complete(query, 5))
         instance.send({
             "operation": "autocomplete-response",
             "responseId": request_id,
@@ -64,6 +74,7 @@ class NewtonBot:
     def __init__(self):
         self.default_state = DefaultState()
         self.state = self.default_state
+        self.profile_limit = 0
 
     @classmethod
     def config(cls):
@@ -79,7 +90,7 @@ class NewtonBot:
         # pylint: disable=unused-argument
         if not start:
             return
-        instance.history.append(MessageContext.create_message(
+        instance.append_history(MessageContext.create_message(
             ("Hello, I am Newton, an assistant that can help you with machine learning. "
              "You can ask me questions at any given time and go back to previous questions too. "
              "How can I help you?"),
@@ -121,21 +132,22 @@ class NewtonBot:
                         self.state = self.default_state
                     else:
                         self.set_state(context, subject_state(context))
+            elif new_state.startswith("!options "):
+                selector = OptionSelector.from_checkpoint_state(new_state[9:])
+                self.set_state(context, selector(context))
+            elif new_state == "!forgotten":
+                self.state = self.default_state
+                context.reply("I no longer remember the context of that message. "
+                              "Please, ask your question again",
+                              checkpoint=state_checkpoint(self.default_state))
             else:
-                module_name, state_func = new_state.split("?", 1)
-                module = import_state_module(module_name)
-                if module is None:
-                    context.reply(f"Module {module_name} not found! Back to default state",
-                                  checkpoint=state_checkpoint(self.default_state))
-                    self.state = self.default_state
-                    return
-                if not hasattr(module, state_func):
-                    context.reply(f"State function {state_func} not found in {module_name}! "
-                                  f"Back to default state",
+                function, error = STATE_TABLE.get(new_state)
+                if function is None:
+                    context.reply(f"{error} Back to default state",
                                   checkpoint=state_checkpoint(self.default_state))
                     self.state = self.default_state
                     return
-                self.set_state(context, getattr(module, state_func)(context, *params))
+                self.set_state(context, function(context, *params))
         elif callable(new_state):
             self.set_state(context, new_state(context, *params))
         elif new_state:
@@ -149,6 +161,22 @@ class NewtonBot:
         """Processes user message"""
         if control:
             text = context.text
+            if self.profile_limit and not text.startswith("!"):
+                limit, self.profile_limit = self.profile_limit, 0
+                report = profile_call(self.process_message, context, control, limit=limit)
+                context.reply(f"####markdown#:\n```\n{report}\n```",
+                              checkpoint=state_checkpoint(self.state))
+                return
+            if text == "!stats":
+                context.reply(format_stats(self.default_state, context.instance),
+                              checkpoint=state_checkpoint(self.state))
+                return
+            if text.startswith("!profile"):
+                args = text.split()[1:]
+                self.profile_limit = int(args[0]) if args and args[0].isdigit() else 20
+                context.reply("The next message will be profiled",
+                              checkpoint=state_checkpoint(self.state))
+                return
             if text == "!debug":
                 context.reply(f"Current state: {self.state!r}",
                               checkpoint=state_checkpoint(self.state))
@@ -170,7 +198,10 @@ class NewtonBot:
             if check_state := context.instance.checkpoints.get(reply, None):
                 self.set_state(context, check_state)
                 return
-            elif reply and len(history) >= 2 and reply != history[-2]['id']:
+            if reply and context.instance.checkpoints.evicted(reply):
+                self.set_state(context, "!forgotten")
+                return
+            if reply and len(history) >= 2 and reply != history[-2]['id']:
                 self.set_state(context, self.default_state)
 
         try:
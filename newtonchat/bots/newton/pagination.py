@@ -2,69 +2,127 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 
+from collections.abc import Sequence
+from itertools import islice
+
 from .action import show_options
-from .states.utils import statemanager
 
 
 if TYPE_CHECKING:
-    from typing import List, Tuple
+    from typing import Any, Callable, Iterable, Iterator, List, Optional
     from ...comm.message import MessageContext
     from .action import StatefulOption
-    from .states.state import StateCallable
-
-
-def create_page(page: int, count: int, items: List[StatefulOption], last: bool) -> StateCallable:
-    """Creates page state"""
-    @statemanager()
-    def more_state(context: MessageContext):
-        start_pos = (page - 1)*count + 1
-        end_pos = start_pos + count - 1
-        if last:
-            end_pos = start_pos + len(items)
-        show_options(
-            context, items, ordered=False,
-            text=f"Showing {start_pos}..{end_pos} (page {page})"
-        )
-    return more_state
-
-
-def _pagination(
-    options: List[StatefulOption],
-    count: int=5,
-    page: int=1
-) -> Tuple[List[StatefulOption], bool]:
-    """Splits options into pages"""
-    if len(options) <= count + 1:
-        return options, True
-    current, extra = options[:count], options[count:]
-    next_page = page + 1
-    current.append({
-        'key': f"<page {next_page}>",
-        'label': "More...",
-        'state': create_page(
-            next_page, count, *_pagination(extra, count, page=next_page)
-        )
-    })
-    return current, False
+    from .states.state import StateDefinition
+
+
+class LazySequence:
+    """Pulls items from an iterable only when a page needs them.
+    Only the items from the start of the last requested slice are kept. Earlier
+    slices are pulled again from a new iterator of the iterable. Iterators cannot
+    be restarted, so all items pulled from them are kept"""
+
+    def __init__(self, iterable: Iterable[Any]):
+        self.iterable = iterable
+        self.iterator: Optional[Iterator[Any]] = iter(iterable)
+        self.restartable = self.iterator is not iterable
+        self.offset = 0
+        self.buffer: List[Any] = []
+
+    def __getitem__(self, index: slice) -> List[Any]:
+        start, stop = index.start or 0, index.stop
+        if start < self.offset:
+            self.iterator = iter(self.iterable)
+            self.offset, self.buffer = 0, []
+        if self.restartable and start > self.offset:
+            skip = start - self.offset - len(self.buffer)
+            del self.buffer[:start - self.offset]
+            if skip > 0 and self.iterator is not None:
+                next(islice(self.iterator, skip - 1, skip), None)
+            self.offset = start
+        missing = stop - self.offset - len(self.buffer)
+        if missing > 0 and self.iterator is not None:
+            pulled = len(self.buffer)
+            self.buffer.extend(islice(self.iterator, missing))
+            if len(self.buffer) - pulled < missing:
+                self.iterator = None
+        return self.buffer[start - self.offset:stop - self.offset]
+
+
+class PageState:
+    """State that shows the page of items that starts at a cursor.
+    Options are created only for the items of the page. The last page
+    also shows the item that would be alone in the next page"""
+    __slots__ = ('items', 'start', 'count', 'create_order', 'option')
+
+    def __init__(
+        self,
+        items: Sequence[Any] | LazySequence,
+        start: int,
+        count: int,
+        create_order: bool,
+        option: Callable[[Any], StatefulOption] | None,
+    ):
+        # pylint: disable=too-many-arguments
+        self.items = items
+        self.start = start
+        self.count = count
+        self.create_order = create_order
+        self.option = option
+
+    def __repr__(self) -> str:
+        return f"PageState(start={self.start}, count={self.count})"
+
+    def page(self) -> tuple[List[StatefulOption], bool]:
+        """Returns the options of the page and whether it is the last one"""
+        start, count = self.start, self.count
+        chunk = self.items[start:start + count + 2]
+        last = len(chunk) <= count + 1
+        if not last:
+            chunk = chunk[:count]
+        options: List[StatefulOption] = []
+        for num, item in enumerate(chunk, start + 1):
+            option = self.option(item) if self.option else item
+            if self.create_order:
+                option = {
+                    'key': option['key'],
+                    'label': f'{num}. {option["label"]}',
+                    'state': option['state']
+                }
+            options.append(option)
+        if not last:
+            options.append({
+                'key': f"<page {start // count + 2}>",
+                'label': "More...",
+                'state': PageState(self.items, start + count, count, self.create_order, self.option)
+            })
+        return options, last
+
+    def __call__(self, context: MessageContext, text: str | None = None) -> StateDefinition:
+        options, last = self.page()
+        page = self.start // self.count + 1
+        shown = len(options) - (0 if last else 1)
+        status = f"Showing {self.start + 1}..{self.start + shown} (page {page})"
+        if page == 1:
+            if not last:
+                text = text + "\n" + status if text else status
+        else:
+            text = status
+        show_options(context, options, ordered=False, text=text)
+        return True
 
 
 def pagination(
     context: MessageContext,
-    items: List[StatefulOption],
+    items: Iterable[Any],
     *,
     count: int=5,
     create_order: bool=True,
-    text: str | None = None
+    text: str | None = None,
+    option: Callable[[Any], StatefulOption] | None = None
 ):
-    """Paginates options and shows first page for consistency"""
-    if create_order:
-        items = [{
-            'key': item['key'],
-            'label': f'{num + 1}. {item["label"]}',
-            'state': item['state']
-        } for num, item in enumerate(items)]
-    items, last = _pagination(items, count=count)
-    if not last:
-        text = text + "\n" if text else ""
-        text += f"Showing 1..{count} (page 1)"
-    show_options(context, items, ordered=False, text=text)
+    """Paginates options and shows first page for consistency.
+    Items can be options or, if option is given, values converted to options when
+    their page is shown. Iterables that are not sequences are consumed lazily"""
+    if not isinstance(items, Sequence):
+        items = LazySequence(items)
+    PageState(items, 0, count, create_order, option)(context, text)
@@ -1,5 +1,9 @@
 """Handle project resources"""
+from pathlib import Path
+import hashlib
 import importlib
+import os
+import sys
 
 MODULE = __name__
 MODULE = MODULE[:MODULE.rfind(".")]
@@ -14,12 +18,136 @@ def data():
     """Returns project data path"""
     return project() / 'data'
 
-def import_state_module(module_name, reload=True):
-    """Returns state module"""
+def cache():
+    """Returns user cache path or None if caching is disabled.
+    The NewtonCacheDir environment variable overrides the path. An empty value disables it"""
+    path = os.environ.get("NewtonCacheDir")
+    if path is not None:
+        return Path(path) if path else None
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~/AppData/Local")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return Path(base) / "newtonchat"
+
+def file_signature(path):
+    """Returns the mtime and md5 hash of a file"""
+    if not path:
+        return None, None
     try:
-        module = importlib.import_module(f'.bots.newton.states.{module_name}', MODULE)
-        if reload:
-            module = importlib.reload(module)
-        return module
-    except ModuleNotFoundError:
-        return None
+        mtime = os.path.getmtime(path)
+        with open(path, "rb") as fil:
+            return mtime, hashlib.md5(fil.read()).hexdigest()
+    except OSError:
+        return None, None
+
+class StateModules:
+    """Imports state modules once and reloads them only when their source changes.
+    In the "always" mode (for development), modules are reloaded on every use"""
+
+    def __init__(self, mode="changed"):
+        self.mode = mode
+        self.modules = {}
+
+    def get(self, module_name, reload=None):
+        """Returns state module or None if it does not exist.
+        reload=True forces a reload and reload=False skips the source check"""
+        try:
+            entry = self.modules.get(module_name)
+            if entry is None:
+                module = importlib.import_module(f'.bots.newton.states.{module_name}', MODULE)
+                if reload or self.mode == "always":
+                    module = importlib.reload(module)
+                self.modules[module_name] = (module, *file_signature(module.__file__))
+                return module
+            module, mtime, digest = entry
+            if reload is False:
+                return module
+            if reload or self.mode == "always":
+                module = importlib.reload(module)
+                self.modules[module_name] = (module, *file_signature(module.__file__))
+                return module
+            try:
+                new_mtime = os.path.getmtime(module.__file__)
+            except (OSError, TypeError):
+                new_mtime = None
+            if new_mtime != mtime:
+                new_mtime, new_digest = file_signature(module.__file__)
+                if new_digest != digest:
+                    module = importlib.reload(module)
+                self.modules[module_name] = (module, new_mtime, new_digest)
+            return module
+        except ModuleNotFoundError:
+            self.modules.pop(module_name, None)
+            return None
+
+STATE_MODULES = StateModules(os.environ.get("NewtonStateReload", "changed"))
+
+def import_state_module(module_name, reload=None):
+    """Returns state module. Reloads it if its source changed.
+    Set NewtonStateReload=always to reload state modules on every use"""
+    return STATE_MODULES.get(module_name, reload)
+
+class StateTable:
+    """Resolves the module?function state strings of data files when they are loaded.
+    Each source (e.g., a handler) compiles its strings on reload, replacing its previous
+    table. Compiled functions are used while their modules are not reloaded"""
+
+    def __init__(self, modules):
+        self.modules = modules
+        self.sources = {}
+        self.errors = {}
+
+    def resolve(self, state):
+        """Returns module, function and error message of a module?function string"""
+        module_name, _, function_name = state.partition("?")
+        module = self.modules.get(module_name)
+        if module is None:
+            return None, None, f"Module {module_name} not found!"
+        function = getattr(module, function_name, None)
+        if function is None:
+            return module, None, f"State function {function_name} not found in {module_name}!"
+        return module, function, None
+
+    def compile(self, source, states):
+        """Resolves state strings of source and returns the broken references.
+        The broken references are kept for !stats.
+        Ignores states that are not module?function strings"""
+        table, errors = {}, []
+        for state in states:
+            if not isinstance(state, str):
+                continue
+            if state.startswith('>'):
+                state = state[1:]
+            if state.startswith("!subject") or state in table:
+                continue
+            table[state] = self.resolve(state)
+            error = table[state][2]
+            if error:
+                errors.append(f"{state}: {error}")
+        self.sources[source] = table
+        self.errors[source] = errors
+        return errors
+
+    def get(self, state):
+        """Returns function and error message of a module?function string.
+        Resolves strings that were not compiled or whose module was reloaded"""
+        for table in list(self.sources.values()):
+            entry = table.get(state)
+            if entry is not None and entry[1] is not None:
+                if self.modules.get(state.partition("?")[0]) is entry[0]:
+                    return entry[1], None
+                break
+        _, function, error = self.resolve(state)
+        return function, error
+
+    def __len__(self):
+        return sum(len(table) for table in self.sources.values())
+
+    def broken(self):
+        """Returns the broken references of all sources"""
+        return [error for errors in self.errors.values() for error in errors]
+
+STATE_TABLE = StateTable(STATE_MODULES)
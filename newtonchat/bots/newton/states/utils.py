@@ -16,9 +16,11 @@ def statemanager(default: StateDefinition=True):
     """Wraps generator function to support waiting for user replies"""
     def inner(func: StateCallable | StateGeneratorFunc):
         """Inner decorator"""
+        is_generator = inspect.isgeneratorfunction(func)
+
         @wraps(func)
         def helper(context: MessageContext, *args, **kwargs) -> StateDefinition:
-            if inspect.isgeneratorfunction(func):
+            if is_generator:
                 gen = func(context, *args, **kwargs)
                 try:
                     next(gen)
@@ -81,16 +83,23 @@ def create_panel_state(url, title):
 
 
 def create_state_loader(state: StateDefinition):
-    """Create a state that loads a state by name when enacted"""
+    """Create a state that loads a state by name when enacted.
+    State names can be stored instead of the loader"""
     @statemanager()
     def state_loader(context: MessageContext) -> StateDefinition:
         raise GoToState(state)
+    if isinstance(state, str):
+        state_loader.checkpoint_state = state  # type: ignore
     return state_loader
 
 
 def state_checkpoint(state: StateDefinition):
-    """Creates checkpoint for current state"""
+    """Creates checkpoint for current state.
+    If the state can be stored as a state string, the checkpoint is stored as the
+    same string prefixed by '>', which processes the reply after loading the state"""
     @statemanager()
     def checkpoint(context: MessageContext):
         return state.process_message(context)
+    if isinstance(stored := getattr(state, "checkpoint_state", None), str):
+        checkpoint.checkpoint_state = ">" + stored  # type: ignore
     return checkpoint
@@ -0,0 +1,131 @@
+"""Collects Newton statistics for the !stats and !profile commands"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import cProfile
+import gc
+import io
+import pstats
+import sys
+import types
+
+from ...comm.operations import Histogram
+from .resources import STATE_TABLE
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Iterable
+    from ...comm.chat_instance import ChatInstance
+    from .newton import DefaultState
+
+
+class SolverStats:
+    """Hits and latency (ms) of a solver"""
+
+    def __init__(self):
+        self.calls = 0
+        self.hits = 0
+        self.latency = Histogram()
+
+    def record(self, hit: bool, latency: float):
+        """Records solver call"""
+        self.calls += 1
+        self.hits += hit
+        self.latency.record(latency)
+
+    def to_row(self, name: str) -> str:
+        """Returns markdown table row"""
+        summary = self.latency.to_dict()
+        rate = self.hits / self.calls if self.calls else 0.0
+        return (f"| {name} | {self.calls} | {rate:.0%} | {summary['p50']:.2f} | "
+                f"{summary['p95']:.2f} | {summary['p99']:.2f} |")
+
+
+_SKIP_TYPES = (type, types.ModuleType, types.CodeType, types.BuiltinFunctionType)
+
+
+def deep_size(roots: Iterable[Any], exclude: Iterable[Any] = ()) -> int:
+    """Returns the approximate size of objects reachable from roots.
+    Modules, types, code and module globals are not counted, nor anything
+    reachable only through exclude (e.g., the default state and the subject knowledge base)"""
+    seen = {id(module.__dict__) for module in list(sys.modules.values()) if module}
+    seen.update(id(obj) for obj in exclude)
+    pending = [obj for obj in roots if id(obj) not in seen]
+    total = 0
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, _SKIP_TYPES):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj, 0)
+        pending.extend(gc.get_referents(obj))
+    return total
+
+
+def history_size(instance: ChatInstance) -> int:
+    """Returns the approximate size of messages kept in memory.
+    Messages that the history store keeps only on disk are not loaded"""
+    total = 0
+    for message in instance.history.resident():
+        total += sys.getsizeof(message) + sys.getsizeof(message.text)
+        if message._alternatives:  # pylint: disable=protected-access
+            total += sum(sys.getsizeof(text) for text in message.alternatives)
+    return total
+
+
+def format_stats(default_state: DefaultState, instance: ChatInstance) -> str:
+    """Returns markdown report of solvers, indexes, history and checkpoints"""
+    subject_handler = default_state.subject_handler
+    lines = [
+        "####markdown#:",
+        "| Solver | Calls | Hit rate | p50 (ms) | p95 (ms) | p99 (ms) |",
+        "| --- | --- | --- | --- | --- | --- |",
+    ]
+    for name, stats in default_state.solver_stats.items():
+        lines.append(stats.to_row(name))
+
+    generators = sum(
+        1 for checkpoint in instance.checkpoints.values()
+        if hasattr(checkpoint, "gen")
+    )
+    # Checkpoint closures reach the instance, the comm and the user namespace
+    comm = instance.comm_ref()
+    shell = getattr(comm, "shell", None)
+    checkpoint_size = deep_size(
+        instance.checkpoints.values(),
+        exclude=[
+            default_state, *default_state.solvers, *subject_handler.index,
+            instance, instance.history,
+            comm, shell, getattr(shell, "user_ns", None)
+        ]
+    )
+    disk_size = instance.history.disk_size()
+    broken = STATE_TABLE.broken()
+    lines += [
+        "",
+        f"- Regex rules: {len(default_state.solvers[0].regexes)}",
+        f"- State references: {len(STATE_TABLE)} ({len(broken)} broken"
+        f"{': ' + ', '.join(broken) if broken else ''})",
+        f"- Subjects: {len(subject_handler.graph)} ({len(subject_handler.graph.keys)} alias paths)"
+        f"{' (index rebuilding)' if subject_handler.rebuilding is not None else ''}"
+        f"{' (last rebuild failed)' if subject_handler.rebuild_error else ''}",
+        f"- Subject search cache: {len(subject_handler.search_cache)} queries, "
+        f"{subject_handler.search_cache.hits} hits, {subject_handler.search_cache.misses} misses",
+        f"- Subject index terms: "
+        f"{len(subject_handler.idx.inverted_index) if subject_handler.idx else 0}",
+        f"- History: {len(instance.history)} messages, "
+        f"{len(instance.history.resident())} in memory ({history_size(instance) / 1024:.1f} KiB)"
+        f"{f', {disk_size / 1024:.1f} KiB on disk' if disk_size else ''}",
+        f"- Checkpoints: {len(instance.checkpoints)} ({generators} suspended generators), "
+        f"{checkpoint_size / 1024:.1f} KiB, {instance.checkpoints.stats()}",
+    ]
+    return "\n".join(lines)
+
+
+def profile_call(function: Callable[..., Any], *args: Any, limit: int = 20) -> str:
+    """Runs function under cProfile and returns the top cumulative functions"""
+    profiler = cProfile.Profile()
+    profiler.runcall(function, *args)
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(limit)
+    return output.getvalue().strip()
@@ -0,0 +1,45 @@
+"""Defines helpers for streaming bot replies"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import time
+
+if TYPE_CHECKING:
+    from ..comm.message import MessageContext
+
+
+class StreamingReply:
+    """Accumulates streamed chunks into the loading placeholder of a context.
+    Sends update-message at most once per interval (in seconds)"""
+
+    def __init__(self, context: MessageContext, interval: float, template: str = "{}"):
+        self.context = context
+        self.message = context.create_placeholder()
+        self.interval = interval
+        self.template = template
+        self.texts: list[str] = []
+        self.last_flush = time.monotonic()
+
+    def push(self, chunk: str, index: int = 0):
+        """Appends chunk to the choice index and flushes if the interval has passed.
+        Empty chunks (e.g., role and finish chunks) only register the choice"""
+        while len(self.texts) <= index:
+            self.texts.append("")
+        if not chunk:
+            return
+        self.texts[index] += chunk
+        if time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Sends the partial text of the first choice"""
+        if not self.texts:
+            return
+        self.message.text = self.template.format(self.texts[0])
+        self.context.instance.update_message(self.message)
+        self.last_flush = time.monotonic()
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Estimates the number of tokens of texts. Streamed responses do not report usage"""
+    return sum(len(text) for text in texts) // 4
@@ -2,21 +2,10 @@
 import os
 import json
 from .kernelcomm import KernelComm
+from .snapshot import Snapshot, apply_arg  # pylint: disable=unused-import
 
 COMM = None
 
-def apply_arg(data, arg, value):
-    """Change value of dict attribute"""
-    args = arg.split('.', 1)
-    if len(args) > 1:
-        step = args[0]
-        if step.startswith('__'):
-            step = int(step[2:])
-        new_data = data[step] if step else data
-        apply_arg(new_data, args[1], value)
-    else:
-        data[arg] = value
-
 def init(load_instances=False):
     """Init Notebook communication"""
     # pylint: disable=undefined-variable, global-statement
@@ -29,10 +18,9 @@ def init(load_instances=False):
             args = json.loads(to_load[1]) if len(to_load) > 1 else {}
             filename = to_load[0]
 
-            with open(filename, 'r', encoding="utf-8") as fil:
-                instances = json.load(fil)
-                for key, value in args.items():
-                    apply_arg(instances, key, value)
+            instances = Snapshot.open(filename)
+            for key, value in args.items():
+                instances.apply_arg(key, value)
 
         COMM.register(instances)
     else:
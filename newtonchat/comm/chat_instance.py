@@ -1,23 +1,29 @@
 """Define a chat instance"""
 from __future__ import annotations
-from collections import defaultdict
-from copy import deepcopy
+from collections import defaultdict, deque
+import asyncio
+import inspect
+import json
 import traceback
+import uuid
 import weakref
 from typing import TYPE_CHECKING, Any, cast
 
 from ..loader import LOADERS
-from .message import KernelProcess, MessageContext
+from .checkpoints import create_checkpoints
+from .history import create_history
+from .message import ChatMessage, KernelProcess, MessageContext
+from .operations import OperationRegistry
 
 if TYPE_CHECKING:
-    from ..bots.newton.states.state import StateDefinition
     from .kernelcomm import KernelComm
     from .message import IChatMessage
+    from .snapshot import SavedInstance
 else:
     IChatMessage = None
 
 
-def apply_partial(original: dict, update: dict):
+def apply_partial(original: dict | ChatMessage, update: dict):
     """Apply nested changes to original dict"""
     for key, value in update.items():
         if isinstance(value, dict):
@@ -29,6 +35,8 @@ def apply_partial(original: dict, update: dict):
 class ChatInstance:
     """Chat Instance handler"""
 
+    operations = OperationRegistry("instance")
+
     def __init__(self, comm: KernelComm, chat_name: str, mode="newton"):
         self.mode = mode
         self.comm_ref = weakref.ref(comm)
@@ -37,8 +45,9 @@ class ChatInstance:
 
         self.chat_name = chat_name
 
-        self.history: list[IChatMessage] = []
-        self.message_map: dict[str, IChatMessage] = {}
+        self.history = create_history()
+        self.epoch = str(uuid.uuid4())
+        self.seq = 0
         self.config = {
             "process_in_kernel": True,
             "enable_autocomplete": True,
@@ -53,8 +62,12 @@ class ChatInstance:
             "show_kernel_messages": True,
             "show_metadata": False,
             "direct_send_to_user": False,
+            "history_page_size": 100,
+            "fanout_workers": 4,
         }
-        self.checkpoints: dict[str, StateDefinition | None] = {}
+        self.checkpoints = create_checkpoints()
+        self.bot_queue: deque[MessageContext] = deque()
+        self.bot_worker: asyncio.Future | None = None
 
     @property
     def bot(self):
@@ -62,68 +75,110 @@ class ChatInstance:
         return self.bot_loader.current()
 
     def start_bot(self, data: dict):
-        """Starts bot and sets history map"""
+        """Starts bot"""
         self.bot.set_config(self, data, start=True)
-        for message in self.history:
-            self.message_map[message['id']] = message
         return self
 
-    def info(self):
-        """Return chat instance info"""
+    def find_message(self, message_id: str) -> ChatMessage:
+        """Returns message by id. Raises KeyError if it does not exist"""
+        return self.history.find(message_id)
+
+    def touch_message(self, message: ChatMessage) -> int:
+        """Stores changed message and returns the new sequence number"""
+        self.seq += 1
+        self.history.touch(message, self.seq)
+        return self.seq
+
+    def append_history(self, message: ChatMessage | IChatMessage) -> ChatMessage:
+        """Appends message to history without sending it"""
+        message = ChatMessage.coerce(message)
+        self.seq += 1
+        self.history.append(message, self.seq)
+        return message
+
+    def reset_history(self, history: list[IChatMessage]):
+        """Replaces history. Clients must perform a full resync after it"""
+        self.epoch = str(uuid.uuid4())
+        self.history.close()
+        self.history = create_history()
+        for message in history:
+            self.append_history(message)
+
+    def history_delta(self, since: int | None, epoch: str | None) -> dict[str, Any] | None:
+        """Returns messages changed and messages appended after since.
+        Returns None when the client version diverges from the history"""
+        if since is None or epoch != self.epoch or since > self.seq:
+            return None
+        start = self.history.count_until(since)
+        appended = self.history[start:]
+        appended_ids = {message['id'] for message in appended}
+        changed = [
+            message for message in self.history.changed_since(since)
+            if message['id'] not in appended_ids
+        ]
         return {
+            "changed": [message.to_dict() for message in changed],
+            "appended": [message.to_dict() for message in appended],
+        }
+
+    def history_page(self, cursor: str | None, before: int, after: int = 0) -> dict[str, Any]:
+        """Returns a window of messages around cursor, newest first.
+        The window ends at the last message if cursor is None"""
+        total = len(self.history)
+        position = total - 1 if cursor is None else self.history.position(cursor)
+        start = max(position - before, 0)
+        end = min(position + after + 1, total)
+        return {
+            "messages": [message.to_dict() for message in reversed(self.history[start:end])],
+            "start": start,
+            "end": end,
+            "history_total": total,
+        }
+
+    def info(self, history=True, limit: int | None = None):
+        """Return chat instance info.
+        If limit is set, history contains only the last limit messages"""
+        result = {
             "mode": self.mode,
-            "history": self.history,
             "config": self.config,
             "bot_config": self.bot.config_values(),
             "bot_config_loader": self.bot.config(),
+            "seq": self.seq,
+            "epoch": self.epoch,
+            "history_total": len(self.history),
         }
+        if history:
+            start = 0 if limit is None else max(len(self.history) - limit, 0)
+            result["history"] = [message.to_dict() for message in self.history[start:]]
+            result["history_start"] = start
+        return result
 
-    def sync_chat(self, operation):
-        """Sends message with history and general config"""
-        self.send({
+    def sync_chat(
+        self, operation,
+        since: int | None = None, epoch: str | None = None, limit: int | None = None
+    ):
+        """Sends message with history and general config.
+        Sends only the delta if the client version (since, epoch) matches the history"""
+        delta = self.history_delta(since, epoch)
+        data = {
             "operation": operation,
-            **self.info()
-        })
+            **self.info(history=delta is None, limit=limit)
+        }
+        if delta is not None:
+            data["delta"] = delta
+        self.send(data)
 
-    def refresh(self):
+    def refresh(self, since: int | None = None, epoch: str | None = None):
         """Refreshes instance"""
         self.bot.refresh(self)
-        self.sync_chat("refresh")
+        self.sync_chat("refresh", since, epoch, limit=self.config["history_page_size"])
 
     def receive(self, data: dict[str, Any]):
         """Processes received requests"""
+        operation: str = data.get("operation", "")
         try:
-            operation: str = data.get("operation", "")
-            if operation == "message":
-                message: IChatMessage = cast(IChatMessage, data.get("message"))
-                self.receive_message(message)
-            elif operation == "refresh":
-                self.refresh()
-            elif operation == "autocomplete-query":
-                self.receive_autocomplete_query(
-                    data.get('requestId'),
-                    data.get('query')
-                )
-            elif operation == "config":
-                key = data["key"]
-                value = data["value"]
-                if data["_mode"] == "update" or key not in self.config:
-                    self.config[key] = value
-                self.send({
-                    "operation": "update-config",
-                    "config": {key: self.config[key]},
-                })
-            elif operation == "sync-message":
-                partial_message = data["message"]
-                message = self.message_map[partial_message["id"]]
-                apply_partial(cast(dict[Any, Any], message), partial_message)
-                self.send({
-                    "operation": "update-message",
-                    "message": message,
-                })
-            elif operation == "update-instance-bot":
-                self.bot.set_config(self, data['data'], start=False)
-                self.refresh()
+            comm = self.comm_ref()
+            self.operations.dispatch(self, data, comm.stats if comm else None)
         except Exception:  # pylint: disable=broad-except
             print(traceback.format_exc())
             self.send({
@@ -132,41 +187,141 @@ class ChatInstance:
                 "message": traceback.format_exc(),
             })
 
-    def receive_message(self, message: IChatMessage):
+    @operations.register("message")
+    def receive_message_operation(self, data: dict[str, Any]):
+        """Receives message from user"""
+        self.receive_message(cast(IChatMessage, data.get("message")))
+
+    @operations.register("init")
+    def receive_init(self, data: dict[str, Any]):
+        """Sends the last page of history and the instance config"""
+        self.sync_chat("init", limit=data.get("limit", self.config["history_page_size"]))
+
+    @operations.register("history-page")
+    def receive_history_page(self, data: dict[str, Any]):
+        """Sends a page of history around the cursor"""
+        page_size = self.config["history_page_size"]
+        self.send({
+            "operation": "history-page",
+            "requestId": data.get("requestId"),
+            **self.history_page(
+                data.get("cursor"),
+                data.get("before", page_size),
+                data.get("after", 0)
+            ),
+        })
+
+    @operations.register("refresh")
+    def receive_refresh(self, data: dict[str, Any]):
+        """Refreshes instance"""
+        self.refresh(data.get("since"), data.get("epoch"))
+
+    @operations.register("autocomplete-query")
+    def receive_autocomplete_operation(self, data: dict[str, Any]):
+        """Receives autocomplete query"""
+        self.receive_autocomplete_query(
+            data.get('requestId'),
+            data.get('query')
+        )
+
+    @operations.register("config")
+    def receive_config(self, data: dict[str, Any]):
+        """Updates config"""
+        key = data["key"]
+        value = data["value"]
+        if data["_mode"] == "update" or key not in self.config:
+            self.config[key] = value
+        self.send({
+            "operation": "update-config",
+            "config": {key: self.config[key]},
+        })
+
+    @operations.register("sync-message")
+    def receive_sync_message(self, data: dict[str, Any]):
+        """Applies partial message changes from user"""
+        partial_message = data["message"]
+        message = self.find_message(partial_message["id"])
+        apply_partial(message, partial_message)
+        self.update_message(message)
+
+    @operations.register("update-instance-bot")
+    def receive_update_instance_bot(self, data: dict[str, Any]):
+        """Updates bot config"""
+        self.bot.set_config(self, data['data'], start=False)
+        self.refresh()
+
+    def receive_message(self, message: ChatMessage | IChatMessage):
         """Receives message from user"""
         comm_ref = self.comm_ref()
         if not comm_ref:
             raise Exception("Missing comm reference")  # pylint: disable=broad-exception-raised
-        self.history.append(message)
-        self.message_map[message['id']] = message
+        message = ChatMessage.coerce(message)
+        context = self.accept_message(message)
+        if context is not None:
+            if inspect.iscoroutinefunction(self.bot.process_message):
+                self.schedule_message(context)
+            else:
+                self.bot.process_message(context)
+
+        replicate_other_instances = (
+            self.chat_name == "base"
+            and (
+                context is not None
+                or message.get('kernelProcess') == KernelProcess.PROCESS
+            )
+        )
+        if replicate_other_instances:
+            comm_ref.fanout.replicate(comm_ref, self, message)
+
+    def accept_message(self, message: ChatMessage | IChatMessage) -> MessageContext | None:
+        """Appends message from user and sends it back.
+        Returns the context for the bot if the kernel should process the message"""
+        message = self.append_history(message)
         self.send({
             "operation": "reply",
-            "message": message
+            "message": message.to_dict(),
+            "seq": self.seq,
         })
         process_message = (
             message.get('kernelProcess') == KernelProcess.PROCESS
             and self.config["process_in_kernel"]
             or message.get('kernelProcess') == KernelProcess.FORCE
         )
+        if not process_message:
+            return None
+        return MessageContext(self.comm_ref(), self, message)
 
-        if process_message:
-            context = MessageContext(comm_ref, self, message)
-            self.bot.process_message(context)
+    def enqueue_message(self, context: MessageContext):
+        """Replies a loading placeholder and queues message for async bots.
+        The placeholder is filled by the first bot reply"""
+        context.create_placeholder()
+        self.bot_queue.append(context)
 
-        replicate_other_instances = (
-            self.chat_name == "base"
-            and (
-                process_message
-                or message.get('kernelProcess') == KernelProcess.PROCESS
-            )
-        )
-        if replicate_other_instances:
-            for chat_name, instance in comm_ref.chat_instances.items():
-                if chat_name != "base" and instance.config["process_base_chat_message"]:
-                    imessage = deepcopy(message)
-                    imessage["inConversationContext"] = True
-                    instance.receive_message(imessage)
+    def schedule_message(self, context: MessageContext):
+        """Schedules message for async bots on the kernel event loop.
+        Messages of an instance are processed in order"""
+        self.enqueue_message(context)
+        self.comm_ref().fanout.start_workers([self], self.config["fanout_workers"])
 
+    async def process_bot_queue(self, limiter: asyncio.Semaphore | None = None):
+        """Processes scheduled messages until the queue is empty.
+        Each bot call waits for the limiter shared with other instances.
+        If the worker is cancelled, the next scheduled message starts a new one"""
+        try:
+            while self.bot_queue:
+                context = self.bot_queue.popleft()
+                try:
+                    if limiter is None:
+                        await self.bot.process_message(context)
+                    else:
+                        async with limiter:
+                            await self.bot.process_message(context)
+                except Exception:  # pylint: disable=broad-except
+                    context.reply(traceback.format_exc(), "error")
+                finally:
+                    context.release_placeholder()
+        finally:
+            self.bot_worker = None
 
     def receive_autocomplete_query(self, request_id, query):
         """Receives query from user"""
@@ -182,15 +337,25 @@ class ChatInstance:
     def send(self, data):
         """Receives send results"""
         data["instance"] = self.chat_name
-        self.comm_ref().comm.send(data)
+        self.comm_ref().send(data)
 
-    def reply_message(self, message: IChatMessage):
-        """Replies IChatMessage to user"""
-        self.history.append(message)
-        self.message_map[message['id']] = message
+    def reply_message(self, message: ChatMessage | IChatMessage) -> ChatMessage:
+        """Replies message to user"""
+        message = self.append_history(message)
         self.send({
             "operation": "reply",
-            "message": message
+            "message": message.to_dict(),
+            "seq": self.seq,
+        })
+        return message
+
+    def update_message(self, message: ChatMessage):
+        """Stores changed message and sends it to user"""
+        self.touch_message(message)
+        self.send({
+            "operation": "update-message",
+            "message": message.to_dict(),
+            "seq": self.seq,
         })
 
     def save(self):
@@ -199,9 +364,33 @@ class ChatInstance:
             "name": self.chat_name,
             "mode": self.mode,
             "bot": self.bot.save(),
-            "history": self.history,
+            "history": [message.to_dict() for message in self.history],
+            "config": self.config
+        }
+
+    def save_patch(self, saved: dict | None) -> tuple[dict, dict | None]:
+        """Returns the save state and the instance section changed since the saved state.
+        The section is None if nothing changed. It has the full history if saved is None
+        or if the history was replaced. Otherwise, it has only the history delta"""
+        settings = {
+            "name": self.chat_name,
+            "mode": self.mode,
+            "bot": self.bot.save(),
             "config": self.config
         }
+        digest = hash(json.dumps(settings, sort_keys=True, default=str))
+        state = {"epoch": self.epoch, "seq": self.seq, "settings": digest}
+        if saved is None or saved["epoch"] != self.epoch:
+            return state, {
+                **settings,
+                "history": [message.to_dict() for message in self.history],
+            }
+        if saved["seq"] == self.seq and saved["settings"] == digest:
+            return state, None
+        return state, {
+            **settings,
+            "history_delta": self.history_delta(saved["seq"], saved["epoch"]),
+        }
 
     def load(self, data):
         """Loads instance data"""
@@ -210,8 +399,47 @@ class ChatInstance:
         if "bot" in data:
             self.bot.load(data["bot"])
         if "history" in data:
-            self.history = data["history"]
-            self.message_map = {}
-            for message in self.history:
-                self.message_map[message['id']] = message
+            self.reset_history(data["history"])
         self.config = {**self.config, **data.get("config", {})}
+
+
+class InstanceStub:
+    """Saved chat instance that has not been loaded yet.
+    KernelComm replaces it by a ChatInstance when the instance is first addressed"""
+
+    def __init__(self, saved: SavedInstance):
+        self.saved = saved
+        self.chat_name = saved.name
+        self.mode = saved.mode
+        self.config = saved.config
+        self.epoch = str(uuid.uuid4())
+
+    def hydrate(self, comm: KernelComm) -> ChatInstance:
+        """Loads chat instance"""
+        instance = ChatInstance(comm, self.chat_name, self.mode)
+        instance.load(self.saved.data())
+        return instance
+
+    def info(self, history=True, limit: int | None = None):
+        """Return chat instance info without loading it"""
+        # pylint: disable=unused-argument
+        return {
+            "mode": self.mode,
+            "config": self.config,
+            "bot_config": {},
+            "bot_config_loader": LOADERS[self.mode].config(),
+            "seq": 0,
+            "epoch": self.epoch,
+            "history_total": self.saved.message_count,
+        }
+
+    def save(self):
+        """Saves instance data"""
+        return self.saved.data()
+
+    def save_patch(self, saved: dict | None) -> tuple[dict, dict | None]:
+        """Returns the save state and the saved data if it was not saved yet"""
+        state = {"epoch": self.epoch, "seq": 0, "settings": None}
+        if saved is None or saved["epoch"] != self.epoch:
+            return state, self.save()
+        return state, None
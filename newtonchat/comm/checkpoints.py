@@ -0,0 +1,153 @@
+"""Defines stores for the checkpoints of bot replies"""
+from __future__ import annotations
+from collections import OrderedDict
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import weakref
+from typing import TYPE_CHECKING
+
+from .history import _remove_database
+
+if TYPE_CHECKING:
+    from typing import Any, Iterator
+
+
+def checkpoint_string(checkpoint: Any) -> str | None:
+    """Returns the state string that represents a checkpoint or None.
+    States can define a checkpoint_state attribute (e.g., "!subject <key>")"""
+    if isinstance(checkpoint, str):
+        return checkpoint
+    state = getattr(checkpoint, "checkpoint_state", None)
+    return state if isinstance(state, str) else None
+
+
+class MemoryCheckpoints:
+    """Keeps the checkpoints of the most recently used replies in memory.
+    Evicts the least recently used checkpoints above size and the checkpoints
+    that were not used for age seconds. Remembers the ids of evicted checkpoints"""
+
+    def __init__(self, size: int | None = 1000, age: float | None = None):
+        self.size = size
+        self.age = age
+        self.entries: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        self.evicted_ids: set[str] = set()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __setitem__(self, message_id: str, checkpoint: Any):
+        self.entries[message_id] = (checkpoint, time.monotonic())
+        self.entries.move_to_end(message_id)
+        self.evicted_ids.discard(message_id)
+        self.expire()
+
+    def get(self, message_id: str, default: Any = None) -> Any:
+        """Returns checkpoint and marks it as recently used"""
+        self.expire()
+        entry = self.entries.get(message_id)
+        if entry is None:
+            return default
+        self.entries[message_id] = (entry[0], time.monotonic())
+        self.entries.move_to_end(message_id)
+        return entry[0]
+
+    def values(self) -> Iterator[Any]:
+        """Returns the checkpoints kept in memory"""
+        return (checkpoint for checkpoint, _ in self.entries.values())
+
+    def evicted(self, message_id: str) -> bool:
+        """Returns whether the checkpoint of message was evicted"""
+        return message_id in self.evicted_ids
+
+    def expire(self):
+        """Evicts checkpoints above size or older than age"""
+        limit = None if self.age is None else time.monotonic() - self.age
+        while self.entries:
+            message_id, (checkpoint, used) = next(iter(self.entries.items()))
+            if (self.size is None or len(self.entries) <= self.size) and (
+                    limit is None or used >= limit):
+                break
+            del self.entries[message_id]
+            self.evictions += 1
+            self.evict(message_id, checkpoint)
+
+    def evict(self, message_id: str, checkpoint: Any):
+        """Drops evicted checkpoint"""
+        # pylint: disable=unused-argument
+        self.evicted_ids.add(message_id)
+
+    def stats(self) -> str:
+        """Returns summary for !stats"""
+        return f"{self.evictions} evicted"
+
+    def close(self):
+        """Releases store resources"""
+
+
+class SQLiteCheckpoints(MemoryCheckpoints):
+    """Spills evicted checkpoints that are state strings to a SQLite file.
+    Other evicted checkpoints are dropped"""
+
+    def __init__(
+        self, size: int | None = 1000, age: float | None = None, directory: str | None = None
+    ):
+        super().__init__(size, age)
+        handle, self.path = tempfile.mkstemp(
+            prefix="newtonchat-checkpoints-", suffix=".sqlite", dir=directory
+        )
+        os.close(handle)
+        self.spilled_ids: set[str] = set()
+        self.connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self.connection.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=OFF;
+            CREATE TABLE checkpoints (id TEXT PRIMARY KEY, state TEXT NOT NULL);
+        """)
+        self._finalizer = weakref.finalize(self, _remove_database, self.connection, self.path)
+
+    def get(self, message_id: str, default: Any = None) -> Any:
+        """Returns checkpoint from memory or the state string spilled to disk"""
+        checkpoint = super().get(message_id, default)
+        if checkpoint is default and message_id in self.spilled_ids:
+            row = self.connection.execute(
+                "SELECT state FROM checkpoints WHERE id = ?", (message_id,)
+            ).fetchone()
+            return row[0]
+        return checkpoint
+
+    def evict(self, message_id: str, checkpoint: Any):
+        """Writes checkpoint to disk if it is a state string"""
+        state = checkpoint_string(checkpoint)
+        if state is None:
+            super().evict(message_id, checkpoint)
+            return
+        self.connection.execute(
+            "INSERT OR REPLACE INTO checkpoints (id, state) VALUES (?, ?)", (message_id, state)
+        )
+        self.spilled_ids.add(message_id)
+
+    def stats(self) -> str:
+        """Returns summary for !stats"""
+        return f"{self.evictions} evicted, {len(self.spilled_ids)} spilled to disk"
+
+    def close(self):
+        """Releases store resources and removes the database file"""
+        self._finalizer()
+
+
+CHECKPOINT_STORES = {
+    "memory": MemoryCheckpoints,
+    "sqlite": SQLiteCheckpoints,
+}
+
+
+def create_checkpoints():
+    """Creates the checkpoint store defined by the NewtonCheckpointStore environment variable.
+    The variable has the format <store>?<json args>. E.g.: sqlite?{"size": 200, "age": 3600}"""
+    definition = os.environ.get("NewtonCheckpointStore", "memory").split('?', 1)
+    args = json.loads(definition[1]) if len(definition) > 1 else {}
+    return CHECKPOINT_STORES[definition[0]](**args)
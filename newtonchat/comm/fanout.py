@@ -0,0 +1,76 @@
+"""Replicates base chat messages to the other chat instances"""
+from __future__ import annotations
+import asyncio
+import inspect
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .chat_instance import ChatInstance
+    from .kernelcomm import KernelComm
+    from .message import ChatMessage
+
+
+class FanOut:
+    """Runs the bot workers of chat instances concurrently.
+    At most limit bot calls run at the same time. A limit of 0 disables the limit"""
+
+    def __init__(self):
+        self.limiter: asyncio.Semaphore | None = None
+        self.limiter_key: tuple[int, int] | None = None
+
+    def get_limiter(self, limit: int) -> asyncio.Semaphore | None:
+        """Returns semaphore shared by the workers of the running loop"""
+        if limit <= 0:
+            return None
+        key = (id(asyncio.get_running_loop()), limit)
+        if self.limiter is None or self.limiter_key != key:
+            self.limiter = asyncio.Semaphore(limit)
+            self.limiter_key = key
+        return self.limiter
+
+    def start_workers(self, instances: list[ChatInstance], limit: int = 0):
+        """Starts the bot workers of instances that have queued messages.
+        Without a running loop (e.g., outside the kernel), waits for all workers in a new loop"""
+        instances = [instance for instance in instances if instance.bot_worker is None]
+        if not instances:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(self.run_workers(instances, limit))
+        else:
+            for instance in instances:
+                instance.bot_worker = asyncio.ensure_future(
+                    instance.process_bot_queue(self.get_limiter(limit))
+                )
+
+    async def run_workers(self, instances: list[ChatInstance], limit: int = 0):
+        """Runs the bot workers of instances until their queues are empty"""
+        self.start_workers(instances, limit)
+        await asyncio.gather(*(
+            instance.bot_worker for instance in instances if instance.bot_worker is not None
+        ))
+
+    def replicate(self, comm: KernelComm, source: ChatInstance, message: ChatMessage):
+        """Replicates message to the other instances that process base chat messages.
+        Each instance receives a copy-on-write message marked as conversation context.
+        Synchronous bots process it in order. Async bots process it concurrently
+        and their replies fill loading placeholders as they complete"""
+        pending = []
+        for name, instance in list(comm.chat_instances.items()):
+            if instance is source or not instance.config.get("process_base_chat_message", True):
+                continue
+            instance = comm.hydrate(name)
+            if instance is None:
+                continue
+            imessage = message.share()
+            imessage.in_conversation_context = True
+            context = instance.accept_message(imessage)
+            if context is None:
+                continue
+            if inspect.iscoroutinefunction(instance.bot.process_message):
+                instance.enqueue_message(context)
+                pending.append(instance)
+            else:
+                instance.bot.process_message(context)
+        self.start_workers(pending, source.config["fanout_workers"])
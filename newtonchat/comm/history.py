@@ -0,0 +1,252 @@
+"""Defines stores for the chat instance history"""
+from __future__ import annotations
+from bisect import bisect_right
+from collections import OrderedDict
+import json
+import os
+import sqlite3
+import tempfile
+import weakref
+from typing import TYPE_CHECKING
+
+from .message import ChatMessage
+
+if TYPE_CHECKING:
+    from typing import Iterator
+
+
+class MemoryHistory:
+    """Keeps the whole history in memory"""
+
+    def __init__(self):
+        self.messages: list[ChatMessage] = []
+        self.message_map: dict[str, ChatMessage] = {}
+        self.positions: dict[str, int] = {}
+        self.append_seqs: list[int] = []
+        self.message_seqs: OrderedDict[str, int] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __iter__(self) -> Iterator[ChatMessage]:
+        return iter(self.messages)
+
+    def __getitem__(self, index):
+        return self.messages[index]
+
+    def append(self, message: ChatMessage, seq: int):
+        """Appends message with the sequence number of the append"""
+        self.positions[message['id']] = len(self.messages)
+        self.messages.append(message)
+        self.message_map[message['id']] = message
+        self.append_seqs.append(seq)
+        self.touch(message, seq)
+
+    def touch(self, message: ChatMessage, seq: int):
+        """Stores changed message with its new sequence number"""
+        self.message_seqs[message['id']] = seq
+        self.message_seqs.move_to_end(message['id'])
+
+    def find(self, message_id: str) -> ChatMessage:
+        """Returns message by id. Raises KeyError if it does not exist"""
+        return self.message_map[message_id]
+
+    def position(self, message_id: str) -> int:
+        """Returns message position by id. Raises KeyError if it does not exist"""
+        return self.positions[message_id]
+
+    def count_until(self, seq: int) -> int:
+        """Returns the number of messages appended up to seq"""
+        return bisect_right(self.append_seqs, seq)
+
+    def changed_since(self, seq: int) -> list[ChatMessage]:
+        """Returns messages changed after seq, in change order"""
+        changed = []
+        for message_id, message_seq in reversed(self.message_seqs.items()):
+            if message_seq <= seq:
+                break
+            changed.append(self.message_map[message_id])
+        changed.reverse()
+        return changed
+
+    def resident(self) -> list[ChatMessage]:
+        """Returns the messages kept in memory"""
+        return self.messages
+
+    def disk_size(self) -> int:
+        """Returns the size of the store files in bytes"""
+        # pylint: disable=no-self-use
+        return 0
+
+    def close(self):
+        """Releases store resources"""
+
+
+def _remove_database(connection: sqlite3.Connection, path: str):
+    """Closes connection and removes database files"""
+    connection.close()
+    for filename in (path, path + "-wal", path + "-shm"):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+class SQLiteHistory:
+    """Appends history to a SQLite file and keeps only a bounded window in memory.
+    Evicted messages are read back through the id and position indexes"""
+
+    def __init__(self, directory: str | None = None, window: int = 500):
+        handle, self.path = tempfile.mkstemp(prefix="newtonchat-", suffix=".sqlite", dir=directory)
+        os.close(handle)
+        self.window_size = window
+        self.window: OrderedDict[int, ChatMessage] = OrderedDict()
+        self.hot_ids: dict[str, int] = {}
+        self.length = 0
+        self.connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self.connection.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=OFF;
+            CREATE TABLE messages (
+                position INTEGER PRIMARY KEY,
+                id TEXT NOT NULL,
+                append_seq INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX messages_id ON messages (id);
+            CREATE INDEX messages_append_seq ON messages (append_seq);
+            CREATE INDEX messages_seq ON messages (seq);
+        """)
+        self._finalizer = weakref.finalize(self, _remove_database, self.connection, self.path)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[ChatMessage]:
+        chunk = max(self.window_size, 1)
+        for start in range(0, self.length, chunk):
+            yield from self._load_range(start, min(start + chunk, self.length))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                return [self[position] for position in range(start, stop, step)]
+            return self._load_range(start, stop)
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("history index out of range")
+        if index in self.window:
+            self.window.move_to_end(index)
+            return self.window[index]
+        row = self.connection.execute(
+            "SELECT data FROM messages WHERE position = ?", (index,)
+        ).fetchone()
+        return self._remember(index, ChatMessage.from_dict(json.loads(row[0])))
+
+    def _remember(self, position: int, message: ChatMessage) -> ChatMessage:
+        """Adds message to the in-memory window, evicting the least recently used"""
+        self.window[position] = message
+        self.window.move_to_end(position)
+        self.hot_ids[message['id']] = position
+        while len(self.window) > self.window_size:
+            _, evicted = self.window.popitem(last=False)
+            self.hot_ids.pop(evicted['id'], None)
+        return message
+
+    def _load_range(self, start: int, stop: int) -> list[ChatMessage]:
+        """Returns messages in [start, stop), reading only evicted ones from disk"""
+        if start >= stop:
+            return []
+        result: list[ChatMessage | None] = [self.window.get(pos) for pos in range(start, stop)]
+        if None in result:
+            rows = self.connection.execute(
+                "SELECT position, data FROM messages WHERE position >= ? AND position < ?",
+                (start, stop)
+            )
+            for position, data in rows:
+                if result[position - start] is None:
+                    result[position - start] = ChatMessage.from_dict(json.loads(data))
+        return result  # type: ignore
+
+    def append(self, message: ChatMessage, seq: int):
+        """Appends message with the sequence number of the append"""
+        self.connection.execute(
+            "INSERT INTO messages (position, id, append_seq, seq, data) VALUES (?, ?, ?, ?, ?)",
+            (self.length, message['id'], seq, seq, json.dumps(message.to_dict()))
+        )
+        self._remember(self.length, message)
+        self.length += 1
+
+    def touch(self, message: ChatMessage, seq: int):
+        """Stores changed message with its new sequence number"""
+        self.connection.execute(
+            "UPDATE messages SET seq = ?, data = ? WHERE position = ?",
+            (seq, json.dumps(message.to_dict()), self.position(message['id']))
+        )
+
+    def find(self, message_id: str) -> ChatMessage:
+        """Returns message by id. Raises KeyError if it does not exist"""
+        return self[self.position(message_id)]
+
+    def position(self, message_id: str) -> int:
+        """Returns message position by id. Raises KeyError if it does not exist"""
+        if message_id in self.hot_ids:
+            return self.hot_ids[message_id]
+        row = self.connection.execute(
+            "SELECT MAX(position) FROM messages WHERE id = ?", (message_id,)
+        ).fetchone()
+        if row[0] is None:
+            raise KeyError(message_id)
+        return row[0]
+
+    def count_until(self, seq: int) -> int:
+        """Returns the number of messages appended up to seq"""
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM messages WHERE append_seq <= ?", (seq,)
+        ).fetchone()[0]
+
+    def changed_since(self, seq: int) -> list[ChatMessage]:
+        """Returns messages changed after seq, in change order"""
+        rows = self.connection.execute(
+            "SELECT position, data FROM messages WHERE seq > ? ORDER BY seq", (seq,)
+        )
+        return [
+            self.window[position] if position in self.window
+            else ChatMessage.from_dict(json.loads(data))
+            for position, data in rows
+        ]
+
+    def resident(self) -> list[ChatMessage]:
+        """Returns the messages of the in-memory window"""
+        return list(self.window.values())
+
+    def disk_size(self) -> int:
+        """Returns the size of the database files in bytes"""
+        total = 0
+        for filename in (self.path, self.path + "-wal"):
+            try:
+                total += os.path.getsize(filename)
+            except OSError:
+                pass
+        return total
+
+    def close(self):
+        """Releases store resources and removes the database file"""
+        self._finalizer()
+
+
+HISTORY_STORES = {
+    "memory": MemoryHistory,
+    "sqlite": SQLiteHistory,
+}
+
+
+def create_history():
+    """Creates the history store defined by the NewtonHistoryStore environment variable.
+    The variable has the format <store>?<json args>. E.g.: sqlite?{"window": 200}"""
+    definition = os.environ.get("NewtonHistoryStore", "memory").split('?', 1)
+    args = json.loads(definition[1]) if len(definition) > 1 else {}
+    return HISTORY_STORES[definition[0]](**args)
@@ -1,42 +1,93 @@
 """Define a Comm for the bot"""
 from __future__ import annotations
-import io
-from contextlib import redirect_stdout
+from contextlib import contextmanager
 
+import threading
 import traceback
 from ipykernel.comm import Comm
 
 from ..loader import LOADERS
-from .chat_instance import ChatInstance
+from .chat_instance import ChatInstance, InstanceStub
+from .fanout import FanOut
 from .message import MessageContext
+from .operations import OperationRegistry, OperationStats
+from .snapshot import Snapshot, create_codec
 
 
 class KernelComm:
     """Comm handler"""
 
+    operations = OperationRegistry("<meta>", buffers=True)
+    # Replaced by headless benchmarks
+    comm_class = Comm
+
     def __init__(self, shell=None, mode="newton"):
         self.shell = shell
+        self.fanout = FanOut()
+        self.stats = OperationStats()
         self.name = "newton.comm"
         self.comm = None
-        self.chat_instances = {
+        self.chat_instances: dict[str, ChatInstance | InstanceStub] = {
             "base": ChatInstance(self, "base", mode).start_bot({})
         }
         self.dead_instances = []
         self.sessions_history = []
+        self.session_input: list[str] = []
+        self.session_input_line = 0
+        self.save_id = 0
+        self.save_checkpoint_interval = 20
+        self.saved_states: dict[str, dict] = {}
+        self.saved_dead_instances = 0
+        self.codec = create_codec()
+        self.local = threading.local()
 
     def register(self, instances=None):
         """Registers comm"""
-        self.comm = Comm(self.name)
+        self.comm = self.comm_class(self.name)
         self.comm.on_msg(self.receive)
-        if instances:
-            self.load_instances(instances)
-        self.sync_meta()
-        for instance in self.chat_instances.values():
-            instance.sync_chat("init")
+        with self.batch():
+            if instances:
+                self.load_instances(instances)
+            self.sync_meta()
+            for instance in self.chat_instances.values():
+                if isinstance(instance, ChatInstance):
+                    instance.sync_chat("init", limit=instance.config["history_page_size"])
+
+    def send(self, data, buffers=None):
+        """Sends data to client. Data is queued if a batch is open in the current thread.
+        Data with binary buffers is never batched"""
+        outbox = getattr(self.local, "outbox", None)
+        if buffers:
+            self.comm.send(data, buffers=buffers)
+        elif outbox is not None:
+            outbox.append(data)
+        else:
+            self.comm.send(data)
+
+    @contextmanager
+    def batch(self):
+        """Coalesces all sends of the current thread into a single batch frame"""
+        if getattr(self.local, "outbox", None) is not None:
+            yield
+            return
+        self.local.outbox = []
+        try:
+            yield
+        finally:
+            outbox = self.local.outbox
+            self.local.outbox = None
+            if len(outbox) == 1:
+                self.comm.send(outbox[0])
+            elif outbox:
+                self.comm.send({
+                    "operation": "batch",
+                    "instance": "<meta>",
+                    "messages": outbox,
+                })
 
     def sync_meta(self):
         """Sends list of loaders and instances to client"""
-        self.comm.send({
+        self.send({
             "operation": "sync-meta",
             "instance": "<meta>",
             "loaders": {
@@ -44,85 +95,148 @@ class KernelComm:
                 for key, value in LOADERS.items()
             },
             "instances": {
-                key: value.info()
+                key: value.info(history=False)
                 for key, value in self.chat_instances.items()
             },
         })
 
-    def save_instances(self):
-        """Saves instances and return a json to client"""
+    def read_session_input(self) -> list[str]:
+        """Reads inputs executed after the last read from the IPython history database.
+        Lines use the format of %history -n"""
+        history_manager = getattr(self.shell, "history_manager", None)
+        if history_manager is None:
+            return []
+        lines = []
+        for _, lineno, source in history_manager.get_range(0, self.session_input_line + 1):
+            source = source.expandtabs(4).rstrip()
+            separator = '\n' if '\n' in source else ' '
+            lines.append(f"{lineno:>4}:{separator}{source}\n")
+            self.session_input_line = lineno
+        self.session_input.extend(lines)
+        return lines
+
+    def save_instances(self, full=False):
+        """Saves instances and sends them to client.
+        Sends only the sections that changed since the previous save as a patch,
+        except on every save_checkpoint_interval saves or if full is set.
+        Binary codecs always send the full snapshot as a buffer"""
+        new_input = self.read_session_input()
+        self.save_id += 1
+        binary = bool(self.codec.magic)
+        full = (
+            full
+            or binary
+            or not self.saved_states
+            or self.save_id % self.save_checkpoint_interval == 0
+        )
+        saved_states = {}
         instances = {}
         for name, instance in self.chat_instances.items():
-            instances[name] = instance.save()
-
-        string_io_file = io.StringIO()
-        with redirect_stdout(string_io_file):
-            self.shell.run_line_magic("history", "-n")
-        out = string_io_file.getvalue()
-
-        history = self.sessions_history + [out]
+            state, section = instance.save_patch(None if full else self.saved_states.get(name))
+            saved_states[name] = state
+            if section is not None:
+                instances[name] = section
 
-        self.comm.send({
-            "operation": "instances",
-            "instance": "<meta>",
-            "data": {
+        if full:
+            data = {
                 "instances": instances,
                 "!!dead_instances": self.dead_instances,
-                "!!sessions_history": history,
-            },
-        })
+                "!!sessions_history": self.sessions_history + ["".join(self.session_input)],
+            }
+        else:
+            data = {
+                "instances": instances,
+                "!!removed_instances": [
+                    name for name in self.saved_states if name not in saved_states
+                ],
+                "!!dead_instances": self.dead_instances[self.saved_dead_instances:],
+                "!!session_input": "".join(new_input),
+            }
+        if binary:
+            self.send({
+                "operation": "instances",
+                "instance": "<meta>",
+                "id": self.save_id,
+                "codec": self.codec.name,
+                "extension": self.codec.extension,
+            }, buffers=[self.codec.encode(data)])
+        else:
+            self.send({
+                "operation": "instances",
+                "instance": "<meta>",
+                "id": self.save_id,
+                "base": None if full else self.save_id - 1,
+                "data": data,
+            })
+        self.saved_states = saved_states
+        self.saved_dead_instances = len(self.dead_instances)
 
-    def load_instances(self, data):
-        """Loads instances and syncs chat"""
+    def load_instances(self, data: dict | Snapshot):
+        """Loads instances and syncs chat.
+        Instances other than base are kept as stubs until they are first addressed.
+        Instances with unknown or missing modes become dead instances"""
+        snapshot = data if isinstance(data, Snapshot) else Snapshot.from_data(data)
         base_mode = self.chat_instances["base"].mode
         self.chat_instances = {}
-        self.dead_instances = data.get("!!dead_instances", [])
-        self.sessions_history = data.get("!!sessions_history", [])
-        for name, instance in data.get("instances", {}).items():
-            try:
-                self.chat_instances[name] = ChatInstance(self, name, instance["mode"])
-                self.chat_instances[name].load(instance)
-            except Exception:  # pylint: disable=broad-except
-                self.dead_instances.append(instance)
+        self.dead_instances = snapshot.get("!!dead_instances", [])
+        self.sessions_history = snapshot.get("!!sessions_history", [])
+        self.saved_states = {}
+        for name, saved in snapshot.instances.items():
+            if saved.mode in LOADERS:
+                self.chat_instances[name] = InstanceStub(saved)
+            else:
+                self.dead_instances.append(saved.data())
 
+        if "base" in self.chat_instances:
+            self.hydrate("base")
         if "base" not in self.chat_instances:
             self.chat_instances["base"] = ChatInstance(self, "base", base_mode).start_bot({})
 
         self.sync_meta()
-        for name, instance in self.chat_instances.items():
-            instance.refresh()
+        for instance in self.chat_instances.values():
+            if isinstance(instance, ChatInstance):
+                instance.refresh()
+
+    def hydrate(self, name: str) -> ChatInstance | None:
+        """Loads instance stub. Instances that fail to load become dead instances"""
+        instance = self.chat_instances[name]
+        if isinstance(instance, ChatInstance):
+            return instance
+        try:
+            loaded = self.chat_instances[name] = instance.hydrate(self)
+            return loaded
+        except Exception:  # pylint: disable=broad-except
+            print(traceback.format_exc())
+            del self.chat_instances[name]
+            self.dead_instances.append(instance.save())
+            return None
+
+    def get_instance(self, name: str) -> ChatInstance:
+        """Returns chat instance by name, loading it if it is a stub.
+        Raises KeyError if it does not exist or fails to load"""
+        instance = self.hydrate(name)
+        if instance is None:
+            self.sync_meta()
+            raise KeyError(name)
+        return instance
 
     def receive(self, msg):
-        """Receives requests"""
-        data = msg["content"]["data"]
+        """Receives requests. Replies are sent as a single batch"""
+        with self.batch():
+            self.dispatch(msg["content"]["data"], msg.get("buffers"))
+
+    def dispatch(self, data, buffers=None):
+        """Dispatches request to meta operations or chat instances"""
         try:
             instance = data["instance"]
             if instance == "<meta>":
-                operation = data.get("operation", "")
-                if operation == "new-instance":
-                    chat_instance = self.chat_instances[data["name"]] = ChatInstance(
-                        self, data["name"], data.get("mode", "base")
-                    ).start_bot(data.get("data", {}))
-                    chat_instance.sync_chat("init")
-                    self.sync_meta()
-                elif operation == "refresh":
-                    self.sync_meta()
-                elif operation == "remove-instance":
-                    self.dead_instances.append(
-                        self.chat_instances[data["name"]].save()
-                    )
-                    del self.chat_instances[data["name"]]
-                    self.sync_meta()
-                elif operation == "save-instances":
-                    self.save_instances()
-                elif operation == "load-instances":
-                    self.load_instances(data["data"])
+                self.operations.dispatch(self, data, self.stats, buffers)
                 return
-            instances = self.chat_instances.values()
-            if instance != "<all>":
-                instances = [self.chat_instances.get(instance, None)]
-            for chat_instance in instances:
-                chat_instance.receive(data)
+            names = [instance]
+            if instance == "<all>":
+                names = list(self.chat_instances)
+            for name in names:
+                self.get_instance(name).receive(data)
         except Exception:  # pylint: disable=broad-except
             print(traceback.format_exc())
             self.chat_instances["base"].send({
@@ -131,7 +245,65 @@ class KernelComm:
                 "message": traceback.format_exc(),
             })
 
+    @operations.register("new-instance")
+    def receive_new_instance(self, data, buffers=None):
+        """Creates and starts chat instance"""
+        # pylint: disable=unused-argument
+        chat_instance = self.chat_instances[data["name"]] = ChatInstance(
+            self, data["name"], data.get("mode", "base")
+        ).start_bot(data.get("data", {}))
+        chat_instance.sync_chat(
+            "init", limit=chat_instance.config["history_page_size"]
+        )
+        self.sync_meta()
+
+    @operations.register("refresh")
+    def receive_refresh(self, data, buffers=None):
+        """Sends list of loaders and instances"""
+        # pylint: disable=unused-argument
+        self.sync_meta()
+
+    @operations.register("remove-instance")
+    def receive_remove_instance(self, data, buffers=None):
+        """Removes chat instance"""
+        # pylint: disable=unused-argument
+        self.dead_instances.append(
+            self.chat_instances[data["name"]].save()
+        )
+        del self.chat_instances[data["name"]]
+        self.sync_meta()
+
+    @operations.register("save-instances")
+    def receive_save_instances(self, data, buffers=None):
+        """Saves instances"""
+        # pylint: disable=unused-argument
+        self.save_instances(data.get("full", False))
+
+    @operations.register("load-instances")
+    def receive_load_instances(self, data, buffers=None):
+        """Loads instances from data or from a binary snapshot buffer"""
+        if buffers:
+            self.load_instances(Snapshot.from_bytes(bytes(buffers[0])))
+        else:
+            self.load_instances(data["data"])
+
+    @operations.register("stats")
+    def receive_stats(self, data, buffers=None):
+        """Sends latency and payload statistics of dispatched operations.
+        payload=true starts measuring payloads and payload=false stops it"""
+        # pylint: disable=unused-argument
+        if "payload" in data:
+            self.stats.measure_payload = bool(data["payload"])
+        self.send({
+            "operation": "stats",
+            "instance": "<meta>",
+            "requestId": data.get("requestId"),
+            "stats": self.stats.report(),
+        })
+        if data.get("reset", False):
+            self.stats.reset()
+
     def reply(self, text, type_="bot", reply=None, instance="base"):
         """Replies message to user"""
         message = MessageContext.create_message(text, type_, reply)
-        self.chat_instances[instance].reply_message(message)
+        self.get_instance(instance).reply_message(message)
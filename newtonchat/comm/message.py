@@ -2,6 +2,8 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 
+import copy
+import sys
 import uuid
 from dataclasses import dataclass
 from datetime import datetime
@@ -11,7 +13,7 @@ from enum import IntEnum
 
 if TYPE_CHECKING:
     from ..bots.newton.states.state import StateDefinition
-    from typing import Sequence, TypedDict
+    from typing import Any, Sequence, TypedDict
 
     from .kernelcomm import KernelComm
     from .chat_instance import ChatInstance
@@ -59,13 +61,204 @@ class KernelProcess(IntEnum):
     FORCE = 2
 
 
+# Maps IChatMessage keys to ChatMessage attributes
+_FIELDS = {
+    "id": "id",
+    "text": "text",
+    "type": "type",
+    "timestamp": "timestamp",
+    "reply": "reply",
+    "display": "display",
+    "kernelProcess": "kernel_process",
+    "kernelDisplay": "kernel_display",
+    "feedback": "feedback",
+    "loading": "loading",
+    "alternatives": "alternatives",
+    "selectedAlt": "selected_alt",
+    "inConversationContext": "in_conversation_context",
+}
+
+
+class ChatMessage:
+    """Compact in-memory message.
+    Supports dict-like access with IChatMessage keys and converts to IChatMessage with to_dict.
+    Empty feedback and alternatives are only created when accessed.
+    Messages created by share use the same feedback, alternatives and extra
+    containers as the original until one of them is accessed for writing"""
+    # pylint: disable=too-many-instance-attributes
+
+    __slots__ = (
+        "id", "text", "type", "timestamp", "reply", "display",
+        "kernel_process", "kernel_display", "loading", "selected_alt",
+        "in_conversation_context", "_feedback", "_alternatives", "_extra", "_shared",
+    )
+
+    def __init__(
+        self,
+        id_: str,
+        text: str,
+        type_: str,
+        timestamp: int,
+        reply: str | None = None,
+        display: MessageDisplay = MessageDisplay.DEFAULT,
+        kernel_process: KernelProcess = KernelProcess.PREVENT,
+        kernel_display: MessageDisplay = MessageDisplay.DEFAULT,
+        loading: bool = False,
+        selected_alt: int = -1,
+        in_conversation_context: bool = False,
+    ):
+        # pylint: disable=too-many-arguments
+        self.id = id_  # pylint: disable=invalid-name
+        self.text = text
+        self.type = sys.intern(type_)
+        self.timestamp = timestamp
+        self.reply = reply
+        self.display = display
+        self.kernel_process = kernel_process
+        self.kernel_display = kernel_display
+        self.loading = loading
+        self.selected_alt = selected_alt
+        self.in_conversation_context = in_conversation_context
+        self._feedback: IFeedback | None = None
+        self._alternatives: list[str] | None = None
+        self._extra: dict[str, Any] | None = None
+        self._shared = False
+
+    def _own(self):
+        """Copies shared containers before they are modified"""
+        if self._shared:
+            self._shared = False
+            if self._feedback is not None:
+                self._feedback = {**self._feedback}
+            if self._alternatives is not None:
+                self._alternatives = [*self._alternatives]
+            if self._extra is not None:
+                self._extra = {
+                    key: copy.deepcopy(value) for key, value in self._extra.items()
+                }
+
+    @property
+    def feedback(self) -> IFeedback:
+        """Returns message feedback"""
+        self._own()
+        if self._feedback is None:
+            self._feedback = {"rate": 0, "reason": "", "otherreason": ""}
+        return self._feedback
+
+    @feedback.setter
+    def feedback(self, value: IFeedback):
+        self._feedback = value
+
+    @property
+    def alternatives(self) -> list[str]:
+        """Returns message alternatives"""
+        self._own()
+        if self._alternatives is None:
+            self._alternatives = []
+        return self._alternatives
+
+    @alternatives.setter
+    def alternatives(self, value: list[str]):
+        self._alternatives = value or None
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _FIELDS:
+            return getattr(self, _FIELDS[key])
+        if self._extra is not None and key in self._extra:
+            self._own()
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any):
+        if key in _FIELDS:
+            if key == "type":
+                value = sys.intern(value)
+            setattr(self, _FIELDS[key], value)
+        else:
+            self._own()
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        return key in _FIELDS or (self._extra is not None and key in self._extra)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Returns attribute by IChatMessage key"""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def copy(self) -> ChatMessage:
+        """Returns copy of message that does not share mutable attributes"""
+        shared = self._shared
+        result = self.share()
+        self._shared = shared
+        result._own()
+        return result
+
+    def share(self) -> ChatMessage:
+        """Returns copy of message that shares mutable attributes until they are modified.
+        Both messages copy the containers on their next write"""
+        result = ChatMessage.__new__(ChatMessage)
+        for slot in ChatMessage.__slots__:
+            setattr(result, slot, getattr(self, slot))
+        result._shared = self._shared = True
+        return result
+
+    def to_dict(self) -> IChatMessage:
+        """Converts message to IChatMessage.
+        Feedback and alternatives are copied, so the result can be changed or queued"""
+        result: IChatMessage = {
+            "id": self.id,
+            "text": self.text,
+            "type": self.type,
+            "timestamp": self.timestamp,
+            "reply": self.reply,
+            "display": self.display,
+            "kernelProcess": self.kernel_process,
+            "kernelDisplay": self.kernel_display,
+            "feedback": {**self._feedback} if self._feedback is not None else {
+                "rate": 0, "reason": "", "otherreason": "",
+            },
+            "loading": self.loading,
+            "alternatives": list(self._alternatives or ()),
+            "selectedAlt": self.selected_alt,
+            "inConversationContext": self.in_conversation_context,
+        }
+        if self._extra:
+            result.update(self._extra)  # type: ignore
+        return result
+
+    @classmethod
+    def from_dict(cls, data: IChatMessage | dict[str, Any]) -> ChatMessage:
+        """Creates message from IChatMessage"""
+        message = cls(data["id"], data["text"], data["type"], data["timestamp"])
+        for key, value in data.items():
+            if key not in ("id", "text", "type", "timestamp"):
+                message[key] = value
+        feedback = message._feedback
+        if feedback is not None and not any(feedback.values()):
+            message._feedback = None
+        return message
+
+    @classmethod
+    def coerce(cls, message: ChatMessage | IChatMessage | dict[str, Any]) -> ChatMessage:
+        """Returns ChatMessage for either representation"""
+        if isinstance(message, ChatMessage):
+            return message
+        return cls.from_dict(message)
+
+
 @dataclass
 class MessageContext:
     """Represents a message context"""
 
     comm: KernelComm
     instance: ChatInstance
-    original_message: IChatMessage
+    original_message: ChatMessage
+    placeholder: ChatMessage | None = None
 
     @staticmethod
     def create_message(
@@ -74,33 +267,27 @@ class MessageContext:
         reply: str | None = None,
         display: MessageDisplay = MessageDisplay.DEFAULT,
         in_conversation_context: bool = False,
-    ) -> IChatMessage:
-        """Creates IChatMessage"""
-        alternatives = []
+    ) -> ChatMessage:
+        """Creates ChatMessage"""
+        alternatives = None
         selected_alt = -1
         if isinstance(text, list):
             alternatives = text
             text = text[0]
             selected_alt = 0
-        return {
-            "id": str(uuid.uuid4()),
-            "text": text,
-            "type": type_,
-            "timestamp": int(datetime.timestamp(datetime.now())*1000),
-            "reply": reply,
-            "display": display,
-            "kernelProcess": KernelProcess.PREVENT,
-            "kernelDisplay": MessageDisplay.DEFAULT,
-            "feedback": {
-                "rate": 0,
-                "reason": "",
-                "otherreason": "",
-            },
-            "loading": False,
-            "alternatives": alternatives,
-            "selectedAlt": selected_alt,
-            "inConversationContext": in_conversation_context,
-        }
+        message = ChatMessage(
+            str(uuid.uuid4()),
+            text,
+            type_,
+            int(datetime.timestamp(datetime.now())*1000),
+            reply,
+            display,
+            selected_alt=selected_alt,
+            in_conversation_context=in_conversation_context,
+        )
+        if alternatives:
+            message.alternatives = alternatives
+        return message
 
     @property
     def text(self):
@@ -119,9 +306,37 @@ class MessageContext:
             self.original_message['kernelDisplay'],
             in_conversation_context
         )
+        placeholder = self.placeholder
+        if placeholder is not None:
+            self.placeholder = None
+            for key in ("text", "type", "timestamp", "alternatives", "selectedAlt",
+                        "inConversationContext"):
+                placeholder[key] = message[key]
+            placeholder.loading = False
+            message = placeholder
         if checkpoint is not None:
             self.instance.checkpoints[message['id']] = checkpoint
-        self.instance.reply_message(message)
+        if placeholder is not None:
+            self.instance.update_message(message)
+        else:
+            self.instance.reply_message(message)
+
+    def create_placeholder(self) -> ChatMessage:
+        """Replies an empty loading message that the next reply fills"""
+        if self.placeholder is None:
+            message = self.create_message(
+                "", "bot", self.original_message['id'], self.original_message['kernelDisplay']
+            )
+            message.loading = True
+            self.placeholder = self.instance.reply_message(message)
+        return self.placeholder
+
+    def release_placeholder(self):
+        """Stops the loading state of the placeholder if the bot has not replied to it"""
+        if self.placeholder is not None:
+            self.placeholder.loading = False
+            self.instance.update_message(self.placeholder)
+            self.placeholder = None
 
     def reply_options(
         self,
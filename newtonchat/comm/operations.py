@@ -0,0 +1,150 @@
+"""Defines operation registries and dispatch metrics"""
+from __future__ import annotations
+import json
+import math
+import time
+from typing import TYPE_CHECKING, Any, Callable
+
+if TYPE_CHECKING:
+    from typing import Iterable
+
+
+class Histogram:
+    """Log-scale histogram. Each bucket covers values up to 2**(1/4) times larger
+    than the previous one, so percentiles are estimated with at most 19% error"""
+
+    base = 2 ** 0.25
+
+    def __init__(self):
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = 0.0
+
+    def record(self, value: float):
+        """Adds value to histogram"""
+        index = math.ceil(math.log(value, self.base)) if value > 0 else -1000
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def percentile(self, percent: float) -> float:
+        """Returns upper bound of the bucket that contains the percentile"""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return max(min(self.base ** index if index > -1000 else 0.0, self.maximum), self.minimum)
+        return self.maximum
+
+    def to_dict(self) -> dict[str, float]:
+        """Summarizes histogram"""
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "min": self.minimum if self.count else 0.0,
+            "max": self.maximum,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class OperationStats:
+    """Latency (ms) and payload (bytes) histograms per scope and operation.
+    Measuring payloads encodes every request again, so it is disabled by default"""
+
+    def __init__(self, measure_payload: bool = False):
+        self.measure_payload = measure_payload
+        self.latency: dict[tuple[str, str], Histogram] = {}
+        self.payload: dict[tuple[str, str], Histogram] = {}
+
+    def record(self, scope: str, operation: str, latency: float, payload: int | None = None):
+        """Records dispatch of operation"""
+        key = (scope, operation)
+        if key not in self.latency:
+            self.latency[key] = Histogram()
+            self.payload[key] = Histogram()
+        self.latency[key].record(latency)
+        if payload is not None:
+            self.payload[key].record(payload)
+
+    def report(self) -> dict[str, dict[str, dict[str, dict[str, float]]]]:
+        """Returns summaries grouped by scope and operation"""
+        result: dict[str, dict[str, dict[str, dict[str, float]]]] = {}
+        for (scope, operation), latency in self.latency.items():
+            result.setdefault(scope, {})[operation] = {
+                "latency_ms": latency.to_dict(),
+                "payload_bytes": self.payload[(scope, operation)].to_dict(),
+            }
+        return result
+
+    def reset(self):
+        """Removes all records"""
+        self.latency.clear()
+        self.payload.clear()
+
+
+def payload_size(data: Any, buffers: Iterable[Any] | None = None) -> int:
+    """Returns the size of the json encoded data plus the size of binary buffers"""
+    size = len(json.dumps(data, separators=(',', ':'), default=str))
+    for buffer in buffers or ():
+        size += memoryview(buffer).nbytes
+    return size
+
+
+class OperationRegistry:
+    """Maps operation names to handlers.
+    Handlers receive the owner of the registry and the request data.
+    If buffers is set, they also receive the binary buffers of the request.
+    Bots and extensions can add operations with register"""
+
+    def __init__(self, scope: str, buffers: bool = False):
+        self.scope = scope
+        self.buffers = buffers
+        self.handlers: dict[str, Callable[..., Any]] = {}
+
+    def register(self, operation: str, handler: Callable[..., Any] | None = None):
+        """Registers handler for operation. Works as a decorator if handler is not given"""
+        if handler is not None:
+            self.handlers[operation] = handler
+            return handler
+
+        def decorator(function: Callable[..., Any]) -> Callable[..., Any]:
+            self.handlers[operation] = function
+            return function
+        return decorator
+
+    def __contains__(self, operation: str) -> bool:
+        return operation in self.handlers
+
+    def dispatch(
+        self, owner: Any, data: dict[str, Any],
+        stats: OperationStats | None = None, buffers: list[Any] | None = None
+    ) -> bool:
+        """Calls the handler of data["operation"] and records its latency and payload.
+        Returns False if the operation is not registered"""
+        operation = data.get("operation", "")
+        handler = self.handlers.get(operation)
+        if handler is None:
+            return False
+        args = (owner, data, buffers) if self.buffers else (owner, data)
+        if stats is None:
+            handler(*args)
+            return True
+        start = time.perf_counter()
+        try:
+            handler(*args)
+        finally:
+            stats.record(
+                self.scope, operation,
+                (time.perf_counter() - start) * 1000,
+                payload_size(data, buffers) if stats.measure_payload else None
+            )
+        return True
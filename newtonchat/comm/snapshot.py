@@ -0,0 +1,392 @@
+"""Defines saved instances snapshots"""
+from __future__ import annotations
+import json
+import os
+import re
+import struct
+import zlib
+from collections import Counter
+from functools import partial
+from typing import Any, Callable
+
+
+def apply_arg(data, arg, value):
+    """Change value of dict attribute"""
+    args = arg.split('.', 1)
+    if len(args) > 1:
+        step = args[0]
+        if step.startswith('__'):
+            step = int(step[2:])
+        new_data = data[step] if step else data
+        apply_arg(new_data, args[1], value)
+    else:
+        data[arg] = value
+
+
+# Skips everything up to the next bracket that is not inside a string
+_SKIP = re.compile(r'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
+# Strings, colons and commas of shallow segments
+_TOKEN = re.compile(r'"(?:[^"\\]+|\\.)*"|[:,]')
+
+
+class _Frame:
+    """Open bracket during scan"""
+    __slots__ = ("start", "key", "items", "mode", "children")
+
+    def __init__(self, start: int, key: str | None):
+        self.start = start
+        self.key = key
+        self.items = 0
+        self.mode: str | None = None
+        self.children: dict[str, tuple[int, int, int]] = {}
+
+
+def scan_snapshot(text: str) -> tuple[dict[str, tuple[int, int]], dict[str, _Frame]]:
+    """Finds the spans of top-level sections and saved instances without decoding them.
+    Only brackets are visited below the instance level. Raises ValueError if the text
+    is not an object with container sections"""
+    # pylint: disable=too-many-branches
+    stack: list[_Frame] = []
+    sections: dict[str, tuple[int, int]] = {}
+    instances: dict[str, _Frame] = {}
+    length = len(text)
+    pos = 0
+    while True:
+        end = _SKIP.match(text, pos).end()  # type: ignore
+        depth = len(stack)
+        tokens = _TOKEN.findall(text, pos, end) if depth <= 3 else []
+        if end >= length:
+            if depth or not sections:
+                raise ValueError("Invalid snapshot")
+            return sections, instances
+        if depth == 1 and ':' in (tokens[:-1] if text[end] in "{[" else tokens):
+            # Scalar sections are not indexed
+            raise ValueError("Invalid snapshot")
+        if depth == 3:
+            for index, token in enumerate(tokens[:-2]):
+                if token == '"mode"' and tokens[index + 1] == ':':
+                    stack[2].mode = json.loads(tokens[index + 2])
+        if text[end] in "{[":
+            key = None
+            if depth and len(tokens) >= 2 and tokens[-1] == ':':
+                key = json.loads(tokens[-2])
+            if depth == 0 and text[end] != "{":
+                raise ValueError("Invalid snapshot")
+            if depth:
+                stack[-1].items += 1
+            stack.append(_Frame(end, key))
+        else:
+            if not stack:
+                raise ValueError("Invalid snapshot")
+            frame = stack.pop()
+            depth = len(stack)
+            if depth == 1:
+                sections[frame.key or ""] = (frame.start, end + 1)
+            elif depth == 2 and stack[1].key == "instances":
+                instances[frame.key or ""] = frame
+                frame.children[""] = (frame.start, end + 1, frame.items)
+            elif depth == 3 and stack[1].key == "instances":
+                stack[2].children[frame.key or ""] = (frame.start, end + 1, frame.items)
+        pos = end + 1
+
+
+class SavedInstance:
+    """Saved instance that is only decoded when it is loaded.
+    The mode is None if the saved instance does not define it"""
+
+    def __init__(
+        self, name: str, mode: str | None, config: dict[str, Any], message_count: int,
+        data: dict[str, Any] | None = None, decode: Callable[[], dict[str, Any]] | None = None
+    ):
+        # pylint: disable=too-many-arguments
+        self.name = name
+        self.mode = mode
+        self.config = config
+        self.message_count = message_count
+        self._data = data
+        self._decode = decode
+        self.overrides: list[tuple[str, Any]] = []
+
+    @classmethod
+    def from_data(cls, name: str, data: dict[str, Any]) -> SavedInstance:
+        """Creates saved instance from decoded data"""
+        return cls(
+            name, data.get("mode"), data.get("config", {}), len(data.get("history", [])), data
+        )
+
+    def data(self) -> dict[str, Any]:
+        """Decodes instance and applies overrides"""
+        if self._data is None:
+            self._data = self._decode()  # type: ignore
+            self._decode = None
+        for arg, value in self.overrides:
+            apply_arg(self._data, arg, value)
+        self.overrides = []
+        return self._data
+
+
+class Snapshot:
+    """Instances snapshot. Instance sections are only decoded when they are loaded"""
+
+    def __init__(self):
+        self.sections: dict[str, Any] = {}
+        self.instances: dict[str, SavedInstance] = {}
+
+    @classmethod
+    def from_data(cls, data: dict[str, Any]) -> Snapshot:
+        """Creates snapshot from decoded data"""
+        snapshot = cls()
+        snapshot.sections = {key: value for key, value in data.items() if key != "instances"}
+        snapshot.instances = {
+            name: SavedInstance.from_data(name, instance)
+            for name, instance in data.get("instances", {}).items()
+        }
+        return snapshot
+
+    @classmethod
+    def from_text(cls, text: str) -> Snapshot:
+        """Creates snapshot from json text, decoding only the instance fields used by stubs"""
+        try:
+            sections, frames = scan_snapshot(text)
+        except ValueError:
+            return cls.from_data(json.loads(text))
+        snapshot = cls()
+        snapshot.sections = {
+            key: json.loads(text[start:end])
+            for key, (start, end) in sections.items() if key != "instances"
+        }
+        for name, frame in frames.items():
+            config = frame.children.get("config")
+            start, end, _ = frame.children[""]
+            snapshot.instances[name] = SavedInstance(
+                name,
+                frame.mode,
+                json.loads(text[config[0]:config[1]]) if config else {},
+                frame.children.get("history", (0, 0, 0))[2],
+                decode=partial(json.loads, text[start:end]),
+            )
+        return snapshot
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> Snapshot:
+        """Creates snapshot from the output of any snapshot codec"""
+        for codec in SNAPSHOT_CODECS.values():
+            if codec.magic and raw.startswith(codec.magic):
+                return codec().decode(raw)
+        return cls.from_text(raw.decode("utf-8"))
+
+    @classmethod
+    def open(cls, filename: str) -> Snapshot:
+        """Reads snapshot file"""
+        with open(filename, 'rb') as fil:
+            return cls.from_bytes(fil.read())
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Returns top-level section"""
+        return self.sections.get(key, default)
+
+    def apply_arg(self, arg: str, value: Any):
+        """Change value of snapshot attribute. Instance overrides are applied when they load"""
+        steps = [step for step in arg.split('.') if step]
+        if len(steps) > 2 and steps[0] == "instances" and steps[1] in self.instances:
+            self.instances[steps[1]].overrides.append(('.'.join(steps[2:]), value))
+        elif len(steps) == 2 and steps[0] == "instances":
+            self.instances[steps[1]] = SavedInstance.from_data(steps[1], value)
+        elif steps and steps[0] != "instances":
+            apply_arg(self.sections, '.'.join(steps), value)
+        else:
+            data = self.to_data()
+            apply_arg(data, arg, value)
+            loaded = Snapshot.from_data(data)
+            self.sections, self.instances = loaded.sections, loaded.instances
+
+    def to_data(self) -> dict[str, Any]:
+        """Decodes the whole snapshot"""
+        return {
+            **self.sections,
+            "instances": {name: instance.data() for name, instance in self.instances.items()},
+        }
+
+
+class JSONCodec:
+    """Encodes snapshots as json text"""
+    name = "json"
+    extension = ".json"
+    magic = b""
+
+    def encode(self, data: dict[str, Any]) -> bytes:
+        """Encodes snapshot data"""
+        # pylint: disable=no-self-use
+        return json.dumps(data).encode("utf-8")
+
+    def decode(self, raw: bytes) -> Snapshot:
+        """Decodes snapshot"""
+        # pylint: disable=no-self-use
+        return Snapshot.from_text(raw.decode("utf-8"))
+
+
+# Message keys stored by position in binary history rows
+_MESSAGE_KEYS = (
+    "id", "text", "type", "timestamp", "reply", "display", "kernelProcess",
+    "kernelDisplay", "feedback", "loading", "alternatives", "selectedAlt",
+    "inConversationContext",
+)
+
+
+class BinaryCodec:
+    """Encodes snapshots as zlib compressed blocks.
+    Format: magic, version (u8), index length (u32), index, blocks.
+    The index describes sections, the string table and one block per instance,
+    so instances are only decompressed when they are loaded.
+    History messages are stored as rows of values in _MESSAGE_KEYS order.
+    Texts and alternatives that repeat across the snapshot (e.g., replicated
+    base chat messages) are stored once in the string table"""
+    name = "binary"
+    extension = ".newton"
+    magic = b"NWTS"
+    version = 1
+    header = struct.Struct(">BI")
+
+    def __init__(self, level: int = 6, min_shared_length: int = 32):
+        self.level = level
+        self.min_shared_length = min_shared_length
+
+    def _block(self, value: Any, blocks: list[bytes], offset: list[int]) -> list[int]:
+        """Compresses value into a new block and returns its position"""
+        block = zlib.compress(
+            json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode("utf-8"),
+            self.level
+        )
+        blocks.append(block)
+        position = [offset[0], len(block)]
+        offset[0] += len(block)
+        return position
+
+    def _shared_strings(self, instances: dict[str, Any]) -> dict[str, int]:
+        """Returns repeated texts and alternatives mapped to their string table index"""
+        counter: Counter[str] = Counter()
+        for instance in instances.values():
+            for message in instance.get("history", []):
+                if not isinstance(message, dict):
+                    continue
+                text = message.get("text")
+                if isinstance(text, str) and len(text) >= self.min_shared_length:
+                    counter[text] += 1
+                for alternative in message.get("alternatives") or []:
+                    if isinstance(alternative, str) and len(alternative) >= self.min_shared_length:
+                        counter[alternative] += 1
+        shared = [text for text, count in counter.items() if count > 1]
+        return {text: index for index, text in enumerate(shared)}
+
+    @staticmethod
+    def _row(message: dict[str, Any], strings: dict[str, int]) -> list[Any] | dict[str, Any]:
+        """Converts message to row. Messages without all keys are kept as dicts"""
+        try:
+            row = [message[key] for key in _MESSAGE_KEYS]
+        except (KeyError, TypeError):
+            return message
+        row[1] = strings.get(row[1], row[1])
+        if row[10]:
+            row[10] = [strings.get(alternative, alternative) for alternative in row[10]]
+        if len(message) > len(_MESSAGE_KEYS):
+            row.append({key: value for key, value in message.items() if key not in _MESSAGE_KEYS})
+        return row
+
+    @staticmethod
+    def _message(row: list[Any] | dict[str, Any], strings: list[str]) -> dict[str, Any]:
+        """Converts row back to message"""
+        if isinstance(row, dict):
+            return row
+        message = dict(zip(_MESSAGE_KEYS, row))
+        if isinstance(row[1], int):
+            message["text"] = strings[row[1]]
+        if row[10]:
+            message["alternatives"] = [
+                strings[alternative] if isinstance(alternative, int) else alternative
+                for alternative in row[10]
+            ]
+        if len(row) > len(_MESSAGE_KEYS):
+            message.update(row[-1])
+        return message
+
+    def encode(self, data: dict[str, Any]) -> bytes:
+        """Encodes snapshot data"""
+        instances = data.get("instances", {})
+        strings = self._shared_strings(instances)
+        blocks: list[bytes] = []
+        offset = [0]
+        index: dict[str, Any] = {
+            "sections": self._block(
+                {key: value for key, value in data.items() if key != "instances"}, blocks, offset
+            ),
+            "strings": self._block(list(strings), blocks, offset),
+            "instances": {},
+        }
+        for name, instance in instances.items():
+            history = instance.get("history", [])
+            index["instances"][name] = {
+                "mode": instance.get("mode"),
+                "config": instance.get("config", {}),
+                "messages": len(history),
+                "block": self._block({
+                    "data": {key: value for key, value in instance.items() if key != "history"},
+                    "history": [self._row(message, strings) for message in history]
+                    if "history" in instance else None,
+                }, blocks, offset),
+            }
+        encoded_index = zlib.compress(json.dumps(index).encode("utf-8"), self.level)
+        return b"".join([
+            self.magic,
+            self.header.pack(self.version, len(encoded_index)),
+            encoded_index,
+            *blocks
+        ])
+
+    def decode(self, raw: bytes) -> Snapshot:
+        """Decodes snapshot index. Instances are decoded when they are loaded"""
+        view = memoryview(raw)
+        start = len(self.magic)
+        version, index_length = self.header.unpack_from(view, start)
+        if version != self.version:
+            raise ValueError(f"Unsupported snapshot version {version}")
+        start += self.header.size
+        index = json.loads(zlib.decompress(view[start:start + index_length]))
+        start += index_length
+
+        def read_block(position: list[int]) -> Any:
+            block_start = start + position[0]
+            return json.loads(zlib.decompress(view[block_start:block_start + position[1]]))
+
+        strings: list[list[str]] = []
+
+        def decode_instance(position: list[int]) -> dict[str, Any]:
+            if not strings:
+                strings.append(read_block(index["strings"]))
+            block = read_block(position)
+            data = block["data"]
+            if block["history"] is not None:
+                data["history"] = [self._message(row, strings[0]) for row in block["history"]]
+            return data
+
+        snapshot = Snapshot()
+        snapshot.sections = read_block(index["sections"])
+        for name, instance in index["instances"].items():
+            snapshot.instances[name] = SavedInstance(
+                name, instance["mode"], instance["config"], instance["messages"],
+                decode=partial(decode_instance, instance["block"])
+            )
+        return snapshot
+
+
+SNAPSHOT_CODECS = {
+    "json": JSONCodec,
+    "binary": BinaryCodec,
+}
+
+
+def create_codec():
+    """Creates the snapshot codec defined by the NewtonSnapshotCodec environment variable.
+    The variable has the format <codec>?<json args>. E.g.: binary?{"level": 9}"""
+    definition = os.environ.get("NewtonSnapshotCodec", "json").split('?', 1)
+    args = json.loads(definition[1]) if len(definition) > 1 else {}
+    return SNAPSHOT_CODECS[definition[0]](**args)
@@ -48,6 +48,10 @@ export function createChatInstance(model: NotebookCommModel, chatName: string, m
     }
   
     let messageMap: { [key: string]: { position: number, message: IChatMessage} } = {};
+    let seq = -1;
+    let epoch: string | null = null;
+    let historyStart: Writable<number> = writable(0);
+    let loadingOlder = false;
     const { subscribe, set, update } = writable(current);
   
     function push(newMessage: IChatMessage) {
@@ -72,12 +76,17 @@ export function createChatInstance(model: NotebookCommModel, chatName: string, m
       model.sendMessageKernel(chatName, newMessage);
     }
   
-    function load(data: IChatMessage[]) {
-      current = data;
+    function rebuildMessageMap() {
       messageMap = {};
       current.forEach((message, index) => {
         messageMap[message['id']] = { position: index, message: message };
       });
+    }
+
+    function load(data: IChatMessage[], start: number = 0) {
+      current = data;
+      historyStart.set(start);
+      rebuildMessageMap();
       const lastMessage = data[data.length - 1];
       if ((get(wizardMode) != (lastMessage.type != 'user')) && !['kernel', 'build'].includes(checkTarget(lastMessage))) {
         replying.set(lastMessage['id']);
@@ -92,6 +101,54 @@ export function createChatInstance(model: NotebookCommModel, chatName: string, m
       set(current);
     }
   
+    function applyDelta(delta: { changed: IChatMessage[], appended: IChatMessage[] }) {
+      for (const message of delta.changed) {
+        // Changed messages may be older than the loaded window
+        if (message['id'] in messageMap) {
+          updateMessage(message);
+        }
+      }
+      for (const message of delta.appended) {
+        if (message['id'] in messageMap) {
+          updateMessage(message);
+        } else {
+          push(message);
+        }
+      }
+    }
+
+    function loadOlder() {
+      if (loadingOlder || get(historyStart) <= 0 || current.length == 0) {
+        return;
+      }
+      loadingOlder = true;
+      model.sendHistoryPage(chatName, current[0]['id']);
+    }
+
+    function prependPage(messages: IChatMessage[], start: number) {
+      // Pages arrive newest first
+      const older = messages.filter((message) => !(message['id'] in messageMap)).reverse();
+      current = [...older, ...current];
+      historyStart.set(Math.min(start, get(historyStart)));
+      loadingOlder = false;
+      rebuildMessageMap();
+      set(current);
+    }
+
+    function setVersion(newSeq: number | undefined, newEpoch?: string) {
+      if (newSeq !== undefined) {
+        seq = newSeq;
+      }
+      if (newEpoch !== undefined) {
+        epoch = newEpoch;
+      }
+    }
+
+    function isStale(newEpoch?: string) {
+      // The kernel replaced the history (e.g., loaded instances) after our last sync
+      return epoch !== null && newEpoch !== undefined && newEpoch !== epoch;
+    }
+
     function submitSyncMessage(message: Pick<IChatMessage, 'id'> & Subset<IChatMessage>) {
       model.sendSyncMessage(chatName, message);
     }
@@ -106,6 +163,10 @@ export function createChatInstance(model: NotebookCommModel, chatName: string, m
     function reset() {
       current = [];
       messageMap = {};
+      seq = -1;
+      epoch = null;
+      historyStart.set(0);
+      loadingOlder = false;
       autoCompleteResponseId.set(-1);
       autoCompleteItems.set([]);
       set(current);
@@ -132,7 +193,7 @@ export function createChatInstance(model: NotebookCommModel, chatName: string, m
   
     function refresh() {
       console.log("refresh", chatName)
-      model.sendRefreshInstance(chatName);
+      model.sendRefreshInstance(chatName, seq, epoch);
     }
   
     return {
@@ -144,6 +205,11 @@ export function createChatInstance(model: NotebookCommModel, chatName: string, m
       push,
       addNew,
       load,
+      applyDelta,
+      setVersion,
+      isStale,
+      loadOlder,
+      prependPage,
       submitSyncMessage,
       updateMessage,
       removeLoading,
@@ -160,6 +226,7 @@ export function createChatInstance(model: NotebookCommModel, chatName: string, m
       autoCompleteResponseId,
       autoCompleteItems,
       replying,
+      historyStart,
 
       botLoader,
       botConfig
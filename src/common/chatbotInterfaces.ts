@@ -101,7 +101,12 @@ export type ILoaderForm = { [formkey: string]: [string, any] }
 
 export interface IChatInstanceInfo {
   mode: string;
-  history: IChatMessage[];
+  history?: IChatMessage[];
+  history_start?: number;
+  history_total: number;
+  delta?: { changed: IChatMessage[], appended: IChatMessage[] };
+  seq: number;
+  epoch: string;
   config: { [id: string]: any };
   bot_config: { [id: string]: string | null };
   bot_config_loader: ILoaderForm;
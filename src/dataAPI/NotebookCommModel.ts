@@ -9,6 +9,7 @@ import {
   kernelStatus,
   wizardMode,
   instancesConfig,
+  wizardOpenChatInstance,
 } from '../stores';
 import { NotebookActions, type NotebookPanel } from '@jupyterlab/notebook';
 import type {
@@ -35,6 +36,7 @@ export class NotebookCommModel {
   private _language: IKernelMatcher;
   public chatInstances: Writable<{ [id: string]: IChatInstance }>;
   public chatLoaders: Writable<{ [id: string]: ILoaderForm }>;
+  private _savedInstances: { id: number, data: any } | null;
   /*private _boundQueryCall: (
     sess: ISessionContext,
     args: KernelMessage.IMessage<KernelMessage.MessageType>
@@ -49,6 +51,7 @@ export class NotebookCommModel {
       "base": createChatInstance(this, "base", "newton", {}, {}) // Passing this here may cause a memory leak, but I haven't checked
     });
     this.chatLoaders = writable({});
+    this._savedInstances = null;
     //this._boundQueryCall = this._queryCall.bind(this);
   }
 
@@ -146,6 +149,7 @@ export class NotebookCommModel {
   public resetData() {
     connectionReady.set(false);
     kernelStatus.reset();
+    this._savedInstances = null;
     for (const chatInstance of Object.values(get(this.chatInstances))) {
       chatInstance.reset();
     }
@@ -155,7 +159,7 @@ export class NotebookCommModel {
    * Send data to icomm
    * @param data
    */
-  public send(data: JSONObject): void {
+  public send(data: JSONObject, buffers?: (ArrayBuffer | ArrayBufferView)[]): void {
     const session = this._sessionContext.session;
     if (
       this._icomm &&
@@ -163,7 +167,7 @@ export class NotebookCommModel {
       session.kernel &&
       session.kernel.hasComm(this._icomm.commId)
     ) {
-      this._icomm.send(data);
+      this._icomm.send(data, undefined, buffers);
     }
   }
 
@@ -233,37 +237,72 @@ export class NotebookCommModel {
   }
 
   /**
-   * Send a save command to the kernel
+   * Send a save command to the kernel.
+   * The kernel replies a patch of the previous save unless full is set
    */
-  public sendSaveInstances(): void {
+  public sendSaveInstances(full: boolean = false): void {
     this.send({
       operation: 'save-instances',
-      instance: '<meta>'
+      instance: '<meta>',
+      full
+    });
+  }
+
+  /**
+   * Ask the kernel for the latency and payload statistics of each operation.
+   * Payloads are only measured after a request with payload set to true
+   */
+  public sendStats(reset: boolean = false, payload?: boolean): void {
+    this.send({
+      operation: 'stats',
+      instance: '<meta>',
+      reset,
+      ...(payload === undefined ? {} : { payload })
     });
   }
 
   /**
-   * Send a save command to the kernel
+   * Send a load command to the kernel.
+   * Snapshots encoded by binary codecs are sent as a buffer
    */
-  public sendLoadInstances(data: any): void {
+  public sendLoadInstances(data: any, buffer?: ArrayBuffer): void {
     this.send({
       operation: 'load-instances',
       instance: '<meta>',
       data
-    });
+    }, buffer === undefined ? undefined : [buffer]);
   }
 
 
   /**
-   * Send a refresh command to the kernel
+   * Send a refresh command to the kernel.
+   * The kernel replies only the changed messages if seq and epoch match its history
    */
-  public sendRefreshInstance(instance: string): void {
+  public sendRefreshInstance(instance: string, since: number = -1, epoch: string | null = null): void {
     this.send({
       operation: 'refresh',
-      instance
+      instance,
+      since: since < 0 ? null : since,
+      epoch
     });
   }
 
+  /**
+   * Send a history page request to the kernel.
+   * The kernel replies the messages before the cursor, newest first
+   */
+  public sendHistoryPage(instance: string, cursor: string | null, before?: number): void {
+    const data: JSONObject = {
+      operation: 'history-page',
+      instance,
+      cursor
+    };
+    if (before !== undefined) {
+      data.before = before;
+    }
+    this.send(data);
+  }
+
   /**
    * Send a config command to the kernel
    */
@@ -354,7 +393,13 @@ export class NotebookCommModel {
    */
 
   private _loadInstanceInfo(chatInstance: IChatInstance, info: IChatInstanceInfo) {
-    chatInstance.load(info.history);
+    if (info.delta !== undefined) {
+      chatInstance.applyDelta(info.delta);
+      chatInstance.setVersion(info.seq, info.epoch);
+    } else if (info.history !== undefined) {
+      chatInstance.load(info.history, info.history_start);
+      chatInstance.setVersion(info.seq, info.epoch);
+    }
     this._loadInstanceConfig(chatInstance, info.config);
     chatInstance.botConfig.set(info.bot_config);
     chatInstance.botLoader.set(info.bot_config_loader);
@@ -370,6 +415,10 @@ export class NotebookCommModel {
     }
   }
 
+  private _isOpen(instance: string): boolean {
+    return instance === 'base' || (get(wizardOpenChatInstance)[instance] || 0) > 0;
+  }
+
   private _loadInstances(instances: { [id: string]: IChatInstanceInfo }) {
     let changed = false;
     let chatInstancesObj = get(this.chatInstances);
@@ -384,9 +433,12 @@ export class NotebookCommModel {
         chatInstancesObj[instance] = createChatInstance(
           this, instance, info.mode, info.bot_config_loader, info.bot_config
         );
+        // Listed instances keep the sync-meta info until they are opened.
+        // Opening an instance refreshes it, which loads it in the kernel
         this._loadInstanceInfo(chatInstancesObj[instance], info);
-        chatInstancesObj[instance].refresh();
         changed = true;
+      } else if (chatInstancesObj[instance].isStale(info.epoch) && this._isOpen(instance)) {
+        chatInstancesObj[instance].refresh();
       }
     }
     if (changed) {
@@ -398,69 +450,146 @@ export class NotebookCommModel {
     msg: KernelMessage.ICommMsgMsg
   ): void | PromiseLike<void> {
     try {
-      const operation = msg.content.data.operation;
-      const instance = msg.content.data.instance as string;
-      if (instance === "<meta>") {
-        if (operation === 'sync-meta') {
-          this.chatLoaders.set(msg.content.data.loaders as unknown as { [id: string]: ILoaderForm });
-          const instances = msg.content.data.instances as unknown as { [id: string]: IChatInstanceInfo };
-          this._loadInstances(instances);
+      this._receiveNewtonData(msg.content.data, msg.buffers);
+    } catch (error) {
+      throw errorHandler.report(error, '_receiveNewtonQuery', [msg]);
+    }
+  }
+
+  /**
+   * Applies a save patch to the last saved instances and returns the full snapshot.
+   * Returns null if the patch is based on a save that we do not have
+   */
+  private _applyInstancesPatch(data: JSONObject): any | null {
+    const id = data.id as number;
+    const patch = data.data as any;
+    if (data.base === null || data.base === undefined) {
+      this._savedInstances = { id, data: patch };
+      return patch;
+    }
+    const saved = this._savedInstances;
+    if (saved === null || saved.id !== data.base) {
+      this._savedInstances = null;
+      return null;
+    }
+    const snapshot = saved.data;
+    for (const name of patch['!!removed_instances']) {
+      delete snapshot.instances[name];
+    }
+    for (const [name, section] of Object.entries<any>(patch.instances)) {
+      const { history_delta: delta, ...settings } = section;
+      if (delta === undefined) {
+        snapshot.instances[name] = section;
+        continue;
+      }
+      const history: IChatMessage[] = snapshot.instances[name].history;
+      const positions = new Map(history.map((message, index) => [message.id, index]));
+      for (const message of delta.changed as IChatMessage[]) {
+        const position = positions.get(message.id);
+        if (position !== undefined) {
+          history[position] = message;
+        }
+      }
+      history.push(...delta.appended);
+      snapshot.instances[name] = { ...settings, history };
+    }
+    snapshot['!!dead_instances'].push(...patch['!!dead_instances']);
+    const sessions: string[] = snapshot['!!sessions_history'];
+    sessions[sessions.length - 1] += patch['!!session_input'];
+    saved.id = id;
+    return snapshot;
+  }
+
+  private _receiveNewtonData(data: JSONObject, buffers?: (ArrayBuffer | ArrayBufferView)[]): void {
+    const operation = data.operation;
+    const instance = data.instance as string;
+    if (instance === "<meta>") {
+      if (operation === 'batch') {
+        // The kernel coalesces the replies of a request into a single frame
+        for (const item of data.messages as unknown as JSONObject[]) {
+          this._receiveNewtonData(item);
         }
-        if (operation === 'instances') {
-          if (get(wizardMode)) {
-            const a = document.createElement('a');
-            const blob = new Blob([JSON.stringify(msg.content.data.data)], {type: 'application/json'});
-            const url = URL.createObjectURL(blob);
-            a.setAttribute('href', url);
-            a.setAttribute('download', 'instances.json');
-            a.click();
-            a.remove();
+      }
+      if (operation === 'sync-meta') {
+        this.chatLoaders.set(data.loaders as unknown as { [id: string]: ILoaderForm });
+        const instances = data.instances as unknown as { [id: string]: IChatInstanceInfo };
+        this._loadInstances(instances);
+      }
+      if (operation === 'stats') {
+        console.table(data.stats);
+      }
+      if (operation === 'instances') {
+        let blob: Blob;
+        if (data.codec !== undefined && buffers !== undefined && buffers.length > 0) {
+          // Binary codecs always send the full snapshot
+          this._savedInstances = null;
+          blob = new Blob([buffers[0]], {type: 'application/octet-stream'});
+        } else {
+          const snapshot = this._applyInstancesPatch(data);
+          if (snapshot === null) {
+            // The patch does not apply to the last save we have. Ask for a full save
+            this.sendSaveInstances(true);
+            return;
           }
+          blob = new Blob([JSON.stringify(snapshot)], {type: 'application/json'});
+        }
+        if (get(wizardMode)) {
+          const a = document.createElement('a');
+          const url = URL.createObjectURL(blob);
+          a.setAttribute('href', url);
+          a.setAttribute('download', `instances${data.extension ?? '.json'}`);
+          a.click();
+          a.remove();
         }
-        return;
       }
+      return;
+    }
 
-      const chatInstance = get(this.chatInstances)[instance];
+    const chatInstance = get(this.chatInstances)[instance];
 
-      if (chatInstance === undefined) {
-        // On some operations, the client receives an update about an instance that it does not know about yet
-        // I saw it occur on loading the history, and on starting a new client
-        // Maybe we should treat it in a different way to prevent the error, 
-        // but I'm just sending a message to the kernel to check for updates for now
-        this.sendRefreshLoaders();
-        return;
-        //throw new Error("Invalid instance " + instance);
-      }
-      if (operation === 'init' || operation === 'refresh') {
-        kernelStatus.setattr('hasKernel', true);
-        this._loadInstanceInfo(chatInstance, msg.content.data as unknown as IChatInstanceInfo);
-      } else if (operation === 'reply') {
-        kernelStatus.setattr('hasKernel', true);
-        const message: IChatMessage = msg.content.data
-          .message as unknown as IChatMessage;
-          chatInstance.push(message);
-      } else if (operation === 'update-message') {
-        kernelStatus.setattr('hasKernel', true);
-        const message: IChatMessage = msg.content.data
-          .message as unknown as IChatMessage;
-          chatInstance.updateMessage(message);
-      } else if (operation === 'update-config') {
-        const config: { [id: string]: any } = msg.content.data
-          .config as unknown as { [id: string]: any };
-        this._loadInstanceConfig(chatInstance, config)
-      } else if (operation === 'error') {
-        errorHandler.report(
-          'Failed to run ICOMM command',
-          '_receiveNewtonQuery',
-          [msg.content.data.command, msg.content.data.message]
-        );
-      } else if (operation === 'autocomplete-response') {
-        const { autoCompleteResponseId, autoCompleteItems } = chatInstance;
-        autoCompleteResponseId.set(msg.content.data.responseId as number);
-        autoCompleteItems.set(msg.content.data.items as unknown as IAutoCompleteItem[]);
-      }
-    } catch (error) {
-      throw errorHandler.report(error, '_receiveNewtonQuery', [msg]);
+    if (chatInstance === undefined) {
+      // On some operations, the client receives an update about an instance that it does not know about yet
+      // I saw it occur on loading the history, and on starting a new client
+      // Maybe we should treat it in a different way to prevent the error, 
+      // but I'm just sending a message to the kernel to check for updates for now
+      this.sendRefreshLoaders();
+      return;
+      //throw new Error("Invalid instance " + instance);
+    }
+    if (operation === 'init' || operation === 'refresh') {
+      kernelStatus.setattr('hasKernel', true);
+      this._loadInstanceInfo(chatInstance, data as unknown as IChatInstanceInfo);
+    } else if (operation === 'reply') {
+      kernelStatus.setattr('hasKernel', true);
+      const message: IChatMessage = data
+        .message as unknown as IChatMessage;
+        chatInstance.push(message);
+        chatInstance.setVersion(data.seq as number | undefined);
+    } else if (operation === 'update-message') {
+      kernelStatus.setattr('hasKernel', true);
+      const message: IChatMessage = data
+        .message as unknown as IChatMessage;
+        chatInstance.updateMessage(message);
+        chatInstance.setVersion(data.seq as number | undefined);
+    } else if (operation === 'history-page') {
+      kernelStatus.setattr('hasKernel', true);
+      const messages: IChatMessage[] = data
+        .messages as unknown as IChatMessage[];
+      chatInstance.prependPage(messages, data.start as number);
+    } else if (operation === 'update-config') {
+      const config: { [id: string]: any } = data
+        .config as unknown as { [id: string]: any };
+      this._loadInstanceConfig(chatInstance, config)
+    } else if (operation === 'error') {
+      errorHandler.report(
+        'Failed to run ICOMM command',
+        '_receiveNewtonQuery',
+        [data.command, data.message]
+      );
+    } else if (operation === 'autocomplete-response') {
+      const { autoCompleteResponseId, autoCompleteItems } = chatInstance;
+      autoCompleteResponseId.set(data.responseId as number);
+      autoCompleteItems.set(data.items as unknown as IAutoCompleteItem[]);
     }
   }
 
@@ -0,0 +1,77 @@
+"""Replies to Newton messages whose checkpoints were evicted"""
+import pytest
+
+from benchmarks.headless.stubs import create_comm, receive
+from newtonchat.comm.message import MessageContext
+
+FORGOTTEN = "I no longer remember the context of that message. Please, ask your question again"
+
+
+@pytest.fixture(name="create_newton")
+def fixture_create_newton(monkeypatch):
+    """Returns function that creates a Newton base instance with a checkpoint store"""
+    monkeypatch.setenv("NewtonCacheDir", "")
+
+    def create_newton(store):
+        monkeypatch.setenv("NewtonCheckpointStore", store)
+        comm = create_comm("newton")
+        return comm, comm.chat_instances["base"]
+    return create_newton
+
+
+def say(comm, instance, text, reply=None):
+    """Sends user message replying to a message and returns the bot replies"""
+    message = MessageContext.create_message(text, "user", reply).to_dict()
+    message["kernelProcess"] = 1
+    receive(comm, {"operation": "message", "instance": "base", "message": message})
+    history = list(instance.history)
+    position = next(i for i, item in enumerate(history) if item["id"] == message["id"])
+    return [item.to_dict() for item in history[position + 1:]]
+
+
+def conversation(comm, instance):
+    """Revisits menus after newer replies and returns the texts of the bot replies"""
+    texts = []
+    search = say(comm, instance, "naive bayes")[-1]
+    texts.append(search["text"])
+    unknown = say(comm, instance, "hi")[-1]
+    texts.append(unknown["text"])
+    subject = say(comm, instance, "1", search["id"])[-1]
+    texts.append(subject["text"])
+    texts.append(say(comm, instance, "hi")[-1]["text"])
+    texts.append(say(comm, instance, "Description", subject["id"])[-1]["text"])
+    parent = say(comm, instance, "2", search["id"])[-1]
+    texts.append(parent["text"])
+    texts.append(say(comm, instance, "hi")[-1]["text"])
+    texts.append(say(comm, instance, "1", parent["id"])[-1]["text"])
+    texts.append(say(comm, instance, "naive bayes", unknown["id"])[-1]["text"])
+    return texts
+
+
+def test_spilled_checkpoints_restore_menus(create_newton):
+    """Option lists, subject options and default state checkpoints survive spilling"""
+    comm, instance = create_newton("memory")
+    expected = conversation(comm, instance)
+    comm, instance = create_newton('sqlite?{"size": 1}')
+    assert conversation(comm, instance) == expected
+    assert instance.checkpoints.spilled_ids
+    assert FORGOTTEN not in expected
+
+
+def test_unstorable_option_is_forgotten(create_newton):
+    """Options whose states cannot be spilled reply that the context was forgotten"""
+    comm, instance = create_newton('sqlite?{"size": 1}')
+    search = say(comm, instance, "learning")[-1]
+    assert "<page 2>::bot::More..." in search["text"]
+    say(comm, instance, "hi")
+    assert search["id"] in instance.checkpoints.spilled_ids
+    assert say(comm, instance, "More...", search["id"])[-1]["text"] == FORGOTTEN
+    assert instance.checkpoints.get(search["id"]) is not None
+
+
+def test_evicted_reply_to_previous_message(create_newton):
+    """Replying to the previous message also reports an evicted checkpoint"""
+    comm, instance = create_newton('memory?{"size": 0}')
+    search = say(comm, instance, "naive bayes")[-1]
+    assert instance.checkpoints.evicted(search["id"])
+    assert say(comm, instance, "1", search["id"])[-1]["text"] == FORGOTTEN
@@ -0,0 +1,95 @@
+"""Completes subject queries from the prefix trie"""
+import pytest
+
+from newtonchat.bots.newton.handlers.completion import WORD, CompletionIndex, normalize
+from newtonchat.bots.newton.handlers.subject import SubjectHandler
+
+
+@pytest.fixture(name="graph", scope="module")
+def fixture_graph():
+    """Returns the subject graph of the data files"""
+    return SubjectHandler().graph
+
+
+def phrase_scores(index, graph):
+    """Returns the weighted phrases and words of each item, like the trie inserts them"""
+    documents = []
+    for key, node in graph.keys.items():
+        keywords = graph.keywords[node] or ''
+        if isinstance(keywords, str):
+            keywords = [keywords]
+        phrases = [
+            (key.rsplit(" > ", 1)[-1], index.name_weight),
+            *((keyword, index.keyword_weight) for keyword in keywords if keyword),
+            *((segment, index.key_weight) for segment in key.split(" > ")),
+        ]
+        terms = []
+        for phrase, weight in phrases:
+            phrase = normalize(phrase)
+            terms.append((phrase, weight + 1 / (1 + len(key))))
+            terms.extend((word, weight * index.word_factor) for word in WORD.findall(phrase))
+        documents.append(terms)
+    return documents
+
+
+def scan(index, documents, query, count):
+    """Completes query scanning every phrase of every subject"""
+    def best(prefix):
+        scores = {}
+        for position, terms in enumerate(documents):
+            weights = [weight for term, weight in terms if term.startswith(prefix)]
+            if weights:
+                scores[position] = max(weights)
+        return sorted(scores, key=lambda position: (-scores[position], position))[:index.limit]
+
+    query = normalize(query)
+    if not query:
+        return []
+    positions, required = best(query), []
+    if not positions:
+        words = WORD.findall(query)
+        if not words:
+            return []
+        positions, required = best(words[-1]), words[:-1]
+    result = []
+    for position in positions:
+        words = index.words[position]
+        if all(any(word.startswith(part) for word in words) for part in required):
+            result.append(index.items[position])
+    return result[:count]
+
+
+QUERIES = [
+    "", " ", "?", "n", "na", "naive", "Naive  Bayes", "naive bayes gauss", "bayes naive",
+    "linear", "lin reg", "regression", "supervised learning > naive", "class", "k",
+    "preprocessing", "zzz", "naive zzz", "svm", "neighbors", "tree", "decision tr",
+]
+
+
+def test_trie_matches_phrase_scan(graph):
+    """The trie returns the same items as scanning every phrase"""
+    index = CompletionIndex(graph)
+    documents = phrase_scores(index, graph)
+    for query in QUERIES:
+        for count in (1, 5, 20):
+            assert list(index.complete(query, count)) == scan(index, documents, query, count), query
+
+
+def test_items_have_the_baseline_fields(graph):
+    """Items have the fields of the autocomplete response"""
+    index = CompletionIndex(graph, description_size=40)
+    items = list(index.complete("naive", 5))
+    assert items
+    for item in items:
+        assert set(item) == {"type", "key", "value", "url"}
+        assert item["type"] == "subject"
+        assert item["key"] in graph.keys
+        assert len(item["value"]) <= 40
+
+
+def test_every_subject_completes_by_name(graph):
+    """Every alias path is returned for the full name of its subject"""
+    index = CompletionIndex(graph, limit=200)
+    for key in graph.keys:
+        name = key.rsplit(" > ", 1)[-1]
+        assert key in [item["key"] for item in index.complete(name, 200)], key
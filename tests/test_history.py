@@ -0,0 +1,177 @@
+"""Synchronizes chat histories through deltas and pages and compares history stores"""
+import os
+import random
+
+import pytest
+
+from benchmarks.headless.stubs import create_comm
+from newtonchat.comm.history import MemoryHistory, SQLiteHistory
+from newtonchat.comm.message import MessageContext
+
+STORES = ["memory", 'sqlite?{"window": 3}']
+
+
+@pytest.fixture(name="instance", params=STORES)
+def fixture_instance(request, monkeypatch):
+    """Returns dummy base instance with the history store"""
+    monkeypatch.setenv("NewtonHistoryStore", request.param)
+    comm = create_comm("dummy")
+    instance = comm.chat_instances["base"]
+    instance.config["history_page_size"] = 10 ** 6
+    return comm, instance
+
+
+class Client:
+    """Keeps the history of the frontend and applies refresh frames"""
+
+    def __init__(self):
+        self.messages = []
+        self.since = None
+        self.epoch = None
+        self.full_syncs = 0
+
+    def refresh(self, comm, instance):
+        """Requests refresh with the client version and applies the frame"""
+        instance.refresh(self.since, self.epoch)
+        frame = comm.comm.last[0]
+        if "delta" in frame:
+            positions = {message["id"]: pos for pos, message in enumerate(self.messages)}
+            for message in frame["delta"]["changed"]:
+                self.messages[positions[message["id"]]] = message
+            self.messages.extend(frame["delta"]["appended"])
+        else:
+            self.full_syncs += 1
+            self.messages = frame["history"]
+        self.since, self.epoch = frame["seq"], frame["epoch"]
+        return frame
+
+
+def full_history(instance):
+    """Returns the history that the baseline refresh sent"""
+    return [message.to_dict() for message in instance.history]
+
+
+def test_random_changes_sync_through_deltas(instance):
+    """Clients that apply deltas have the same history as a full refresh"""
+    comm, instance = instance
+    rng = random.Random(0)
+    client = Client()
+    client.refresh(comm, instance)
+    stale = Client()
+    for step in range(300):
+        action = rng.random()
+        if action < 0.5:
+            instance.reply_message(MessageContext.create_message(f"message {step}", "bot"))
+        elif action < 0.85 and len(instance.history):
+            message = instance.history[rng.randrange(len(instance.history))]
+            message["text"] = f"edited {step}"
+            message.feedback["rate"] = step
+            instance.update_message(message)
+        elif action < 0.87:
+            instance.reset_history(full_history(instance)[-rng.randrange(1, 20):])
+        if rng.random() < 0.2:
+            client.refresh(comm, instance)
+            assert client.messages == full_history(instance)
+        if rng.random() < 0.02:
+            stale.refresh(comm, instance)
+            assert stale.messages == full_history(instance)
+    client.refresh(comm, instance)
+    assert client.messages == full_history(instance)
+    assert 1 < client.full_syncs < 10
+
+
+def test_divergent_client_gets_full_history(instance):
+    """Unknown epochs and versions ahead of the history get the full history"""
+    comm, instance = instance
+    instance.reply_message(MessageContext.create_message("hello", "bot"))
+    assert instance.history_delta(instance.seq, "other") is None
+    assert instance.history_delta(instance.seq + 1, instance.epoch) is None
+    assert instance.history_delta(None, instance.epoch) is None
+    assert instance.history_delta(instance.seq, instance.epoch) == {"changed": [], "appended": []}
+    frame = Client().refresh(comm, instance)
+    assert frame["history"] == full_history(instance)
+
+
+def test_history_page_matches_history_slices(instance):
+    """Pages are the newest first slices of the full history around the cursor"""
+    _, instance = instance
+    for number in range(40):
+        instance.reply_message(MessageContext.create_message(f"message {number}", "bot"))
+    history = full_history(instance)
+    total = len(history)
+    cursors = [None, history[0]["id"], history[-1]["id"], history[17]["id"]]
+    for cursor in cursors:
+        position = total - 1 if cursor is None else next(
+            pos for pos, message in enumerate(history) if message["id"] == cursor
+        )
+        for before, after in [(0, 0), (5, 0), (5, 5), (100, 100), (3, 1)]:
+            page = instance.history_page(cursor, before, after)
+            start = max(position - before, 0)
+            end = min(position + after + 1, total)
+            assert (page["start"], page["end"], page["history_total"]) == (start, end, total)
+            assert page["messages"] == history[start:end][::-1]
+    with pytest.raises(KeyError):
+        instance.history_page("missing", 5)
+
+
+def stores_with_random_history(window, seed=0):
+    """Applies the same appends and changes to a memory and a sqlite store"""
+    rng = random.Random(seed)
+    memory, sqlite = MemoryHistory(), SQLiteHistory(window=window)
+    seq = 0
+    ids = []
+    for step in range(200):
+        seq += 1
+        if rng.random() < 0.6 or not ids:
+            message = MessageContext.create_message(f"message {step}", "user")
+            ids.append(message["id"])
+            memory.append(message, seq)
+            sqlite.append(message.copy(), seq)
+        else:
+            message_id = rng.choice(ids)
+            for store in (memory, sqlite):
+                message = store.find(message_id)
+                message["text"] = f"edited {step}"
+                message.alternatives = [f"alternative {step}"]
+                store.touch(message, seq)
+    return memory, sqlite, ids, seq
+
+
+def dicts(messages):
+    """Converts messages to wire dicts"""
+    return [message.to_dict() for message in messages]
+
+
+@pytest.mark.parametrize("window", [1, 3, 500])
+def test_sqlite_history_matches_memory_history(window):
+    """Reads over evicted rows return the same messages as the memory store"""
+    memory, sqlite, ids, seq = stores_with_random_history(window)
+    assert len(sqlite) == len(memory)
+    assert len(sqlite.resident()) == min(window, len(memory))
+    assert dicts(sqlite) == dicts(memory)
+    for start, stop in [(0, 10), (5, 6), (50, 120), (-10, None), (None, None), (3, 2)]:
+        assert dicts(sqlite[start:stop]) == dicts(memory[start:stop])
+    assert dicts(sqlite[::7]) == dicts(memory[::7])
+    for position in [0, 1, len(memory) - 1, -1, -len(memory)]:
+        assert sqlite[position].to_dict() == memory[position].to_dict()
+    for message_id in ids[::5]:
+        assert sqlite.position(message_id) == memory.position(message_id)
+        assert sqlite.find(message_id).to_dict() == memory.find(message_id).to_dict()
+    for since in range(0, seq + 2, 9):
+        assert sqlite.count_until(since) == memory.count_until(since)
+        assert dicts(sqlite.changed_since(since)) == dicts(memory.changed_since(since))
+    with pytest.raises(IndexError):
+        sqlite[len(memory)]  # pylint: disable=pointless-statement
+    with pytest.raises(KeyError):
+        sqlite.find("missing")
+    sqlite.close()
+
+
+def test_sqlite_history_removes_database():
+    """Closing the store removes its database file"""
+    store = SQLiteHistory(window=2)
+    store.append(MessageContext.create_message("hello", "user"), 1)
+    assert os.path.exists(store.path)
+    assert store.disk_size() > 0
+    store.close()
+    assert not os.path.exists(store.path)
@@ -0,0 +1,41 @@
+"""Converts compact chat messages to wire dicts"""
+from newtonchat.comm.message import ChatMessage, MessageContext
+
+
+def create_message():
+    """Returns message with feedback and alternatives"""
+    message = MessageContext.create_message(["first", "second"], "bot")
+    message.feedback["rate"] = 1
+    return message
+
+
+def test_round_trip():
+    """from_dict restores the wire dict created by to_dict"""
+    message = create_message()
+    message["custom"] = {"value": 1}
+    data = message.to_dict()
+    assert data["alternatives"] == ["first", "second"]
+    assert data["feedback"] == {"rate": 1, "reason": "", "otherreason": ""}
+    assert ChatMessage.from_dict(data).to_dict() == data
+
+
+def test_to_dict_does_not_alias_message():
+    """Changing the wire dict does not change the message"""
+    message = create_message()
+    data = message.to_dict()
+    data["alternatives"].append("third")
+    data["feedback"]["rate"] = 5
+    assert message.alternatives == ["first", "second"]
+    assert message.feedback["rate"] == 1
+    assert message.to_dict() != data
+
+
+def test_share_copies_on_write():
+    """Shared messages copy containers on their first write"""
+    message = create_message()
+    shared = message.share()
+    shared.alternatives.append("third")
+    shared.feedback["rate"] = 2
+    assert message.to_dict()["alternatives"] == ["first", "second"]
+    assert message.to_dict()["feedback"]["rate"] == 1
+    assert shared.to_dict()["alternatives"] == ["first", "second", "third"]
@@ -0,0 +1,117 @@
+"""Paginates options from a cursor over lazily pulled items"""
+import pytest
+
+from newtonchat.bots.newton.pagination import LazySequence, PageState, pagination
+
+
+class OptionsContext:
+    """Records the options replied by show_options"""
+
+    def __init__(self):
+        self.replies = []
+
+    def reply_options(self, options, ordered=True, full=False, checkpoint=None, text=None):
+        """Records options, text and checkpoint"""
+        # pylint: disable=unused-argument, too-many-arguments
+        self.replies.append((options, text, checkpoint))
+
+
+class CountingRange:
+    """Iterable of numbers that counts how many were pulled"""
+
+    def __init__(self, size):
+        self.size = size
+        self.pulled = 0
+
+    def __iter__(self):
+        for number in range(self.size):
+            self.pulled += 1
+            yield number
+
+
+def option(number):
+    """Converts number to option"""
+    return {'key': f"item {number}", 'label': f"Item {number}", 'state': None}
+
+
+def baseline_pages(size, count):
+    """Splits numbers into pages like the recursive pagination that built every page.
+    The last page takes the item that would be alone in the next page"""
+    pages = []
+    numbers = list(range(size))
+    while len(numbers) > count + 1:
+        pages.append(numbers[:count])
+        numbers = numbers[count:]
+    pages.append(numbers)
+    return pages
+
+
+def walk(items, count=5):
+    """Follows More... options and returns the labels and status of each page"""
+    context = OptionsContext()
+    pagination(context, items, count=count, text="Results", option=option)
+    pages = []
+    while True:
+        options, text, _ = context.replies[-1]
+        more = options[-1] if options and options[-1]['label'] == "More..." else None
+        labels = [item['label'] for item in options if item is not more]
+        pages.append((labels, text))
+        if more is None:
+            return pages
+        assert more['state'](context) is True
+
+
+@pytest.mark.parametrize("size", range(0, 18))
+@pytest.mark.parametrize("source", [list, iter, CountingRange])
+def test_pages_match_baseline(size, source):
+    """Pages have the same items, numbering and status as the baseline pagination"""
+    count = 5
+    pages = walk(source(range(size)) if source is not CountingRange else source(size), count)
+    expected = baseline_pages(size, count)
+    assert [labels for labels, _ in pages] == [
+        [f"{number + 1}. Item {number}" for number in page] for page in expected
+    ]
+    for position, (page, (_, text)) in enumerate(zip(expected, pages)):
+        status = f"Showing {page[0] + 1}..{page[-1] + 1} (page {position + 1})" if page else ""
+        if position == 0:
+            assert text == ("Results\n" + status if len(expected) > 1 else "Results")
+        else:
+            assert text == status
+
+
+def test_items_are_pulled_per_page():
+    """Only the items of the shown page and the look-ahead are pulled"""
+    items = CountingRange(100)
+    context = OptionsContext()
+    pagination(context, items, count=5, option=option)
+    assert items.pulled == 7
+
+
+@pytest.mark.parametrize("restartable", [True, False])
+def test_revisiting_previous_page(restartable):
+    """Earlier pages can be shown again after later pages"""
+    items = CountingRange(40)
+    lazy = LazySequence(items if restartable else iter(items))
+    first = PageState(lazy, 0, 5, True, option)
+    third = PageState(lazy, 10, 5, True, option)
+    labels = [item['label'] for item in first.page()[0]]
+    third.page()
+    assert [item['label'] for item in first.page()[0]] == labels
+    assert labels == [f"{number + 1}. Item {number}" for number in range(5)] + ["More..."]
+    if restartable:
+        assert len(lazy.buffer) == 7
+    else:
+        assert len(lazy.buffer) == 17
+
+
+def test_window_moves_with_the_cursor():
+    """A restartable iterable keeps only the items from the last page start"""
+    lazy = LazySequence(CountingRange(100))
+    for start in range(0, 90, 5):
+        assert lazy[start:start + 7] == list(range(start, start + 7))
+        assert lazy.offset == start
+        assert len(lazy.buffer) == 7
+    assert lazy[95:102] == list(range(95, 100))
+    assert lazy[2:4] == [2, 3]
+    assert lazy[50:57] == list(range(50, 57))
+    assert lazy.buffer == list(range(50, 57))
@@ -0,0 +1,70 @@
+"""Routes texts through the n-gram prefiltered regex router"""
+import re
+
+import pytest
+
+from benchmarks.regex_router import create_rules, create_texts, linear, routed
+from newtonchat.bots.newton.handlers import router as router_module
+from newtonchat.bots.newton.handlers.router import RegexRouter, required_literal
+
+
+@pytest.fixture(name="rules", scope="module")
+def fixture_rules():
+    """Returns the rules of regexes.json followed by synthetic rules"""
+    return create_rules(400)
+
+
+@pytest.fixture(name="texts", scope="module")
+def fixture_texts(rules):
+    """Returns texts that match random rules, texts that match none and rule literals"""
+    texts = create_texts(rules, 800)
+    texts.extend(literal for literal in map(required_literal, map(re.compile, (
+        rule["regex"] for rule in rules
+    ))) if literal)
+    texts.extend(["", "a", "ab", "tokenize", "TOKENIZE TEXT FROM DF"])
+    return texts
+
+
+@pytest.mark.parametrize("regex, literal", [
+    (r"tokenize (.*) from (.*)", "tokenize "),
+    (r"(\w+) column12$", " column12"),
+    (r"(?i)tokenize (.*)", ""),
+    (r"tokenize|split", ""),
+    (r"(tokenize)", ""),
+    (r"a+b", "b"),
+])
+def test_required_literal(regex, literal):
+    """The required literal is the longest top-level literal"""
+    assert required_literal(re.compile(regex)) == literal
+
+
+def test_router_matches_linear_scan(rules, texts):
+    """The router selects the same rule and params as re.search over all patterns"""
+    router = RegexRouter(rules)
+    assert len(router.always) < len(rules)
+    matched = 0
+    for text in texts:
+        expected = linear(rules, text)
+        assert routed(router, text) == expected, text
+        matched += expected is not None
+    assert matched > len(texts) // 4
+
+
+class BrokenParser:
+    """Regex parser of an incompatible Python version"""
+    LITERAL = object()
+
+    @staticmethod
+    def parse(pattern, flags=0):
+        """Fails to parse"""
+        raise TypeError(f"Unsupported pattern {pattern!r} {flags}")
+
+
+@pytest.mark.parametrize("parser", [BrokenParser, None])
+def test_parser_failure_scans_every_rule(monkeypatch, rules, texts, parser):
+    """Rules are evaluated for every text if the regex parser is unavailable"""
+    monkeypatch.setattr(router_module, "sre_parse", parser)
+    router = RegexRouter(rules)
+    assert router.always == list(range(len(rules)))
+    for text in texts[:300]:
+        assert routed(router, text) == linear(rules, text), text
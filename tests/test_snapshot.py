@@ -0,0 +1,138 @@
+"""Loads saved instance snapshots"""
+import json
+
+import pytest
+
+from benchmarks.headless.stubs import create_comm
+from newtonchat.comm.chat_instance import ChatInstance, InstanceStub
+from newtonchat.comm.message import MessageContext
+from newtonchat.comm.snapshot import BinaryCodec, JSONCodec, Snapshot, apply_arg
+
+
+def saved_instance(mode, texts=("hello",)):
+    """Returns saved instance data with a user message for each text"""
+    data = {
+        "config": {"enable_autocomplete": False},
+        "history": [MessageContext.create_message(text, "user").to_dict() for text in texts],
+    }
+    if mode is not None:
+        data["mode"] = mode
+    return data
+
+
+def snapshot_data():
+    """Returns snapshot with a valid instance and instances with bad modes"""
+    return {
+        "!!dead_instances": [],
+        "!!sessions_history": [],
+        "instances": {
+            "base": saved_instance("dummy"),
+            "other": saved_instance("dummy", ("a", "b")),
+            "unknown": saved_instance("nope"),
+            "missing": saved_instance(None),
+        },
+    }
+
+
+SNAPSHOTS = {
+    "data": lambda data: data,
+    "json": lambda data: Snapshot.from_bytes(JSONCodec().encode(data)),
+    "binary": lambda data: Snapshot.from_bytes(BinaryCodec().encode(data)),
+}
+
+
+@pytest.mark.parametrize("source", SNAPSHOTS)
+def test_bad_modes_become_dead_instances(source):
+    """Unknown and missing modes are moved to dead instances and sync_meta keeps working"""
+    comm = create_comm("dummy")
+    comm.load_instances(SNAPSHOTS[source](snapshot_data()))
+
+    assert set(comm.chat_instances) == {"base", "other"}
+    assert isinstance(comm.chat_instances["base"], ChatInstance)
+    assert isinstance(comm.chat_instances["other"], InstanceStub)
+    assert [instance.get("mode") for instance in comm.dead_instances] == ["nope", None]
+    assert comm.dead_instances[0]["history"][0]["text"] == "hello"
+
+    comm.sync_meta()
+    frame = comm.comm.last[0]
+    assert frame["operation"] == "sync-meta"
+    assert set(frame["instances"]) == {"base", "other"}
+    assert frame["instances"]["other"]["history_total"] == 2
+
+
+def tricky_snapshot():
+    """Returns snapshot whose strings contain brackets, quotes and escapes"""
+    shared = "Shared reply that is replicated to every instance of the chat"
+    history = [
+        MessageContext.create_message(text, "user").to_dict() for text in [
+            'brackets } ] { [ inside', 'quote " and \\" escape', "unicode é ✓ \\u00e9", shared,
+        ]
+    ]
+    history.append({**MessageContext.create_message([shared, "other " * 10], "bot").to_dict(),
+                    "extra": {"nested": [1, {"a": "}"}]}})
+    history.append({"id": "partial", "text": "message without all keys"})
+    return {
+        "!!dead_instances": [{"mode": "nope", "history": []}],
+        "!!sessions_history": ["   1: print('[{')\n"],
+        "settings": {"nested": {"list": [1, 2, {"mode": "not an instance"}]}},
+        "instances": {
+            "base": {"mode": "newton", "config": {"a": "]"}, "history": history, "bot": {}},
+            'name "quoted" [x]': {"mode": "dummy", "history": history[:2]},
+            "empty": {"mode": "gpt", "history": []},
+            "no history": {"config": {"mode": "config mode"}, "mode": "chatgpt"},
+        },
+    }
+
+
+def test_scanner_matches_json_loads():
+    """The scanned snapshot decodes to the same data as json.loads"""
+    data = tricky_snapshot()
+    text = json.dumps(data)
+    snapshot = Snapshot.from_text(text)
+    for name, instance in data["instances"].items():
+        saved = snapshot.instances[name]
+        assert saved.mode == instance["mode"]
+        assert saved.config == instance.get("config", {})
+        assert saved.message_count == len(instance.get("history", []))
+        assert saved._data is None  # pylint: disable=protected-access
+    assert snapshot.get("settings") == data["settings"]
+    assert snapshot.to_data() == json.loads(text)
+    assert Snapshot.from_text(json.dumps(data, indent=2)).to_data() == data
+
+
+@pytest.mark.parametrize("text", [
+    '{"instances": {}, "version": 1}',
+    '{"version": 1, "instances": {"base": {"mode": "dummy"}}}',
+    '{"instances": {"base": {"mode": "newton", "history": []}}, "x": "{"}',
+    '{}',
+])
+def test_scanner_keeps_every_section(text):
+    """Snapshots with scalar sections are decoded entirely"""
+    assert Snapshot.from_text(text).to_data() == {"instances": {}, **json.loads(text)}
+
+
+@pytest.mark.parametrize("level", [0, 6, 9])
+def test_binary_codec_round_trip(level):
+    """Binary snapshots decode to the encoded data"""
+    data = tricky_snapshot()
+    codec = BinaryCodec(level=level)
+    raw = codec.encode(data)
+    assert raw.startswith(BinaryCodec.magic)
+    snapshot = Snapshot.from_bytes(raw)
+    assert snapshot.instances["base"].message_count == len(data["instances"]["base"]["history"])
+    assert snapshot.to_data() == json.loads(json.dumps(data))
+    assert len(raw) < len(JSONCodec().encode(data)) or level == 0
+
+
+def test_overrides_match_apply_arg():
+    """Instance overrides are applied like apply_arg on the decoded data"""
+    data = tricky_snapshot()
+    snapshot = Snapshot.from_bytes(JSONCodec().encode(data))
+    snapshot.apply_arg("instances.base.config.a", "changed")
+    snapshot.apply_arg("instances.empty", {"mode": "dummy", "history": []})
+    snapshot.apply_arg("settings.nested.value", 2)
+    apply_arg(data, "instances.base.config.a", "changed")
+    apply_arg(data, "instances.empty", {"mode": "dummy", "history": []})
+    apply_arg(data, "settings.nested.value", 2)
+    assert snapshot.instances["empty"].mode == "dummy"
+    assert snapshot.to_data() == data
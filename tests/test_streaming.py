@@ -0,0 +1,190 @@
+"""Streams GPT and ChatGPT replies from the local fake OpenAI endpoint.
+The endpoint also sends the role chunk with null content and the empty finish chunk"""
+import asyncio
+import json
+import threading
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from benchmarks.fake_openai import TEXT, FakeOpenAIHandler
+from benchmarks.headless.stubs import HeadlessKernelComm, StubComm, StubShell, receive
+from newtonchat.bots.chatgpt import ChatGPTBot
+from newtonchat.bots.gpt import GPTBot
+from newtonchat.comm.message import MessageContext
+
+BOTS = {"chatgpt": ChatGPTBot, "gpt": GPTBot}
+STREAMED_TEXTS = {"chatgpt": "####markdown#:\n" + TEXT, "gpt": TEXT}
+
+
+def final_text(mode, text):
+    """Returns the reply text without the ChatGPT metadata. Checks the metadata"""
+    if mode == "chatgpt":
+        text, metadata = text.split("\n####metadata#:")
+        assert json.loads(metadata)["tokens"] > 0
+    return text
+
+
+class QuietHandler(FakeOpenAIHandler):
+    """Fake endpoint that does not log requests"""
+    delay = 0.0
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Ignores request logs"""
+
+
+class QuietServer(ThreadingHTTPServer):
+    """Fake server that ignores clients that disconnect while streaming"""
+
+    def handle_error(self, request, client_address):
+        """Ignores broken connections"""
+
+
+class RecordingComm(StubComm):
+    """Stub comm that keeps every operation, unwrapping batches"""
+
+    def __init__(self, target_name=None, **kwargs):
+        super().__init__(target_name, **kwargs)
+        self.operations = []
+
+    def send(self, data=None, buffers=None):
+        super().send(data, buffers)
+        if data.get("operation") == "batch":
+            self.operations.extend(data["messages"])
+        else:
+            self.operations.append(data)
+
+
+class RecordingKernelComm(HeadlessKernelComm):
+    """KernelComm that records the operations sent to the client"""
+    comm_class = RecordingComm
+
+
+@pytest.fixture(name="api_base")
+def fixture_api_base():
+    """Serves the fake endpoint on a free port"""
+    server = QuietServer(("127.0.0.1", 0), QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(name="handler")
+def fixture_handler():
+    """Returns the fake endpoint handler and restores its delay between streamed words"""
+    yield QuietHandler
+    QuietHandler.delay = 0.0
+
+
+def create_instance(api_base, mode):
+    """Creates comm with a streaming instance of the bot"""
+    comm = RecordingKernelComm(StubShell(), "newton")
+    comm.register()
+    data = {key: options["value"] for key, (_, options) in BOTS[mode].config().items()}
+    data.update({"api_key": "test", "api_base": api_base, "stream_interval": 0, "max_tokens": 50})
+    receive(comm, {
+        "operation": "new-instance", "instance": "<meta>",
+        "name": mode, "mode": mode, "data": data,
+    })
+    comm.comm.operations.clear()
+    return comm, comm.chat_instances[mode]
+
+
+def send(comm, instance, text):
+    """Sends user message to the instance"""
+    message = MessageContext.create_message(text, "user").to_dict()
+    message["kernelProcess"] = 1
+    receive(comm, {"operation": "message", "instance": instance.chat_name, "message": message})
+    return message
+
+
+def streamed(comm, reply_to):
+    """Returns the placeholder reply and the updates of the bot reply to a message"""
+    placeholder = next(
+        operation["message"] for operation in comm.comm.operations
+        if operation["operation"] == "reply" and operation["message"]["reply"] == reply_to
+    )
+    updates = [
+        operation["message"] for operation in comm.comm.operations
+        if operation["operation"] == "update-message"
+        and operation["message"]["id"] == placeholder["id"]
+    ]
+    return placeholder, updates
+
+
+def test_endpoint_sends_chunks_without_content(api_base):
+    """The chat stream starts with null content and ends with an empty delta"""
+    request = urllib.request.Request(
+        api_base + "/chat/completions",
+        data=json.dumps({"stream": True, "messages": []}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request) as response:
+        events = [
+            json.loads(line[6:]) for line in response.read().decode("utf-8").splitlines()
+            if line.startswith("data: {")
+        ]
+    deltas = [event["choices"][0]["delta"] for event in events]
+    assert deltas[0] == {"role": "assistant", "content": None}
+    assert deltas[-1] == {}
+
+
+@pytest.mark.parametrize("mode", ["chatgpt", "gpt"])
+def test_streams_chunks_into_placeholder(api_base, mode):
+    """The placeholder is sent loading, grows with each chunk and ends with the final text"""
+    comm, instance = create_instance(api_base, mode)
+    message = send(comm, instance, "hello")
+
+    placeholder, updates = streamed(comm, message["id"])
+    assert placeholder["loading"] is True
+    assert placeholder["text"] == ""
+    partial = [update["text"] for update in updates if update["loading"]]
+    assert len(partial) > 1
+    for previous, current in zip(partial, partial[1:]):
+        assert current.startswith(previous) and len(current) > len(previous)
+    assert STREAMED_TEXTS[mode].startswith(partial[-1])
+
+    final = updates[-1]
+    assert final["loading"] is False
+    assert final_text(mode, final["text"]) == STREAMED_TEXTS[mode]
+    stored = instance.find_message(placeholder["id"]).to_dict()
+    assert stored == final
+    assert stored["type"] == "bot"
+    assert instance.history[-1]["id"] == placeholder["id"]
+    if mode == "chatgpt":
+        assert stored["inConversationContext"] is True
+
+
+def test_cancelled_stream_releases_placeholder(api_base, handler):
+    """Cancelling the worker keeps the partial text and later messages are still answered"""
+    comm, instance = create_instance(api_base, "chatgpt")
+    handler.delay = 0.05
+
+    async def cancel_while_streaming():
+        message = send(comm, instance, "hello")
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if streamed(comm, message["id"])[1]:
+                break
+        worker = instance.bot_worker
+        worker.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await worker
+        return message
+
+    message = asyncio.run(cancel_while_streaming())
+    placeholder, updates = streamed(comm, message["id"])
+    stored = instance.find_message(placeholder["id"]).to_dict()
+    assert updates[-1]["loading"] is False
+    assert stored["loading"] is False
+    assert stored["text"] != STREAMED_TEXTS["chatgpt"]
+    assert STREAMED_TEXTS["chatgpt"].startswith(stored["text"])
+    assert instance.bot_worker is None
+
+    handler.delay = 0.0
+    message = send(comm, instance, "again")
+    _, updates = streamed(comm, message["id"])
+    assert final_text("chatgpt", updates[-1]["text"]) == STREAMED_TEXTS["chatgpt"]